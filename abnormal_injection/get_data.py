@@ -3,6 +3,7 @@ import xml.etree.ElementTree as ET
 import json
 from collections import defaultdict
 
+from abnormal_injection.net_index import load_net_index
 from files_path.file_path import emulation_path, data_path
 
 
@@ -25,44 +26,24 @@ def parse_detectors(add_file):
 
 def parse_tl_logics(net_file):
     """解析交通信号灯配置"""
-    tree = ET.parse(net_file)
-    root = tree.getroot()
+    return load_net_index(net_file).tl_logics()
 
-    tl_logics = {}
-    for tl in root.findall('.//tlLogic'):
-        tl_id = tl.get('id')
-        phases = []
-        for phase in tl.findall('phase'):
-            phase_data = {
-                'duration': float(phase.get('duration')),
-                'state': phase.get('state'),
-                'minDur': float(phase.get('minDur')) if phase.get('minDur') else None,
-                'maxDur': float(phase.get('maxDur')) if phase.get('maxDur') else None
-            }
-            phases.append(phase_data)
-        tl_logics[tl_id] = {
-            'type': tl.get('type'),
-            'programID': tl.get('programID'),
-            'offset': float(tl.get('offset')),
-            'phases': phases
-        }
-    return tl_logics
+
+def parse_edge_graph(net_file):
+    """解析路网的道路连接关系，返回车道ID到道路ID的映射与道路的下游道路集合（忽略交叉口内部道路）"""
+    index = load_net_index(net_file)
+    return index.lane_to_edge(), index.edge_successors()
 
 
 def find_valid_junctions(net_file, all_lanes):
     """查找有效交叉口"""
-    tree = ET.parse(net_file)
-    root = tree.getroot()
+    index = load_net_index(net_file)
 
     valid_junctions = {}
 
-    for junction in root.findall('.//junction'):
-        jid = junction.get('id')
-        # 只处理信号灯控制的交叉口
-        if junction.get('type') != 'traffic_light':
-            continue
-
-        inc_lanes = junction.get('incLanes', '').split()
+    # 只处理信号灯控制的交叉口
+    for jid in index.junctions('traffic_light'):
+        inc_lanes = index.incoming_lanes(jid)
         if inc_lanes and all(lane in all_lanes for lane in inc_lanes):
             valid_junctions[jid] = inc_lanes
 
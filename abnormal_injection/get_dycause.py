@@ -1,11 +1,20 @@
 import os
-import xml.etree.ElementTree as ET
-import pandas as pd
 import json
 import numpy as np
 from collections import defaultdict
-from scipy.signal import savgol_filter
-from scipy.stats import median_abs_deviation
+from data_processing.detector_frame import DetectorFrame
+from data_processing.e1_reader import write_intervals
+from data_processing.exporters import EXPORT_FORMATS, dycause_matrix, export_matrix, select_rows
+from data_processing.parse_cache import default_cache, load_intervals
+from data_processing.smoothing import frame_to_records, smooth_frame
+from edpf.batch import detect_many
+from edpf.cascade import cascade_scores
+from edpf.model_store import MappedModel, binary_model_source, save_binary_model
+from edpf.rolling import RollingMedian
+from edpf.runner import BatchManifest, atomic_path, run_batch
+from edpf.scoring import build_param_array, score_aligned
+from edpf.series import load_detector_series
+from edpf.training import collect_shards, fit_phase_params, params_to_dict
 from tqdm import tqdm
 from pathlib import Path
 from files_path.file_path import data_path, screen_path
@@ -16,23 +25,35 @@ smoothed_path = os.path.join(data_path, "smoothed_output\\")
 anomaly_path = os.path.join(data_path, "anomaly_results\\")
 dycause_path = os.path.join(data_path, "dycause_outputs\\")
 model_path = os.path.join(screen_path, "enhanced_model.json")
+binary_model_path = os.path.join(screen_path, "enhanced_model.npy")
+manifest_path = os.path.join(data_path, "dycause_manifest.json")
 
 INPUT_DIR = data_paths  # 原始XML文件目录
 SMOOTHED_DIR = smoothed_path  # 平滑后XML保存目录
 ANOMALY_DIR = anomaly_path  # 异常检测结果保存目录
 EXCEL_DIR = dycause_path  # Excel输出目录
 MODEL_PATH = model_path  # 预训练模型路径
+BINARY_MODEL_PATH = binary_model_path  # 内存映射二进制模型路径（优先使用）
+MANIFEST_PATH = manifest_path  # 批处理清单（输入哈希、参数与输出文件）
 
 # 处理参数
 WINDOW_SIZE = 19     # 平滑窗口大小（必须为奇数）
 POLY_ORDER = 3       # 多项式阶数
+WRITE_SMOOTHED_XML = False  # 是否另存平滑后的XML（Excel 直接使用内存中的平滑结果）
+EXPORT_FORMAT = 'xlsx'  # DyCause 输入的导出格式：'xlsx'（只写模式流式写出）、'csv'、'npz'、'parquet'
 PHASE_LENGTH = 90    # 信号周期长度
 TIME_WINDOW = 30     # 时间窗口大小
 TOP_K = 160          # 显示前K个异常检测器
+BATCH_WORKERS = os.cpu_count() or 1  # 批量处理场景文件的进程数
 
 
 # ====================== 工具类 ======================
 class TrafficProcessor:
+    # 处理阶段及其依赖：Excel 由异常检测结果与内存中的平滑结果生成，平滑后的XML仅在需要时另存
+    STAGES = ('detect', 'smooth', 'excel')
+    STAGE_DEPENDS = {'excel': ('detect',)}
+    SMOOTH_FEATURES = ['flow', 'occupancy', 'speed']
+
     def __init__(self):
         self.detector = EnhancedTrafficAnomalyDetector(
             phase_length=PHASE_LENGTH,
@@ -40,13 +61,46 @@ class TrafficProcessor:
             top_k=TOP_K,
             verbose=False
         )
-        if os.path.exists(MODEL_PATH):
-            self.detector.load_model(MODEL_PATH)
-        else:
-            raise FileNotFoundError("未找到预训练模型")
+        self._refresh_binary_model()
+        self.detector.load_model(BINARY_MODEL_PATH)
+
+    def _refresh_binary_model(self):
+        """JSON 模型转换为二进制格式后内存映射加载；JSON 模型内容变化（如重新训练）后重新转换"""
+        if not os.path.exists(MODEL_PATH):
+            if not os.path.exists(BINARY_MODEL_PATH):
+                raise FileNotFoundError("未找到预训练模型")
+            return
+        digest = default_cache().digest(MODEL_PATH)
+        if os.path.exists(BINARY_MODEL_PATH) and binary_model_source(BINARY_MODEL_PATH) == digest:
+            return
+        if os.path.exists(BINARY_MODEL_PATH):
+            print(f"JSON 模型已更新，重新生成二进制模型: {BINARY_MODEL_PATH}")
+        self.detector.load_model(MODEL_PATH)
+        save_binary_model(BINARY_MODEL_PATH, self.detector.normal_params, self.detector.phase_length,
+                          self.detector.features, source_digest=digest)
+
+    @staticmethod
+    def _anomaly_json_path(input_path):
+        return os.path.join(ANOMALY_DIR, f"{Path(input_path).stem}_anomaly.json")
+
+    def stage_params(self):
+        """各处理阶段的参数；参数变化时该阶段及依赖它的阶段需要重新计算"""
+        detect = {
+            'phase_length': PHASE_LENGTH,
+            'time_window': TIME_WINDOW,
+            'top_k': TOP_K,
+            'model': default_cache().digest(BINARY_MODEL_PATH),
+        }
+        smooth = {'window_size': WINDOW_SIZE, 'poly_order': POLY_ORDER}
+        return {'detect': detect,
+                'smooth': dict(smooth, write_xml=WRITE_SMOOTHED_XML),
+                'excel': dict(detect, export_format=EXPORT_FORMAT, **smooth)}
 
-    def process_single_file(self, input_path):
-        """处理单个XML文件的完整流程"""
+    def process_single_file(self, input_path, stages=STAGES):
+        """处理单个XML文件的完整流程，只执行 stages 中的阶段
+
+        所有输出先写入临时文件再原子替换，返回 {阶段: [输出文件]}，出错时返回 None。
+        """
         try:
             # 创建输出目录
             os.makedirs(SMOOTHED_DIR, exist_ok=True)
@@ -56,192 +110,144 @@ class TrafficProcessor:
             # 生成基础文件名
             base_name = os.path.basename(input_path)
             file_stem = Path(base_name).stem
+            outputs = {}
 
             # 步骤1: 异常检测生成JSON
-            json_path = os.path.join(ANOMALY_DIR, f"{file_stem}_anomaly.json")
-            if not os.path.exists(json_path):
-                self.detector.detect_anomalies(input_path, json_path)
-
-            # 步骤2: 数据平滑处理
-            smoothed_path = os.path.join(SMOOTHED_DIR, f"{file_stem}_smoothed.xml")
-            if not os.path.exists(smoothed_path):
-                self._smooth_xml(input_path, smoothed_path)
-
-            # 步骤3: 生成两种Excel文件
-            for use_filter in [True, False]:
-                suffix = "filtered" if use_filter else "unfiltered"
-                excel_path = os.path.join(EXCEL_DIR, f"{file_stem}_{suffix}.xlsx")
-                self._generate_excel(smoothed_path, json_path, excel_path, use_filter)
-
-            return True
+            json_path = self._anomaly_json_path(input_path)
+            if 'detect' in stages:
+                with atomic_path(json_path) as temp_path:
+                    self.detector.detect_anomalies(input_path, temp_path)
+                outputs['detect'] = [json_path]
+
+            # 步骤2: 按检测器平滑，结果直接交给下一步（WRITE_SMOOTHED_XML 时另存为XML）
+            smoothed = None
+            if 'smooth' in stages:
+                outputs['smooth'] = []
+                if WRITE_SMOOTHED_XML:
+                    smoothed = self._smooth_frame(input_path)
+                    smoothed_path = os.path.join(SMOOTHED_DIR, f"{file_stem}_smoothed.xml")
+                    with atomic_path(smoothed_path) as temp_path:
+                        self._write_smoothed_xml(input_path, smoothed, temp_path)
+                    outputs['smooth'].append(smoothed_path)
+
+            # 步骤3: 生成过滤与不过滤两种 DyCause 输入（没有数据时不生成）
+            if 'excel' in stages:
+                if smoothed is None:
+                    smoothed = self._smooth_frame(input_path)
+                outputs['excel'] = self._generate_excel(smoothed, json_path, file_stem)
+
+            return outputs
         except Exception as e:
             print(f"处理文件 {input_path} 时出错: {str(e)}")
-            return False
-
-    def _smooth_xml(self, input_path, output_path):
-        """执行第一部分的数据平滑处理"""
-        tree = ET.parse(input_path)
-        root = tree.getroot()
-
-        # 提取数据
-        data = []
-        for interval in root.findall('interval'):
-            data.append([
-                float(interval.get('begin')),
-                float(interval.get('end')),
-                interval.get('id'),
-                float(interval.get('flow')),
-                float(interval.get('occupancy')),
-                float(interval.get('speed'))
-            ])
-
-        # 数据平滑
-        df = pd.DataFrame(data, columns=['begin', 'end', 'id', 'flow', 'occupancy', 'speed'])
-        smoothed_data = []
-        for column in ['flow', 'occupancy', 'speed']:
-            aspect = df[column].to_numpy()
-            smooth = savgol_filter(aspect, WINDOW_SIZE, POLY_ORDER, mode='mirror')
-            smoothed_data.append(np.maximum(smooth, 0))
-
-        # 更新XML数据
-        for index, interval in enumerate(root.findall('interval')):
-            interval.set('flow', str(smoothed_data[0][index]))
-            interval.set('occupancy', str(smoothed_data[1][index]))
-            interval.set('speed', str(smoothed_data[2][index]))
-
-        tree.write(output_path)
-
-    def _generate_excel(self, xml_path, json_path, output_path, use_filter):
-        """生成Excel文件，支持过滤模式"""
+            return None
+
+    def run_batch(self, xml_files, workers=BATCH_WORKERS, manifest_path=MANIFEST_PATH):
+        """并行、可续跑地处理多个场景文件，只重新计算输入内容或参数发生变化的阶段"""
+        manifest = BatchManifest(manifest_path)
+        return run_batch(self, xml_files, manifest, workers=workers)
+
+    def _smooth_frame(self, input_path):
+        """执行第一部分的数据平滑处理：每个检测器沿时间轴独立平滑，不跨越检测器边界"""
+        records = load_intervals(input_path, fields=['begin'] + self.SMOOTH_FEATURES)
+        frame = DetectorFrame.from_records(records, self.SMOOTH_FEATURES, dtype=np.float64)
+        return smooth_frame(frame, WINDOW_SIZE, POLY_ORDER)
+
+    def _write_smoothed_xml(self, input_path, smoothed, output_path):
+        """按原记录顺序将平滑结果流式写回XML"""
+        records = load_intervals(input_path, fields=['begin'] + self.SMOOTH_FEATURES)
+        write_intervals(input_path, output_path, frame_to_records(smoothed, records))
+
+    def _generate_excel(self, smoothed, json_path, file_stem):
+        """生成过滤与不过滤两种输出：同一个内存矩阵按检测器选取行后导出，返回写出的文件"""
         # 加载过滤列表
-        filtered_detectors = None
-        if use_filter:
-            try:
-                with open(json_path, 'r') as f:
-                    data = json.load(f)
-                filtered_detectors = {item['detector_id'] for item in data['top_k_detectors']}
-            except:
-                filtered_detectors = set()
-
-        # 解析XML
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-
-        # 提取数据
-        detector_data = defaultdict(dict)
-        time_points = set()
-        for interval in root.findall('interval'):
-            det_id = interval.get('id')
-            if filtered_detectors and det_id not in filtered_detectors:
+        try:
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+            filtered_detectors = {item['detector_id'] for item in data['top_k_detectors']}
+        except:
+            filtered_detectors = set()
+
+        # 由平滑后的速度生成 [检测器, 时刻] 矩阵，缺失时刻补 0
+        matrix = dycause_matrix(smoothed)
+        written = []
+        for use_filter in [True, False]:
+            suffix = "filtered" if use_filter else "unfiltered"
+            rows = select_rows(smoothed.detector_ids, filtered_detectors if use_filter else None)
+            if not len(rows):
                 continue
-
-            begin = int(float(interval.get('begin')))
-            speed = max(0.0, float(interval.get('speed')))
-            time_points.add(begin)
-            detector_data[det_id][begin] = speed
-
-        # 生成时间序列
-        sorted_times = sorted(time_points)
-        output_rows = []
-        for det_id, time_dict in detector_data.items():
-            row = [det_id] + [round(time_dict.get(t, 0.0), 2) for t in sorted_times]
-            output_rows.append(row)
-
-        # 保存Excel
-        if output_rows:
-            pd.DataFrame(output_rows).to_excel(
-                output_path, index=False, header=False, engine='openpyxl')
+            output_path = os.path.join(EXCEL_DIR, f"{file_stem}_{suffix}{EXPORT_FORMATS[EXPORT_FORMAT]}")
+            with atomic_path(output_path) as temp_path:
+                export_matrix(temp_path, [smoothed.detector_ids[i] for i in rows], smoothed.times,
+                              matrix[rows], EXPORT_FORMAT)
+            written.append(output_path)
+        return written
 
 
 # ====================== 异常检测类 ======================
 class EnhancedTrafficAnomalyDetector:
-    def __init__(self, phase_length=90, time_window=30, top_k=TOP_K, verbose=True):
+    def __init__(self, phase_length=90, time_window=30, top_k=TOP_K, verbose=True,
+                 scoring_mode='array', workers=1, cache_training=False):
         self.phase_length = phase_length
         self.time_window = time_window
         self.top_k = top_k
         self.verbose = verbose
+        self.scoring_mode = scoring_mode  # 'array' 批量数组计算，'cascade' 上界剪枝后精确计算，'loop' 逐点计算
+        self.workers = workers  # 训练时并行解析文件的进程数
+        self.cache_training = cache_training  # 训练时是否把正常数据文件的解析结果写入解析缓存
         self.features = ['speed', 'occupancy', 'flow']
         self.normal_params = defaultdict(lambda: defaultdict(dict))
         self._model_trained = False
+        self.cascade_stats = None  # 最近一次级联筛选的检测器数、精确打分数与剪枝数
+
+    def _training_cache(self):
+        # 正常数据文件默认只解析一次、不写入解析缓存，避免训练集被整体复制到 data/parse_cache
+        return None if self.cache_training else False
 
     def _print(self, message):
         if self.verbose:
             print(f"[SYSTEM] {message}")
 
-    def _smooth_data(self, data, window_size=3):
-        """使用移动平均进行数据平滑"""
-        if len(data) < window_size:
-            return data
-        return np.convolve(data, np.ones(window_size) / window_size, mode='valid')
-
     def _parse_xml(self, file_path):
-        """改进的XML解析，包含数据预处理"""
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-
+        """改进的XML解析，包含数据预处理（有效性过滤与移动平均平滑）"""
         time_series = defaultdict(lambda: defaultdict(list))
-        for interval in root.findall('interval'):
-            t = int(float(interval.get('begin')))
-            detector_id = interval.get('id')
-
-            record = {
-                'speed': float(interval.get('speed')),
-                'occupancy': float(interval.get('occupancy')),
-                'flow': float(interval.get('flow'))
-            }
-
-            valid = record['speed'] > 0 and record['occupancy'] >= 0 and record['flow'] >= 0
-            if valid:
-                for feature in self.features:
-                    time_series[detector_id][feature].append((t, record[feature]))
-
-        for detector in time_series.values():
-            for feature in self.features:
-                if len(detector[feature]) > 0:
-                    times, values = zip(*detector[feature])
-                    smoothed = self._smooth_data(values)
-                    if len(smoothed) > 0:
-                        detector[feature] = list(zip(times[-len(smoothed):], smoothed))
+        for detector_id, times, values in load_detector_series(file_path, self.features):
+            row_times = times.tolist()
+            for j, feature in enumerate(self.features):
+                time_series[detector_id][feature] = list(zip(row_times, values[:, j].tolist()))
         return time_series
 
+    def _parse_frame(self, file_path):
+        """预处理后的数据以 DetectorFrame 返回（float64，保证与逐点计算的分数一致）"""
+        series = load_detector_series(file_path, self.features)
+        return DetectorFrame.from_series(series, self.features, dtype=np.float64)
+
     def train_normal_model(self, normal_dir, save_path=None):
         self._print(f"开始训练正常流量模型，数据目录: {normal_dir}")
-        phase_buckets = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-
-        for file_name in tqdm(sorted(os.listdir(normal_dir)),
-                              desc="处理正常数据文件",
-                              disable=not self.verbose):
-            if not file_name.startswith("normal_"):
-                continue
-
-            file_path = os.path.join(normal_dir, file_name)
-            time_series = self._parse_xml(file_path)
-
-            for detector, features in time_series.items():
-                for feature in self.features:
-                    for t, value in features[feature]:
-                        phase = t % self.phase_length
-                        phase_buckets[detector][phase][feature].append(value)
-
+        file_paths = [os.path.join(normal_dir, file_name)
+                      for file_name in sorted(os.listdir(normal_dir))
+                      if file_name.startswith("normal_")]
+        if not file_paths:
+            raise ValueError("未找到正常数据文件")
+
+        # 每个文件解析为按相位展开的数组分片（workers>1 时多进程并行）
+        shards = collect_shards(file_paths, self.features, self.phase_length,
+                                workers=self.workers, verbose=self.verbose,
+                                cache=self._training_cache())
+
+        # 计算鲁棒统计量
         self._print("计算鲁棒统计参数...")
-        for detector in tqdm(phase_buckets.keys(),
-                             desc="处理检测器",
-                             disable=not self.verbose):
-            for phase in range(self.phase_length):
-                for feature in self.features:
-                    data = phase_buckets[detector][phase][feature]
-                    if len(data) >= 5:
-                        median = np.median(data)
-                        mad = median_abs_deviation(data, scale='normal')
-                        self.normal_params[detector][phase][feature] = (median, mad)
-                    else:
-                        self.normal_params[detector][phase][feature] = (np.nan, np.nan)
+        detector_ids, params = fit_phase_params(shards, self.phase_length, len(self.features))
+        self.normal_params = params_to_dict(detector_ids, params, self.features)
 
         self._model_trained = True
         if save_path:
             self.save_model(save_path)
 
     def save_model(self, file_path):
+        """保存模型：.npy 为内存映射二进制格式，其余按 JSON 保存"""
+        if file_path.endswith('.npy'):
+            save_binary_model(file_path, self.normal_params, self.phase_length, self.features)
+            return
         save_data = {}
         for detector, phases in self.normal_params.items():
             save_data[detector] = {}
@@ -254,6 +260,14 @@ class EnhancedTrafficAnomalyDetector:
 
     def load_model(self, file_path):
         self._print(f"加载预训练模型: {file_path}")
+        if file_path.endswith('.npy'):
+            model = MappedModel(file_path)
+            if model.phase_length != self.phase_length or model.features != self.features:
+                raise ValueError("模型的相位长度或特征与检测器配置不一致")
+            self.normal_params = model
+            self._model_trained = True
+            return
+
         with open(file_path, 'r') as f:
             loaded_data = json.load(f)
 
@@ -270,23 +284,21 @@ class EnhancedTrafficAnomalyDetector:
             return 0
         return abs(actual - median) / mad
 
-    def detect_anomalies(self, test_file, output_file=None):
-        if not self._model_trained:
-            raise RuntimeError("请先训练或加载模型")
-
-        self._print(f"\n开始检测异常: {Path(test_file).name}")
-        test_data = self._parse_xml(test_file)
-
+    def _score_detectors_loop(self, test_data):
+        """逐检测器、逐时间点计算综合异常指数"""
         detector_scores = defaultdict(list)
         for detector_id, features in tqdm(test_data.items(),
                                           desc="处理检测器数据",
                                           disable=not self.verbose):
-            feature_scores = {f: [] for f in self.features}
+            feature_windows = {f: RollingMedian(self.time_window) for f in self.features}
             time_points = set()
+            # 各特征按时间点建立索引（同一时间点取第一个值），避免逐时间点扫描整个序列
+            feature_values = {f: {} for f in self.features}
 
             for feature in self.features:
-                for t, _ in features[feature]:
+                for t, v in features[feature]:
                     time_points.add(t)
+                    feature_values[feature].setdefault(t, v)
 
             sorted_times = sorted(time_points)
             for t in sorted_times:
@@ -295,7 +307,7 @@ class EnhancedTrafficAnomalyDetector:
                 valid_features = 0
 
                 for feature in self.features:
-                    current_value = next((v for (time, v) in features[feature] if time == t), None)
+                    current_value = feature_values[feature].get(t)
                     if current_value is None:
                         continue
 
@@ -304,19 +316,15 @@ class EnhancedTrafficAnomalyDetector:
                         continue
 
                     score = self._calculate_feature_score(current_value, *params)
-                    feature_scores[feature].append(score)
+                    feature_windows[feature].push(score)
                     valid_features += 1
 
                 if valid_features > 0:
                     window_scores = []
                     for feature in self.features:
-                        if len(feature_scores[feature]) >= self.time_window:
-                            window = feature_scores[feature][-self.time_window:]
-                        else:
-                            window = feature_scores[feature]
-
-                        if len(window) > 0:
-                            window_scores.append(np.median(window))
+                        # 滑动窗口内最近 time_window 个分数的中位数
+                        if len(feature_windows[feature]) > 0:
+                            window_scores.append(feature_windows[feature].median())
 
                     if len(window_scores) > 0:
                         combined_score = np.mean(window_scores)
@@ -327,10 +335,63 @@ class EnhancedTrafficAnomalyDetector:
                 detector_scores[detector_id] = final_score
             else:
                 detector_scores[detector_id] = 0
+        return detector_scores
+
+    def _score_detectors_array(self, frame):
+        """在 DetectorFrame 的 (detector, time, feature) 数组上批量计算综合异常指数"""
+        params = build_param_array(self.normal_params, frame.detector_ids,
+                                   self.phase_length, self.features)
+        scores = score_aligned(frame.values.transpose(1, 0, 2), frame.times, params,
+                               self.phase_length, self.time_window)
+        return dict(zip(frame.detector_ids, scores))
+
+    def _score_detectors_cascade(self, frame):
+        """两阶段筛选：先计算每个检测器综合异常指数的上界，只对可能进入 top-K 的检测器精确打分
+
+        返回的字典只包含精确打分的检测器，其 top-K 与穷举计算完全相同。
+        """
+        detector_ids = frame.detector_ids
+        params = build_param_array(self.normal_params, detector_ids,
+                                   self.phase_length, self.features)
+        eligible = frame.counts() >= 5
+        exact, _ = cascade_scores(frame.values.transpose(1, 0, 2), frame.times, params,
+                                  self.phase_length, self.time_window, self.top_k, eligible)
+        self.cascade_stats = {
+            "detectors": len(detector_ids),
+            "scored": len(exact),
+            "pruned": int(eligible.sum()) - len(exact),
+        }
+        self._print(f"级联筛选: 共 {len(detector_ids)} 个检测器，精确打分 {len(exact)} 个，"
+                    f"剪枝 {self.cascade_stats['pruned']} 个")
+        return {detector_ids[i]: exact[i] for i in sorted(exact)}
+
+    def detect_many(self, files, workers=1, output_files=None):
+        """批量检测多个场景文件，按完成顺序逐个产出 (文件, 检测结果)"""
+        if not self._model_trained:
+            raise RuntimeError("请先训练或加载模型")
+        return detect_many(self, files, workers=workers, output_files=output_files)
+
+    def detect_anomalies(self, test_file, output_file=None, save_results=True):
+        """检测单个场景文件，结果只写入 output_file；save_results 仅为与 screen 的检测器接口一致"""
+        if not self._model_trained:
+            raise RuntimeError("请先训练或加载模型")
+
+        self._print(f"\n开始检测异常: {Path(test_file).name}")
+        if self.scoring_mode == 'loop':
+            test_data = self._parse_xml(test_file)
+            detector_scores = self._score_detectors_loop(test_data)
+            point_counts = {k: len(v['speed']) for k, v in test_data.items()}
+        else:
+            frame = self._parse_frame(test_file)
+            if self.scoring_mode == 'cascade':
+                detector_scores = self._score_detectors_cascade(frame)
+            else:
+                detector_scores = self._score_detectors_array(frame)
+            point_counts = dict(zip(frame.detector_ids, frame.counts().tolist()))
 
         valid_detectors = {
             k: v for k, v in detector_scores.items()
-            if len(test_data[k]['speed']) >= 5
+            if point_counts[k] >= 5
         }
 
         sorted_scores = sorted(valid_detectors.items(),
@@ -358,10 +419,6 @@ if __name__ == "__main__":
                  if f.endswith(".xml") and "normal" not in f]
 
     print(f"开始处理 {len(xml_files)} 个文件...")
-    success_count = 0
-
-    for xml_path in tqdm(xml_files, desc="处理进度"):
-        if processor.process_single_file(xml_path):
-            success_count += 1
+    done, skipped, failed = processor.run_batch(xml_files)
 
-    print(f"\n处理完成！成功处理 {success_count}/{len(xml_files)} 个文件")
\ No newline at end of file
+    print(f"\n处理完成！成功处理 {done} 个，跳过未变化的 {skipped} 个，失败 {failed} 个（共 {len(xml_files)} 个文件）")
@@ -3,6 +3,7 @@ import shutil
 import json
 import time
 import traci
+import numpy as np
 
 from files_path.file_path import emulation_path, data_path
 import psutil  # 新增进程管理库
@@ -10,6 +11,11 @@ import psutil  # 新增进程管理库
 data_paths = os.path.join(data_path, "junction_data.json")
 E1_SOURCE_PATH = os.path.join(emulation_path, "e1output.xml")
 
+# 异常注入时间段（仿真步）
+ANOMALY_START, ANOMALY_END = 800, 2800
+# 在线检测时，异常注入后排名持续不变多少秒即提前结束仿真
+EARLY_STOP_PATIENCE = 600
+
 
 def kill_sumo_processes():
     """强制终止所有SUMO相关进程"""
@@ -34,6 +40,29 @@ def safe_copy(src, dst, retries=5, delay=2):
     return False
 
 
+def read_induction_loops(loop_ids, step_length=1.0):
+    """读取所有线圈上一步的 (speed, occupancy, flow)，与 e1 输出的字段含义一致"""
+    readings = np.empty((len(loop_ids), 3))
+    for i, loop_id in enumerate(loop_ids):
+        readings[i, 0] = traci.inductionloop.getLastStepMeanSpeed(loop_id)
+        readings[i, 1] = traci.inductionloop.getLastStepOccupancy(loop_id)
+        readings[i, 2] = traci.inductionloop.getLastStepVehicleNumber(loop_id) * 3600 / step_length
+    return readings
+
+
+def save_online_ranking(online, file_path, stopped_at):
+    """保存在线检测的 top-K 排名（结构与 anomaly_results.json 一致）"""
+    result_data = {
+        "stopped_at": stopped_at,
+        "top_k_detectors": [
+            {"detector_id": detector, "anomaly_score": score}
+            for detector, score in online.ranking()
+        ]
+    }
+    with open(file_path, 'w') as f:
+        json.dump(result_data, f, indent=2)
+
+
 def generate_anomaly_states(original_state):
     """生成异常信号状态"""
     length = len(original_state)
@@ -43,8 +72,13 @@ def generate_anomaly_states(original_state):
     }
 
 
-def run_simulation(junction_id, anomaly_type, config_path, output_dir, steps=3600, traffic_scale=4):
-    """运行单次仿真并保存结果"""
+def run_simulation(junction_id, anomaly_type, config_path, output_dir, steps=3600, traffic_scale=4,
+                   detector=None, early_stop=False):
+    """运行单次仿真并保存结果
+
+    传入已训练的 EnhancedTrafficAnomalyDetector 时，每步把线圈读数送入在线检测器；
+    early_stop=True 时，异常注入后 top-K 排名持续 EARLY_STOP_PATIENCE 秒不变即提前结束。
+    """
     # 预处理：清理残留进程
     kill_sumo_processes()
     time.sleep(3)
@@ -87,11 +121,17 @@ def run_simulation(junction_id, anomaly_type, config_path, output_dir, steps=360
         except:
             print("初始文件清理失败，继续运行...")
 
+    online = None
+    if detector is not None:
+        loop_ids = list(traci.inductionloop.getIDList())
+        online = detector.online_session(loop_ids)
+        step_length = traci.simulation.getDeltaT()
+
     step = 0
     try:
         while step < steps:
             # 异常注入时间段
-            if 800 <= step <= 2800:
+            if ANOMALY_START <= step <= ANOMALY_END:
                 traci.trafficlight.setRedYellowGreenState(
                     junction_id,
                     anomaly_states[anomaly_type]
@@ -112,6 +152,13 @@ def run_simulation(junction_id, anomaly_type, config_path, output_dir, steps=360
                 )
 
             traci.simulationStep()
+            if online is not None:
+                # 本步读数对应 e1 输出中 begin=step 的区间
+                online.update(step, read_induction_loops(loop_ids, step_length))
+                if early_stop and online.stable_for(since=ANOMALY_START) >= EARLY_STOP_PATIENCE:
+                    print(f"⏹ 排名已稳定，在第 {step} 步提前结束仿真")
+                    step += 1
+                    break
             step += 1
     finally:
         traci.close()
@@ -131,9 +178,19 @@ def run_simulation(junction_id, anomaly_type, config_path, output_dir, steps=360
     else:
         print(f"❌ 严重错误: 无法保存E1文件 {e1_target_path}")
 
+    if online is not None:
+        online_path = os.path.splitext(e1_target_path)[0] + "_online.json"
+        save_online_ranking(online, online_path, step)
+        print(f"✅ 在线检测结果已保存至: {online_path}")
+        return online.ranking()
+
 
-def batch_run_simulation(config_path):
-    """批量运行所有异常场景"""
+def batch_run_simulation(config_path, detector=None, early_stop=False, store=None):
+    """批量运行所有异常场景
+
+    store 为可选的 data_processing.e1_store.E1Store：传入时每个场景的E1文件保存后即转换为分区数据集，
+    默认不转换（之后也可运行 python -m data_processing.e1_store data/final_output）。
+    """
     with open(data_paths) as f:
         junction_data = json.load(f)
 
@@ -152,9 +209,19 @@ def batch_run_simulation(config_path):
                 config_path=config_path,
                 output_dir=temp_dir,
                 steps=3600,
-                traffic_scale=4
+                traffic_scale=4,
+                detector=detector,
+                early_stop=early_stop
             )
 
+            if store is not None:
+                e1_path = os.path.join(data_path, 'final_output', f"{junction_id}_{anomaly_type}_e1.xml")
+                try:
+                    store.ingest(e1_path)
+                    print(f"✅ 场景已写入数据集: {store.scenario_dir(f'{junction_id}_{anomaly_type}')}")
+                except Exception as e:
+                    print(f"转换E1文件失败: {str(e)}")
+
             # 增强的目录清理逻辑
             if os.path.exists(temp_dir):
                 for retry in range(3):
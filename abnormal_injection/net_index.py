@@ -0,0 +1,341 @@
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from xml.parsers import expat
+
+import numpy as np
+
+from data_processing.parse_cache import default_cache
+from files_path.file_path import data_path
+
+# 路网索引缓存目录，每个路网文件按内容哈希保存为一个 npz
+NET_CACHE_DIR = os.path.join(data_path, "net_cache")
+
+# 缓存格式版本，字段变化时递增使旧缓存失效
+_FORMAT_VERSION = 1
+
+_EXPAT_BUFFER = 1 << 20
+
+# 同一进程内已加载的索引，按内容哈希复用
+_loaded = {}
+
+
+class NetIndex:
+    """map.net.xml 的紧凑索引：交叉口、进口车道、信号灯配时、道路与车道级连接
+
+    名称存为字符串表，其余为整数编码数组：
+    junction_ids/junction_types，inc_offsets/inc_lanes 为各交叉口进口车道的 CSR；
+    edge_ids/edge_from/edge_to（交叉口编码，未知为 -1），lane_ids/lane_edge（所属道路编码，非普通道路为 -1）；
+    conn_from/conn_to 为普通道路之间的车道级连接，conn_tl/conn_link 为控制该连接的信号灯编码与相位下标（无则 -1）；
+    tl_ids/tl_types/tl_programs/tl_offsets 与 phase_offsets/phase_duration/phase_state/phase_min/phase_max
+    （CSR，minDur/maxDur 缺失为 NaN）。交叉口内部道路、内部交叉口及经过内部车道的连接不收录。
+    """
+
+    ARRAYS = ('junction_ids', 'junction_types', 'inc_offsets', 'inc_lanes', 'edge_ids', 'edge_from', 'edge_to',
+              'lane_ids', 'lane_edge', 'conn_from', 'conn_to', 'conn_tl', 'conn_link', 'tl_ids', 'tl_types',
+              'tl_programs', 'tl_offsets', 'phase_offsets', 'phase_duration', 'phase_state', 'phase_min',
+              'phase_max')
+
+    def __init__(self, arrays):
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        # 名称列表与反查字典在加载时建好一次，查询时不再构造 numpy 字符串
+        self._junctions = self.junction_ids.tolist()
+        self._edges = self.edge_ids.tolist()
+        self._lanes = self.lane_ids.tolist()
+        self.junction_code = {jid: i for i, jid in enumerate(self._junctions)}
+        self.edge_code = {eid: i for i, eid in enumerate(self._edges)}
+        self.lane_code = {lane: i for i, lane in enumerate(self._lanes)}
+        self.tl_code = {tl_id: k for k, tl_id in enumerate(self.tl_ids.tolist())}
+
+        # 车道级连接按起点、终点分别排序，上下游查询为一次二分查找
+        self._down_order = np.argsort(self.conn_from, kind='stable')
+        self._up_order = np.argsort(self.conn_to, kind='stable')
+        self._down_keys = self.conn_from[self._down_order]
+        self._up_keys = self.conn_to[self._up_order]
+
+        self._out_edges = defaultdict(list)
+        self._in_edges = defaultdict(list)
+        for e, (f, t) in enumerate(zip(self.edge_from.tolist(), self.edge_to.tolist())):
+            if f >= 0:
+                self._out_edges[f].append(e)
+            if t >= 0:
+                self._in_edges[t].append(e)
+        self._edge_lanes = defaultdict(list)
+        for lane, e in enumerate(self.lane_edge.tolist()):
+            if e >= 0:
+                self._edge_lanes[e].append(lane)
+
+    # --- 与 get_data 中原解析函数相同结构的结果 ---
+
+    def lane_to_edge(self):
+        """{车道ID: 道路ID}，只含普通道路的车道"""
+        return {self._lanes[lane]: self._edges[e] for lane, e in enumerate(self.lane_edge.tolist()) if e >= 0}
+
+    def edge_successors(self):
+        """{道路ID: 下游道路ID集合}"""
+        successors = defaultdict(set)
+        from_edge = self.lane_edge[self.conn_from]
+        to_edge = self.lane_edge[self.conn_to]
+        for f, t in set(zip(from_edge.tolist(), to_edge.tolist())):
+            successors[self._edges[f]].add(self._edges[t])
+        return successors
+
+    def tl_logics(self):
+        """{信号灯ID: {type, programID, offset, phases}}，与 get_data.parse_tl_logics 的结果相同"""
+        logics = {}
+        for k, tl_id in enumerate(self.tl_ids.tolist()):
+            phases = []
+            for p in range(self.phase_offsets[k], self.phase_offsets[k + 1]):
+                phases.append({
+                    'duration': float(self.phase_duration[p]),
+                    'state': str(self.phase_state[p]),
+                    'minDur': None if np.isnan(self.phase_min[p]) else float(self.phase_min[p]),
+                    'maxDur': None if np.isnan(self.phase_max[p]) else float(self.phase_max[p]),
+                })
+            logics[tl_id] = {
+                'type': str(self.tl_types[k]),
+                'programID': str(self.tl_programs[k]),
+                'offset': float(self.tl_offsets[k]),
+                'phases': phases,
+            }
+        return logics
+
+    # --- 图查询 ---
+
+    def junctions(self, junction_type=None):
+        """全部交叉口ID，junction_type 非空时只返回该类型的交叉口"""
+        if junction_type is None:
+            return self.junction_ids.tolist()
+        return self.junction_ids[self.junction_types == junction_type].tolist()
+
+    def incoming_lanes(self, junction_id):
+        """交叉口的进口车道（net.xml 中的 incLanes，按原顺序）"""
+        j = self.junction_code.get(junction_id)
+        if j is None:
+            return []
+        return [self._lanes[lane] for lane in self.inc_lanes[self.inc_offsets[j]:self.inc_offsets[j + 1]].tolist()]
+
+    def outgoing_lanes(self, junction_id):
+        """从交叉口驶出的道路上的全部车道"""
+        j = self.junction_code.get(junction_id)
+        return [self._lanes[lane] for e in self._out_edges.get(j, ()) for lane in self._edge_lanes[e]]
+
+    def incoming_edges(self, junction_id):
+        return [self._edges[e] for e in self._in_edges.get(self.junction_code.get(junction_id), ())]
+
+    def outgoing_edges(self, junction_id):
+        return [self._edges[e] for e in self._out_edges.get(self.junction_code.get(junction_id), ())]
+
+    def upstream_junctions(self, junction_id):
+        """经一条道路驶入该交叉口的上游交叉口"""
+        j = self.junction_code.get(junction_id)
+        return list(dict.fromkeys(self._junctions[self.edge_from[e]] for e in self._in_edges.get(j, ())
+                                  if self.edge_from[e] >= 0))
+
+    def downstream_junctions(self, junction_id):
+        """经一条道路从该交叉口驶向的下游交叉口"""
+        j = self.junction_code.get(junction_id)
+        return list(dict.fromkeys(self._junctions[self.edge_to[e]] for e in self._out_edges.get(j, ())
+                                  if self.edge_to[e] >= 0))
+
+    def downstream_lanes(self, lane_id):
+        """与该车道直接连接的下游车道"""
+        return self._neighbour_lanes(lane_id, self._down_keys, self._down_order, self.conn_to)
+
+    def upstream_lanes(self, lane_id):
+        """直接连接到该车道的上游车道"""
+        return self._neighbour_lanes(lane_id, self._up_keys, self._up_order, self.conn_from)
+
+    def _neighbour_lanes(self, lane_id, keys, order, other):
+        code = self.lane_code.get(lane_id)
+        if code is None:
+            return []
+        lo, hi = np.searchsorted(keys, [code, code + 1])
+        return list(dict.fromkeys(self._lanes[lane] for lane in other[order[lo:hi]].tolist()))
+
+    def lane_junction(self, lane_id):
+        """车道所在道路的终点交叉口（即以该车道为进口道的交叉口），未知时为 None"""
+        lane = self.lane_code.get(lane_id)
+        if lane is None or self.lane_edge[lane] < 0:
+            return None
+        j = self.edge_to[self.lane_edge[lane]]
+        return None if j < 0 else self._junctions[j]
+
+    def tl_links(self, tl_id):
+        """信号灯控制的车道级连接 [(进口车道, 出口车道, 相位状态下标)]，按下标排序"""
+        k = self.tl_code.get(tl_id)
+        if k is None:
+            return []
+        rows = np.flatnonzero(self.conn_tl == k)
+        rows = rows[np.argsort(self.conn_link[rows], kind='stable')]
+        return [(self._lanes[f], self._lanes[t], link) for f, t, link in
+                zip(self.conn_from[rows].tolist(), self.conn_to[rows].tolist(), self.conn_link[rows].tolist())]
+
+
+class _Table:
+    """字符串到连续编码的映射"""
+
+    def __init__(self):
+        self.code = {}
+        self.names = []
+
+    def get(self, name):
+        code = self.code.get(name)
+        if code is None:
+            code = self.code[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+
+def _float_or_nan(value):
+    return float(value) if value else np.nan
+
+
+def parse_net(net_file):
+    """用 expat 单次流式读取 net.xml，返回 NetIndex；XML 格式错误抛出 ParseError"""
+    junctions, edges, lanes, tls = _Table(), _Table(), _Table(), _Table()
+    junction_types, junction_inc, defined = {}, {}, []
+    edge_from, edge_to, lane_edge = {}, {}, {}
+    connections = []
+    tl_meta, phases = {}, defaultdict(list)
+    state = {'edge': None, 'tl': None}
+
+    def start_element(name, attrs):
+        if name == 'lane':
+            if state['edge'] is not None:
+                lane_edge[lanes.get(attrs['id'])] = state['edge']
+        elif name == 'phase':
+            if state['tl'] is not None:
+                phases[state['tl']].append((float(attrs['duration']), attrs.get('state', ''),
+                                            _float_or_nan(attrs.get('minDur')),
+                                            _float_or_nan(attrs.get('maxDur'))))
+        elif name == 'edge':
+            if attrs.get('function') == 'internal':
+                state['edge'] = None
+                return
+            e = state['edge'] = edges.get(attrs['id'])
+            edge_from[e] = junctions.get(attrs['from']) if 'from' in attrs else -1
+            edge_to[e] = junctions.get(attrs['to']) if 'to' in attrs else -1
+        elif name == 'junction':
+            if attrs.get('type') == 'internal':
+                return
+            j = junctions.get(attrs['id'])
+            defined.append(j)
+            junction_types[j] = attrs.get('type', '')
+            junction_inc[j] = [lanes.get(lane) for lane in attrs.get('incLanes', '').split()]
+        elif name == 'connection':
+            from_edge, to_edge = attrs['from'], attrs['to']
+            if from_edge.startswith(':') or to_edge.startswith(':'):
+                return
+            tl = tls.get(attrs['tl']) if 'tl' in attrs else -1
+            connections.append((lanes.get(f"{from_edge}_{attrs['fromLane']}"),
+                                lanes.get(f"{to_edge}_{attrs['toLane']}"),
+                                tl, int(attrs.get('linkIndex', -1))))
+        elif name == 'tlLogic':
+            k = state['tl'] = tls.get(attrs['id'])
+            # 同一信号灯有多个方案时与 parse_tl_logics 一致，保留最后一个
+            phases[k] = []
+            tl_meta[k] = (attrs.get('type'), attrs.get('programID'), float(attrs.get('offset', 0)))
+
+    def end_element(name):
+        if name == 'edge':
+            state['edge'] = None
+        elif name == 'tlLogic':
+            state['tl'] = None
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.buffer_size = _EXPAT_BUFFER
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    with open(net_file, 'rb') as f:
+        try:
+            parser.ParseFile(f)
+        except expat.ExpatError as e:
+            err = ET.ParseError(f"{expat.ErrorString(e.code)}: line {e.lineno}, column {e.offset}")
+            err.code = e.code
+            err.position = (e.lineno, e.offset)
+            raise err from None
+
+    n_junctions, n_edges, n_lanes, n_tls = len(junctions.names), len(edges.names), len(lanes.names), len(tls.names)
+    # 道路先于交叉口出现，重新编码使交叉口按文件中的定义顺序排列（只被道路引用的排在最后）
+    order = list(dict.fromkeys(defined + list(range(n_junctions))))
+    recode = np.empty(n_junctions + 1, dtype=np.int32)
+    recode[order] = np.arange(n_junctions)
+    recode[-1] = -1
+    inc = [junction_inc.get(j, []) for j in order]
+    offsets = np.zeros(n_junctions + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(codes) for codes in inc])
+    members = [lane for codes in inc for lane in codes]
+
+    # 只在连接的 tl 属性中出现、没有 tlLogic 的信号灯没有配时方案
+    tl_phases = [phases.get(k, []) for k in range(n_tls)]
+    phase_offsets = np.zeros(n_tls + 1, dtype=np.int64)
+    phase_offsets[1:] = np.cumsum([len(p) for p in tl_phases])
+    flat = [phase for p in tl_phases for phase in p]
+    meta = [tl_meta.get(k, ('', '', 0.0)) for k in range(n_tls)]
+    conn = np.array(connections, dtype=np.int64).reshape(len(connections), 4)
+
+    return NetIndex({
+        'junction_ids': np.array([junctions.names[j] for j in order], dtype=str),
+        'junction_types': np.array([junction_types.get(j, '') for j in order], dtype=str),
+        'inc_offsets': offsets,
+        'inc_lanes': np.array(members, dtype=np.int32),
+        'edge_ids': np.array(edges.names, dtype=str),
+        'edge_from': recode[[edge_from[e] for e in range(n_edges)]],
+        'edge_to': recode[[edge_to[e] for e in range(n_edges)]],
+        'lane_ids': np.array(lanes.names, dtype=str),
+        'lane_edge': np.array([lane_edge.get(lane, -1) for lane in range(n_lanes)], dtype=np.int32),
+        'conn_from': conn[:, 0].astype(np.int32),
+        'conn_to': conn[:, 1].astype(np.int32),
+        'conn_tl': conn[:, 2].astype(np.int32),
+        'conn_link': conn[:, 3].astype(np.int32),
+        'tl_ids': np.array(tls.names, dtype=str),
+        'tl_types': np.array([m[0] or '' for m in meta], dtype=str),
+        'tl_programs': np.array([m[1] or '' for m in meta], dtype=str),
+        'tl_offsets': np.array([m[2] for m in meta], dtype=np.float64),
+        'phase_offsets': phase_offsets,
+        'phase_duration': np.array([p[0] for p in flat], dtype=np.float64),
+        'phase_state': np.array([p[1] for p in flat], dtype=str),
+        'phase_min': np.array([p[2] for p in flat], dtype=np.float64),
+        'phase_max': np.array([p[3] for p in flat], dtype=np.float64),
+    })
+
+
+def load_net_index(net_file, cache_dir=None):
+    """读取路网索引：先查进程内已加载的索引，再查按内容哈希命名的 npz 缓存，都未命中时解析并写入缓存"""
+    cache_dir = cache_dir or NET_CACHE_DIR
+    digest = default_cache().digest(net_file)
+    index = _loaded.get(digest)
+    if index is not None:
+        return index
+
+    path = os.path.join(cache_dir, digest + ".npz")
+    try:
+        with np.load(path) as data:
+            if int(data['version']) == _FORMAT_VERSION:
+                index = NetIndex({name: data[name] for name in NetIndex.ARRAYS})
+    except (OSError, ValueError, KeyError):
+        index = None
+
+    if index is None:
+        index = parse_net(net_file)
+        _store(path, index)
+    _loaded[digest] = index
+    return index
+
+
+def _store(path, index):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, version=_FORMAT_VERSION, **{name: getattr(index, name) for name in NetIndex.ARRAYS})
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"写入路网索引缓存失败: {str(e)}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -1,8 +1,9 @@
 import os
-import xml.etree.ElementTree as ET
-import pandas as pd
 import json
-from collections import defaultdict
+import numpy as np
+from data_processing.detector_frame import DetectorFrame
+from data_processing.exporters import dycause_matrix, export_matrix, select_rows
+from data_processing.parse_cache import load_intervals
 from files_path.file_path import screen_path, data_path
 
 
@@ -15,7 +16,7 @@ def load_filtered_detectors(json_path):
 
 # 路径声明
 xml_path = os.path.join(screen_path, "data_abnormal\\abnormal_0.xml")
-output_path = os.path.join(data_path, "detector_speeds.xlsx")
+output_path = os.path.join(data_path, "detector_speeds.xlsx")  # 扩展名决定导出格式：.xlsx / .csv / .npz / .parquet
 json_path = os.path.join(data_path, "anomaly_results.json")
 
 # 用户输入
@@ -30,44 +31,15 @@ if use_filter:
         print(f"加载JSON文件失败: {str(e)}")
         exit()
 
-# 解析XML文件
-tree = ET.parse(xml_path)
-root = tree.getroot()
+# 提取并处理数据：时间取整数秒，速度 -1 转换为 0，缺失时刻补 0
+# 启用过滤时只保留过滤列表中的检测器
+records = load_intervals(xml_path, fields=['begin', 'speed'])
+frame = DetectorFrame.from_records(records, ['speed'], dtype=np.float64)
+rows = select_rows(frame.detector_ids, filtered_detectors)
 
-detector_data = defaultdict(dict)
-time_points = set()
-
-# 提取并处理数据
-for interval in root.findall('interval'):
-    det_id = interval.get('id')
-
-    # 如果启用了过滤且检测器不在过滤列表中，则跳过
-    if filtered_detectors and det_id not in filtered_detectors:
-        continue
-
-    begin = int(float(interval.get('begin')))  # 转换为整数秒
-    speed = max(0.0, float(interval.get('speed')))  # 将-1转换为0
-
-    time_points.add(begin)
-    detector_data[det_id][begin] = speed
-
-# 生成时间序列
-sorted_times = sorted(time_points)
-
-# 构建输出数据
-output_rows = []
-for det_id, time_dict in detector_data.items():
-    row = [det_id]
-    row.extend([round(time_dict.get(t, 0.0), 2) for t in sorted_times])
-    output_rows.append(row)
-
-# 创建DataFrame并保存为Excel
-if output_rows:
-    df = pd.DataFrame(output_rows)
-    df.to_excel(output_path,
-                index=False,
-                header=False,
-                engine='openpyxl')
-    print(f"转换完成！结果已保存到 detector_speeds.xlsx，共转换 {len(output_rows)} 个检测器")
+# 导出 [检测器, 时刻] 矩阵（xlsx 以只写模式流式写出）
+if len(rows):
+    export_matrix(output_path, [frame.detector_ids[i] for i in rows], frame.times, dycause_matrix(frame)[rows])
+    print(f"转换完成！结果已保存到 {os.path.basename(output_path)}，共转换 {len(rows)} 个检测器")
 else:
     print("没有找到符合条件的数据，请检查过滤条件或输入文件")
@@ -4,16 +4,28 @@ import os
 import xml.etree.ElementTree as ET
 import pandas as pd
 import numpy as np
-from statsmodels.tsa.stattools import grangercausalitytests
-from collections import defaultdict
+from data_processing.detector_frame import DetectorFrame
+from data_processing.parse_cache import load_intervals
+from edpf.granger import compare_with_statsmodels, granger_chunked, save_granger
+from edpf.topology import load_allowed_mask
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.join(SCRIPT_DIR, "..")
 
 SUMO_OUTPUT_XML = os.path.join(PROJECT_ROOT, "emulation", "e1output.xml")
+NETWORK_XML = os.path.join(PROJECT_ROOT, "emulation", "map.net.xml")
+DETECTOR_ADD_XML = os.path.join(PROJECT_ROOT, "emulation", "e4.add.xml")
 INTERMEDIATE_DATA_CSV = os.path.join(PROJECT_ROOT, "data", "gc_input_data.csv")  # 保存中间数据的路径
+GC_RESULTS_NPZ = os.path.join(PROJECT_ROOT, "data", "gc_results.npz")  # 检验结果 [target, source, lag]
+GC_CHECKPOINT_DIR = os.path.join(PROJECT_ROOT, "data", "gc_checkpoint")  # 分块结果与进度，中断后从此继续
 
 MAX_LAG = 5
+SIGNIFICANCE_LEVEL = 0.05
+GC_WORKERS = os.cpu_count() or 1  # 并行计算的进程数
+GC_CHUNK_SIZE = 32  # 每个分块包含的目标序列数
+TOPOLOGY_HOPS = 2  # 只检验沿道路上下游不超过该跳数的检测器对；None 表示检验全部序列对
+PRINT_PAIR_RESULTS = False  # 是否逐对逐阶打印检验结论（序列较多时输出量很大）
+STATSMODELS_CHECK_PAIRS = 0  # 随机抽取多少个序列对用 statsmodels 重算核对（需安装 statsmodels），0 表示不核对
 
 
 def create_dummy_files_for_granger():
@@ -50,9 +62,9 @@ def create_dummy_files_for_granger():
 
 
 def parse_sumo_xml_to_dataframe():
+    METRICS_TO_EXTRACT = ['speed', 'flow', 'occupancy']
     try:
-        tree = ET.parse(SUMO_OUTPUT_XML)
-        root = tree.getroot()
+        records = load_intervals(SUMO_OUTPUT_XML, fields=['begin'] + METRICS_TO_EXTRACT)
     except FileNotFoundError:
         print(f"ERROR: SUMO XML 文件未找到：'{SUMO_OUTPUT_XML}'。请检查路径是否正确。")
         return None
@@ -63,52 +75,14 @@ def parse_sumo_xml_to_dataframe():
         print(f"ERROR: 打开或解析 XML 文件时发生意外错误: {e}")
         return None
 
-    time_series_data = defaultdict(dict)
-    all_metrics_per_detector = defaultdict(set)
-    METRICS_TO_EXTRACT = ['speed', 'flow', 'occupancy']
-
-    for interval_element in root.findall('interval'):
-        detector_id = interval_element.get('id')
-        begin_time_str = interval_element.get('begin')
-
-        if not (detector_id and begin_time_str):
-            continue
-
-        try:
-            begin_time = float(begin_time_str)
-            time_key = round(begin_time, 2)
-
-            for metric in METRICS_TO_EXTRACT:
-                value_str = interval_element.get(metric)
-
-                if value_str is not None:
-                    try:
-                        value = float(value_str)
-                        if value == -1.00:
-                            value = np.nan
-
-                        metric_column_name = f"{detector_id}__{metric}"
-                        time_series_data[time_key][metric_column_name] = value
-                        all_metrics_per_detector[detector_id].add(metric)
-
-                    except ValueError:
-                        metric_column_name = f"{detector_id}__{metric}"
-                        time_series_data[time_key][metric_column_name] = np.nan
-                        all_metrics_per_detector[detector_id].add(metric)
-                else:
-                    metric_column_name = f"{detector_id}__{metric}"
-                    time_series_data[time_key][metric_column_name] = np.nan
-                    all_metrics_per_detector[detector_id].add(metric)
-
-        except ValueError:
-            continue
-
-    df_processed = pd.DataFrame.from_dict(time_series_data, orient='index')
-
-    all_potential_columns = [f"{det}__{metric}" for det in all_metrics_per_detector for metric in METRICS_TO_EXTRACT]
-    for col in all_potential_columns:
-        if col not in df_processed.columns:
-            df_processed[col] = np.nan
+    # 时间取 begin 保留两位小数，跳过缺少 id 或 begin 的记录，同一时刻同一检测器重复出现时以最后一条为准
+    frame = DetectorFrame.from_records(records, METRICS_TO_EXTRACT, dtype=np.float64, time_decimals=2)
+    tables = []
+    for metric in METRICS_TO_EXTRACT:
+        table = frame.to_dataframe(metric)
+        table.columns = [f"{det}__{metric}" for det in frame.detector_ids]
+        tables.append(table.mask(table == -1.00))
+    df_processed = pd.concat(tables, axis=1)
 
     df_processed = df_processed.sort_index(axis=1)
     df_processed = df_processed.sort_index()
@@ -131,7 +105,14 @@ def parse_sumo_xml_to_dataframe():
         return None
 
 
-def perform_granger_causality_tests(df_data):
+def build_allowed_mask(columns):
+    """按路网拓扑生成序列对掩码 [target, source]；未启用剪枝或路网文件无法解析时返回 None（检验全部序列对）"""
+    # 列名为 "<检测器ID>__<指标>"
+    series_detectors = [column.rsplit('__', 1)[0] for column in columns]
+    return load_allowed_mask(series_detectors, NETWORK_XML, DETECTOR_ADD_XML, TOPOLOGY_HOPS)
+
+
+def perform_granger_causality_tests(df_data, allowed=None):
     if df_data is None or df_data.empty:
         print("没有可用于格兰杰因果检验的数据。")
         return
@@ -139,43 +120,45 @@ def perform_granger_causality_tests(df_data):
     print(f"\n--- 开始执行格兰杰因果检验 (最大滞后阶数: {MAX_LAG}) ---")
 
     all_series_columns = df_data.columns.tolist()
-    num_tests_performed = 0
-
-    for i in range(len(all_series_columns)):
-        for j in range(len(all_series_columns)):
-            if i == j:
-                continue
-
-            series_A_name = all_series_columns[i]
-            series_B_name = all_series_columns[j]
-
-            df_pair = df_data[[series_A_name, series_B_name]]
-            df_pair_cleaned = df_pair.dropna()
-
-            min_data_points_required = MAX_LAG * 2 + 10
-
-            if len(df_pair_cleaned) < min_data_points_required:
-                continue
-
-            try:
-                gc_result = grangercausalitytests(df_pair_cleaned, maxlag=MAX_LAG, verbose=False)
-                num_tests_performed += 1
-
-                for lag, (test_stats, _, _, _) in gc_result.items():
-                    p_value_f_test = test_stats['params_ftest'][1]
-                    significance_level = 0.05
-                    decision = "不 Granger 引起" if p_value_f_test > significance_level else "Granger 引起"
-
-                    print(
-                        f"  - 滞后阶数 {lag}: '{series_B_name}' {decision} '{series_A_name}' (p-value: {p_value_f_test:.4f})")
-
-            except Exception as e:
-                print(f"  ERROR: 对 '{series_A_name}' 与 '{series_B_name}' 进行格兰杰检验时出错: {e}")
+    # 按目标序列分块批量计算，每对只使用两者都有效的时刻，有效时刻不足的序列对结果为 NaN；
+    # 已完成的分块保存在 GC_CHECKPOINT_DIR，中断后重新运行只计算剩余分块
+    min_obs = MAX_LAG * 2 + 10
+    f_stat, p_value = granger_chunked(df_data.values, MAX_LAG, GC_CHECKPOINT_DIR, min_obs=min_obs,
+                                      chunk_size=GC_CHUNK_SIZE, workers=GC_WORKERS, allowed=allowed)
+    tested = np.isfinite(p_value).any(axis=-1)
+    num_tests_performed = int(tested.sum())
+
+    if PRINT_PAIR_RESULTS:
+        for i, j in zip(*np.nonzero(tested)):
+            for lag in range(1, MAX_LAG + 1):
+                p_value_f_test = p_value[i, j, lag - 1]
+                if np.isnan(p_value_f_test):
+                    continue
+                decision = "不 Granger 引起" if p_value_f_test > SIGNIFICANCE_LEVEL else "Granger 引起"
+                print(f"  - 滞后阶数 {lag}: '{all_series_columns[j]}' {decision} '{all_series_columns[i]}' "
+                      f"(p-value: {p_value_f_test:.4f})")
 
     if num_tests_performed == 0:
         print("\n没有足够的数据或条件来执行任何格兰杰因果检验。")
-    else:
-        print(f"\n--- 完成了 {num_tests_performed} 项格兰杰因果检验 ---")
+        return
+
+    os.makedirs(os.path.dirname(GC_RESULTS_NPZ), exist_ok=True)
+    save_granger(GC_RESULTS_NPZ, all_series_columns, f_stat, p_value)
+    with np.errstate(invalid='ignore'):
+        significant = (p_value <= SIGNIFICANCE_LEVEL).sum(axis=(0, 1))
+    for lag in range(1, MAX_LAG + 1):
+        print(f"  - 滞后阶数 {lag}: {significant[lag - 1]} 对显著 (p-value <= {SIGNIFICANCE_LEVEL})")
+    print(f"\n--- 完成了 {num_tests_performed} 项格兰杰因果检验，结果已保存到：'{GC_RESULTS_NPZ}' ---")
+
+    if STATSMODELS_CHECK_PAIRS:
+        try:
+            check = compare_with_statsmodels(df_data.values, f_stat, p_value, n_pairs=STATSMODELS_CHECK_PAIRS,
+                                             min_obs=min_obs)
+        except ImportError:
+            print("WARNING: 未安装 statsmodels，跳过核对。")
+            return
+        print(f"INFO: 与 statsmodels 核对 {check['pairs']} 个序列对：F 统计量最大相对误差 {check['f_rel_err']:.2e}，"
+              f"p 值最大绝对误差 {check['p_abs_err']:.2e}")
 
 
 def main():
@@ -197,7 +180,7 @@ def main():
         df_for_granger = pd.read_csv(INTERMEDIATE_DATA_CSV, index_col=0)
         # 确保加载的 DataFrame 的数据类型正确，尤其 NaN 值
         df_for_granger = df_for_granger.apply(pd.to_numeric, errors='coerce')
-        perform_granger_causality_tests(df_for_granger)
+        perform_granger_causality_tests(df_for_granger, allowed=build_allowed_mask(df_for_granger.columns))
     except FileNotFoundError:
         print(f"ERROR: 中间数据 CSV 文件未找到：'{INTERMEDIATE_DATA_CSV}'。请检查文件是否已成功创建。")
     except pd.errors.EmptyDataError:
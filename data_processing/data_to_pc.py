@@ -4,8 +4,14 @@ import os
 import xml.etree.ElementTree as ET
 import csv
 import json
+import time
+import numpy as np
 import pandas as pd
-from collections import defaultdict
+from data_processing.detector_frame import DetectorFrame
+from data_processing.detector_index import index_from_ids, load_detector_index, split_detector_id
+from data_processing.parse_cache import load_intervals
+from edpf.pc import pc_skeleton, save_skeleton
+from edpf.topology import load_allowed_mask
 
 BASE_DIR = ".."
 
@@ -13,8 +19,19 @@ SUMO_OUTPUT_XML = os.path.join(BASE_DIR, "emulation", "e1output.xml")
 OUTPUT_CSV = os.path.join(BASE_DIR, "data", "pc_input_data.csv")
 DETECTORS_CSV = os.path.join(BASE_DIR, "data", "detectors.csv")
 ANOMALY_RESULTS_JSON = os.path.join(BASE_DIR, "data", "anomaly_results.json")
-
-def load_detector_ids_from_json():
+PC_SKELETON_NPZ = os.path.join(BASE_DIR, "data", "pc_skeleton.npz")
+NETWORK_XML = os.path.join(BASE_DIR, "emulation", "map.net.xml")
+DETECTOR_ADD_XML = os.path.join(BASE_DIR, "emulation", "e4.add.xml")
+JUNCTION_JSON = os.path.join(BASE_DIR, "data", "junction_data.json")
+DETECTOR_INDEX_JSON = os.path.join(BASE_DIR, "data", "detector_index.json")
+
+RUN_PC_SKELETON = True  # Run the built-in PC skeleton search on the output matrix
+PC_ALPHA = 0.05
+PC_MAX_DEPTH = 2  # Largest conditioning set size; None runs until no edge can be tested
+PC_WORKERS = os.cpu_count() or 1
+TOPOLOGY_HOPS = 2  # Only start with edges between detectors within this many road hops; None keeps all pairs
+
+def load_detector_ids_from_json(detector_index):
     try:
         with open(ANOMALY_RESULTS_JSON, 'r', encoding='utf-8') as f:
             anomaly_results = json.load(f)
@@ -28,15 +45,16 @@ def load_detector_ids_from_json():
                 continue
             detector_id_str = detector_info.get("detector_id")
             if detector_id_str and isinstance(detector_id_str, str):
-                parts = detector_id_str.split('_')
-                if len(parts) > 1 and parts[-1].isdigit():
-                    base_id = "_".join(parts[:-1])
-                    base_ids.append(base_id)
+                # IDs that are not full detector IDs are kept and resolved against the index later
+                if detector_index is None:
+                    base_ids.append(split_detector_id(detector_id_str)[0])
+                elif detector_id_str in detector_index:
+                    base_ids.append(detector_index.base(detector_id_str))
                 else:
                     base_ids.append(detector_id_str)
             else:
                  print(f"Warning: Skipping detector with missing or invalid 'detector_id': {detector_info}")
-        unique_base_ids = list(set(base_ids))
+        unique_base_ids = list(dict.fromkeys(base_ids))
         if not unique_base_ids:
             print("Warning: No valid detector IDs were extracted from the JSON file.")
         return unique_base_ids
@@ -72,30 +90,53 @@ def load_detector_ids_from_csv():
         print(f"An unexpected error occurred while loading detector IDs from CSV: {e}")
         return []
 
-def get_target_detector_ids(mode):
+def get_target_detector_ids(mode, detector_index):
     if mode == "1":
-        return load_detector_ids_from_json()
+        return load_detector_ids_from_json(detector_index)
     elif mode == "2":
         return load_detector_ids_from_csv()
     else:
         print("Invalid mode selected. Please choose '1' or '2'.")
         return []
 
+def run_pc_skeleton(matrix, detector_ids):
+    allowed = load_allowed_mask(detector_ids, NETWORK_XML, DETECTOR_ADD_XML, TOPOLOGY_HOPS)
+    start = time.perf_counter()
+    adjacency, sepsets = pc_skeleton(matrix, alpha=PC_ALPHA, max_depth=PC_MAX_DEPTH, workers=PC_WORKERS,
+                                     allowed=allowed)
+    elapsed = time.perf_counter() - start
+    try:
+        save_skeleton(PC_SKELETON_NPZ, detector_ids, adjacency, sepsets, PC_ALPHA)
+    except Exception as e:
+        print(f"Error: Failed to save PC skeleton to '{PC_SKELETON_NPZ}'. Details: {e}")
+        return
+    print(f"PC skeleton: {int(adjacency.sum()) // 2} edges, {len(sepsets)} separating sets ({elapsed:.1f}s), "
+          f"saved to '{PC_SKELETON_NPZ}'")
+
 def main():
     mode = input("Choose input mode (1: Use base IDs from JSON, 2: Use full IDs from CSV): ").strip()
     if mode not in ['1', '2']:
         print("Invalid input. Exiting.")
         return
 
-    target_ids_input = get_target_detector_ids(mode)
+    # Only mode 1 maps base IDs to detectors; without a readable detector file the base ID and lane
+    # suffix are split off the detector IDs instead
+    detector_index = None
+    if mode == "1":
+        try:
+            detector_index = load_detector_index(DETECTOR_ADD_XML, JUNCTION_JSON, DETECTOR_INDEX_JSON)
+        except (OSError, ET.ParseError) as e:
+            print(f"Warning: Failed to build the detector index from '{DETECTOR_ADD_XML}'; "
+                  f"splitting lane suffixes off the detector IDs instead. Details: {e}")
+
+    target_ids_input = get_target_detector_ids(mode, detector_index)
     if not target_ids_input:
         print("No target detector IDs were loaded. Exiting.")
         return
     print(f"Selected target IDs ({len(target_ids_input)}): {target_ids_input[:5]}..." if len(target_ids_input) > 5 else target_ids_input)
 
     try:
-        tree = ET.parse(SUMO_OUTPUT_XML)
-        root = tree.getroot()
+        records = load_intervals(SUMO_OUTPUT_XML, fields=['begin', 'speed'])
     except FileNotFoundError:
         print(f"Error: SUMO XML file not found at '{SUMO_OUTPUT_XML}'. Please ensure the path is correct.")
         return
@@ -106,81 +147,30 @@ def main():
         print(f"An unexpected error occurred while opening or parsing the XML file: {e}")
         return
 
-    intervals_data = defaultdict(dict)
-    all_found_detector_ids = set()
-    all_time_steps = set()
-
-    for interval_element in root.findall('interval'):
-        detector_id = interval_element.get('id')
-        speed_str = interval_element.get('speed')
-        begin_time_str = interval_element.get('begin')
+    # Time steps are begin rounded to 2 decimals; records without a speed are ignored
+    frame = DetectorFrame.from_records(records, ['speed'], time_decimals=2,
+                                       mask=~np.isnan(records.columns['speed']))
+    all_found_detector_ids = set(frame.detector_ids)
 
-        if not (detector_id and speed_str and begin_time_str):
-            continue
-
-        try:
-            speed = float(speed_str)
-            begin_time = float(begin_time_str)
-            time_key = round(begin_time, 2)
-
-            intervals_data[time_key][detector_id] = speed
-            all_found_detector_ids.add(detector_id)
-            all_time_steps.add(time_key)
-
-        except ValueError:
-            continue
-        except TypeError:
-             continue
-
-    if not intervals_data:
+    if not all_found_detector_ids:
         print("No valid interval data could be extracted from the SUMO output file.")
         return
 
-    sorted_time_steps = sorted(list(all_time_steps))
-
     final_columns_ordered = []
-    structured_rows_data = []
 
     if mode == "1":
-        detector_groups = defaultdict(list)
-        for found_id in sorted(list(all_found_detector_ids)):
-            parts = found_id.split('_')
-            base_id = found_id
-            suffix = ''
-            if len(parts) > 1 and parts[-1].isdigit():
-                suffix = parts[-1]
-                base_id = "_".join(parts[:-1])
-
-            if base_id in target_ids_input:
-                detector_groups[base_id].append({'full_id': found_id, 'suffix': suffix})
-
-        sorted_base_ids = sorted(detector_groups.keys())
-        for base_id in sorted_base_ids:
-            detector_groups[base_id].sort(key=lambda x: int(x['suffix']) if x['suffix'].isdigit() else float('inf'))
-            for det_info in detector_groups[base_id]:
-                final_columns_ordered.append(det_info['full_id'])
-
-        for time_step in sorted_time_steps:
-            row_data = {}
-            for base_id in sorted_base_ids:
-                if base_id in detector_groups:
-                    for det_info in detector_groups[base_id]:
-                        full_id = det_info['full_id']
-                        speed = intervals_data[time_step].get(full_id, -1.00)
-                        row_data[full_id] = speed
-            structured_rows_data.append(row_data)
+        # Detectors of each base ID come back from the index ordered by lane suffix
+        if detector_index is None:
+            detector_index = index_from_ids(all_found_detector_ids)
+        for base_id in sorted(target_ids_input):
+            for found_id in detector_index.resolve(base_id):
+                if found_id in all_found_detector_ids:
+                    final_columns_ordered.append(found_id)
+        final_columns_ordered = list(dict.fromkeys(final_columns_ordered))
 
     elif mode == "2":
         valid_target_full_ids = {tid for tid in target_ids_input if tid in all_found_detector_ids}
         final_columns_ordered = sorted(list(valid_target_full_ids))
-
-        for time_step in sorted_time_steps:
-            row_data = {}
-            current_time_data = intervals_data.get(time_step, {})
-            for col_id in final_columns_ordered:
-                speed = current_time_data.get(col_id, -1.00)
-                row_data[col_id] = speed
-            structured_rows_data.append(row_data)
     else:
         print("Internal Error: Invalid mode encountered during data processing.")
         return
@@ -189,7 +179,8 @@ def main():
         print("No matching detector data found for the specified targets. Cannot create CSV output.")
         return
 
-    df_output = pd.DataFrame(structured_rows_data, columns=final_columns_ordered)
+    # One row per time step; detectors without a reading at that time get -1.00
+    df_output = frame.select(final_columns_ordered).to_dataframe('speed').reset_index(drop=True)
     df_output.fillna(-1.00, inplace=True)
 
     column_rename_map = {original_col: f'X{i+1}' for i, original_col in enumerate(final_columns_ordered)}
@@ -201,6 +192,10 @@ def main():
         print(f"Output CSV contains {len(df_output)} rows (time steps) and {len(df_output.columns)} columns (detectors).")
     except Exception as e:
         print(f"Error: Failed to save data to CSV file '{OUTPUT_CSV}'. Details: {e}")
+        return
+
+    if RUN_PC_SKELETON:
+        run_pc_skeleton(df_output.values.astype(np.float64), final_columns_ordered)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,9 +1,11 @@
 import os
-import xml.etree.ElementTree as ET
 import csv
 import json
+import xml.etree.ElementTree as ET
 import pandas as pd
 
+from data_processing.detector_index import load_detector_index
+from data_processing.e1_reader import iter_intervals
 from files_path.file_path import emulation_path, data_path, data_pro_path
 
 # Paths
@@ -63,47 +65,21 @@ def main():
     if not target_ids:
         return
 
-    # Parse the XML file
-    tree = ET.parse(input_data_path)
-    root = tree.getroot()
-
-    # Load the detectors CSV file
-    df = pd.read_csv(detectors_path)
-    lane_ids = df['lane_id'].tolist()
-    det_ids = df['det_id'].tolist()
-
-    # Build a hash table for lane_id to det_id mapping
-    lane_id_dict = {lane_id: det_id for lane_id, det_id in zip(lane_ids, det_ids)}
-
-    # Initialize a dictionary to store matches
-    matches = {}
-
-    # Map target_ids to det_ids
-    print(target_ids)
-    for target_id in target_ids:
-        print(target_id)
-        print("1")
-        if target_id in lane_id_dict:
-            matches[target_id] = lane_id_dict[target_id]
-        else:
-            suffix_count = 0
-            while True:
-                modified_target_id = f"{target_id}_{suffix_count}"
-                if modified_target_id in lane_id_dict:
-                    matches[target_id] = lane_id_dict[modified_target_id]
-                    break
-                suffix_count += 1
-
-    # Initialize a list to store the new target IDs
+    # Map targets to detectors: detector IDs are kept, lane, edge and junction IDs map to the
+    # detector on their lowest lane suffix
+    try:
+        detector_index = load_detector_index()
+    except (OSError, ET.ParseError) as e:
+        print(f"Error: Failed to build the detector index from e4.add.xml. Details: {e}")
+        return
     new_target_ids = []
-
-    print("1")
-    # Replace target_ids with their corresponding det_ids
     for target_id in target_ids:
-        if target_id in matches:
-            new_target_ids.append(matches[target_id])
+        detectors = detector_index.resolve(target_id)
+        if detectors:
+            new_target_ids.append(detectors[0])
         else:
-            new_target_ids.append(target_id)  # Keep the original ID if no match is found
+            print(f"Warning: '{target_id}' is not a known detector, lane or edge ID; keeping it unchanged.")
+            new_target_ids.append(target_id)
 
     # Use the new target IDs
     target_ids = new_target_ids
@@ -111,18 +87,16 @@ def main():
     # Store speed data in a dictionary
     speed_data = {id_value: {} for id_value in target_ids}
 
-    # Traverse the XML tree
-    for interval in root.findall('interval'):
+    # Stream the intervals of the XML file
+    for interval in iter_intervals(input_data_path):
         id_value = interval.get('id')
-        speed_value = interval.get('speed')
+        # Only keep the target detectors within the time range
+        if id_value not in speed_data:
+            continue
         begin_value = float(interval.get('begin'))
-
-        # Check if the ID is in the target_ids and within the time range
         if 0 <= begin_value <= 3600:
-            for target_id in target_ids:
-                if target_id == id_value:
-                    suffix = id_value.split('_')[-1]
-                    speed_data[target_id].setdefault(suffix, []).append(speed_value)
+            suffix = detector_index.suffix(id_value) if id_value in detector_index else None
+            speed_data[id_value].setdefault(suffix, []).append(interval.get('speed'))
 
     # Write the data to a CSV file
     with open(output_data_path, 'w', newline='') as csvfile:
@@ -131,18 +105,16 @@ def main():
         # Write the header row
         header = []
         for target_id in target_ids:
-            header.extend([f'e1det_{target_id}_{suffix}' for suffix in sorted(speed_data[target_id].keys())])
+            header.extend([f'e1det_{target_id}_{suffix}' for suffix in speed_data[target_id]])
         writer.writerow(header)
 
         # Write the speed data
         num_intervals = max(
             len(speed_data[target_id][suffix]) for target_id in target_ids for suffix in speed_data[target_id])
-        print(num_intervals)
         for i in range(num_intervals):
-            print(i)
             row = []
             for target_id in target_ids:
-                for suffix in sorted(speed_data[target_id].keys()):
+                for suffix in speed_data[target_id]:
                     if i < len(speed_data[target_id][suffix]):
                         row.append(speed_data[target_id][suffix][i])
                     else:
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import numpy as np
+from data_processing.data_to_gc import build_allowed_mask, create_dummy_files_for_granger, parse_sumo_xml_to_dataframe
+from edpf.var import fit_sparse_var, save_var
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.join(SCRIPT_DIR, "..")
+
+VAR_RESULTS_NPZ = os.path.join(PROJECT_ROOT, "data", "var_results.npz")  # 稀疏 VAR 的影响矩阵与系数
+
+MAX_LAG = 5
+MIN_RATIO = 0.5  # lambda 路径的终点（相对每个目标的 lambda_max），越小模型越稠密
+N_LAMBDAS = 10
+TOP_EDGES = 20  # 打印影响最强的检测器对数量
+
+
+def detector_influence(columns, influence):
+    """将序列间的影响矩阵按检测器汇总（各指标对的平方和开方），返回 (detector_ids, [target, source])"""
+    series_detectors = [column.rsplit('__', 1)[0] for column in columns]
+    detector_ids = list(dict.fromkeys(series_detectors))
+    index = {det: i for i, det in enumerate(detector_ids)}
+    code = np.array([index[det] for det in series_detectors], dtype=np.int64)
+    squared = np.zeros((len(detector_ids), len(detector_ids)))
+    np.add.at(squared, (code[:, None], code[None, :]), influence ** 2)
+    np.fill_diagonal(squared, 0.0)
+    return detector_ids, np.sqrt(squared)
+
+
+def main():
+    create_dummy_files_for_granger()
+
+    # 与 GC 转换脚本使用同一份解析后的 detector__metric 时间序列
+    print("--- 开始解析 SUMO XML 并准备数据 ---")
+    df_data = parse_sumo_xml_to_dataframe()
+    if df_data is None:
+        print("未能成功准备数据，退出程序。")
+        return
+    print(f"INFO: DataFrame 包含 {df_data.shape[0]} 个时间步和 {df_data.shape[1]} 个 detector__metric 时间序列。")
+    if df_data.shape[0] <= MAX_LAG * 2 + 10:
+        print("时间步不足，无法拟合 VAR 模型。")
+        return
+
+    columns = df_data.columns.tolist()
+    print(f"\n--- 开始拟合稀疏 VAR (最大滞后阶数: {MAX_LAG}, lambda 路径: 1 → {MIN_RATIO}) ---")
+    start = time.perf_counter()
+    influence, coef, entry = fit_sparse_var(df_data.values, MAX_LAG, min_ratio=MIN_RATIO, n_lambdas=N_LAMBDAS,
+                                            allowed=build_allowed_mask(columns))
+    print(f"INFO: 拟合完成，耗时 {time.perf_counter() - start:.1f}s，非零影响 {int((influence > 0).sum())} 个序列对")
+
+    detector_ids, det_influence = detector_influence(columns, influence)
+    os.makedirs(os.path.dirname(VAR_RESULTS_NPZ), exist_ok=True)
+    save_var(VAR_RESULTS_NPZ, columns, influence, coef, entry,
+             detector_ids=np.array(detector_ids, dtype=str), detector_influence=det_influence)
+
+    order = np.argsort(det_influence, axis=None)[::-1][:TOP_EDGES]
+    print(f"\n--- 影响最强的 {len(order)} 个检测器对 ---")
+    for flat in order:
+        target, source = np.unravel_index(flat, det_influence.shape)
+        if det_influence[target, source] <= 0:
+            break
+        print(f"  - '{detector_ids[source]}' → '{detector_ids[target]}': {det_influence[target, source]:.4f}")
+    print(f"\n--- 结果已保存到：'{VAR_RESULTS_NPZ}' ---")
+
+
+if __name__ == "__main__":
+    main()
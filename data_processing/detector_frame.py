@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+
+class DetectorFrame:
+    """检测器时间序列的稠密表示：[time, detector, feature] 数组，缺失处为 NaN
+
+    times 为升序时间轴，detector_ids 为列顺序，index 为 检测器ID→列下标。
+    按时间范围、单个特征或单个检测器取子集时返回共享内存的视图；按检测器子集取子集时，
+    若所选检测器在列上连续则同样为视图，否则复制所选列。
+    """
+
+    def __init__(self, values, times, detector_ids, features):
+        self.values = values
+        self.times = np.asarray(times)
+        self.detector_ids = list(detector_ids)
+        self.features = list(features)
+        self.index = {det: j for j, det in enumerate(self.detector_ids)}
+        if values.shape != (len(self.times), len(self.detector_ids), len(self.features)):
+            raise ValueError(f"数组形状 {values.shape} 与时间轴、检测器或特征数量不一致")
+
+    @classmethod
+    def from_records(cls, records, features, dtype=np.float32, time_decimals=None, mask=None):
+        """由 E1Arrays 构建；同一时刻同一检测器重复出现时以最后一条为准，缺少 id 或 begin 的记录被跳过
+
+        time_decimals 不为 None 时先将 begin 四舍五入到指定小数位再作为时间轴；
+        mask 为记录级布尔掩码，只使用其中为 True 的记录。
+        """
+        begin = records.columns['begin']
+        if time_decimals is not None:
+            begin = np.round(begin, time_decimals)
+        has_id = np.array([bool(det) for det in records.detector_ids], dtype=bool)
+        keep = ~np.isnan(begin) & has_id[records.codes]
+        if mask is not None:
+            keep &= mask
+        keep = np.flatnonzero(keep)
+
+        # 只保留实际出现过的检测器，按首次出现的顺序排列
+        codes = records.codes[keep]
+        present, first = np.unique(codes, return_index=True)
+        order = present[np.argsort(first)]
+        column = np.empty(len(records.detector_ids), dtype=np.int64)
+        column[order] = np.arange(len(order))
+
+        times, time_idx = np.unique(begin[keep], return_inverse=True)
+        values = np.full((len(times), len(order), len(features)), np.nan, dtype=dtype)
+        for k, feature in enumerate(features):
+            values[time_idx, column[codes], k] = records.columns[feature][keep]
+        return cls(values, times, [records.detector_ids[code] for code in order], features)
+
+    @classmethod
+    def from_series(cls, series, features, dtype=np.float32):
+        """由 [(detector_id, times, values[n, feature]), ...] 构建；同一时刻重复出现时保留第一个值"""
+        detector_ids = [detector_id for detector_id, _, _ in series]
+        if series:
+            times = np.unique(np.concatenate([np.asarray(t, dtype=np.int64) for _, t, _ in series]))
+        else:
+            times = np.empty(0, dtype=np.int64)
+        values = np.full((len(times), len(detector_ids), len(features)), np.nan, dtype=dtype)
+        for j, (_, det_times, det_values) in enumerate(series):
+            idx = np.searchsorted(times, det_times)
+            values[idx[::-1], j] = det_values[::-1]
+        return cls(values, times, detector_ids, features)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def mask(self):
+        """有效（非 NaN）位置"""
+        return ~np.isnan(self.values)
+
+    def counts(self):
+        """每个检测器至少有一个有效特征的时间点数"""
+        return self.mask.any(axis=-1).sum(axis=0)
+
+    def feature(self, name):
+        """单个特征的 [time, detector] 视图"""
+        return self.values[:, :, self.features.index(name)]
+
+    def detector(self, detector_id):
+        """单个检测器的 [time, feature] 视图"""
+        return self.values[:, self.index[detector_id]]
+
+    def time_range(self, start=None, end=None):
+        """时间在 [start, end] 内的子帧（视图）"""
+        lo = 0 if start is None else np.searchsorted(self.times, start, side='left')
+        hi = len(self.times) if end is None else np.searchsorted(self.times, end, side='right')
+        return DetectorFrame(self.values[lo:hi], self.times[lo:hi], self.detector_ids, self.features)
+
+    def select(self, detector_ids):
+        """按给定顺序选取检测器子集，跳过不存在的检测器；所选列连续时返回视图"""
+        columns = [self.index[det] for det in detector_ids if det in self.index]
+        if columns and columns == list(range(columns[0], columns[0] + len(columns))):
+            values = self.values[:, columns[0]:columns[0] + len(columns)]
+        else:
+            values = self.values[:, columns]
+        return DetectorFrame(values, self.times, [self.detector_ids[j] for j in columns], self.features)
+
+    def to_dataframe(self, feature):
+        """单个特征的宽表：行为时间，列为检测器"""
+        return pd.DataFrame(self.feature(feature), index=self.times, columns=self.detector_ids)
+
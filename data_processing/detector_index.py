@@ -0,0 +1,159 @@
+import json
+import os
+from collections import defaultdict
+
+from abnormal_injection.get_data import parse_detectors
+from data_processing.parse_cache import default_cache
+from edpf.runner import atomic_path
+from files_path.file_path import emulation_path, data_path
+
+DETECTOR_ADD_XML = os.path.join(emulation_path, "e4.add.xml")
+JUNCTION_JSON = os.path.join(data_path, "junction_data.json")
+INDEX_PATH = os.path.join(data_path, "detector_index.json")
+
+# 每个检测器保存的属性，持久化时按此顺序存为列表
+FIELDS = ('lane', 'edge', 'base', 'suffix', 'junction')
+
+
+class DetectorIndex:
+    """检测器ID、车道ID、道路ID、基础ID（去掉车道序号的检测器ID）、车道序号与所属信号灯路口之间的映射
+
+    records 为 {检测器ID: {lane, edge, base, suffix, junction}}，suffix 为车道序号（整数，无法识别时为 None），
+    junction 为以该车道为进口道的信号灯路口（不在 junction_data.json 中时为 None）。
+    各反向映射在构造时一次建好，查询均为字典查找；同一车道、道路、基础ID、路口下的检测器按车道序号排列。
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.by_lane = defaultdict(list)
+        self.by_edge = defaultdict(list)
+        self.by_base = defaultdict(list)
+        self.by_junction = defaultdict(list)
+        order = sorted(records, key=lambda det: (_suffix_key(records[det]['suffix']), det))
+        for det in order:
+            record = records[det]
+            self.by_lane[record['lane']].append(det)
+            self.by_edge[record['edge']].append(det)
+            self.by_base[record['base']].append(det)
+            if record['junction'] is not None:
+                self.by_junction[record['junction']].append(det)
+
+    def __contains__(self, det_id):
+        return det_id in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def lane(self, det_id):
+        return self.records[det_id]['lane']
+
+    def edge(self, det_id):
+        return self.records[det_id]['edge']
+
+    def base(self, det_id):
+        return self.records[det_id]['base']
+
+    def suffix(self, det_id):
+        return self.records[det_id]['suffix']
+
+    def junction(self, det_id):
+        return self.records[det_id]['junction']
+
+    def resolve(self, key):
+        """key 依次按检测器ID、车道ID、基础ID、道路ID、路口ID查找，返回对应的检测器列表；都不匹配时返回 []"""
+        if key in self.records:
+            return [key]
+        for mapping in (self.by_lane, self.by_base, self.by_edge, self.by_junction):
+            if key in mapping:
+                return list(mapping[key])
+        return []
+
+    def to_json(self):
+        return {det: [record[field] for field in FIELDS] for det, record in self.records.items()}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls({det: dict(zip(FIELDS, values)) for det, values in data.items()})
+
+
+def _suffix_key(suffix):
+    return float('inf') if suffix is None else suffix
+
+
+def build_detector_index(add_file=DETECTOR_ADD_XML, junction_file=JUNCTION_JSON):
+    """由检测器配置文件与 junction_data.json 构建 DetectorIndex；junction_file 不存在时不记录所属路口"""
+    lane_to_detectors, _ = parse_detectors(add_file)
+
+    lane_junction = {}
+    if junction_file is not None and os.path.exists(junction_file):
+        with open(junction_file, encoding='utf-8') as f:
+            junctions = json.load(f)
+        for jid, entry in junctions.items():
+            for det in entry.get('detectors', []):
+                lane_junction[det] = jid
+
+    records = {}
+    for lane, detectors in lane_to_detectors.items():
+        # SUMO 的车道ID为 {道路ID}_{车道序号}
+        edge, _, index = lane.rpartition('_')
+        if not edge or not index.isdigit():
+            edge, index = lane, None
+        suffix = None if index is None else int(index)
+        for det in detectors:
+            tail = f"_{index}"
+            base = det[:-len(tail)] if index is not None and det.endswith(tail) else det
+            records[det] = {'lane': lane, 'edge': edge, 'base': base, 'suffix': suffix,
+                            'junction': lane_junction.get(det)}
+    return DetectorIndex(records)
+
+
+def split_detector_id(det_id):
+    """按 {基础ID}_{车道序号} 拆分检测器ID，返回 (基础ID, 车道序号)；没有数字序号时为 (det_id, None)"""
+    base, _, index = det_id.rpartition('_')
+    if not base or not index.isdigit():
+        return det_id, None
+    return base, int(index)
+
+
+def index_from_ids(detector_ids):
+    """没有检测器配置文件时只由检测器ID构建 DetectorIndex（不含车道、道路与路口信息）"""
+    records = {}
+    for det in detector_ids:
+        base, suffix = split_detector_id(det)
+        records[det] = {'lane': None, 'edge': None, 'base': base, 'suffix': suffix, 'junction': None}
+    return DetectorIndex(records)
+
+
+def _source_digests(add_file, junction_file):
+    cache = default_cache()
+    digests = {'add': cache.digest(add_file), 'junction': None}
+    if junction_file is not None and os.path.exists(junction_file):
+        digests['junction'] = cache.digest(junction_file)
+    return digests
+
+
+def load_detector_index(add_file=DETECTOR_ADD_XML, junction_file=JUNCTION_JSON, index_path=INDEX_PATH):
+    """读取持久化的检测器索引；源文件内容变化或索引文件缺失、损坏时重新构建并写回 index_path"""
+    sources = _source_digests(add_file, junction_file)
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved.get('sources') == sources:
+            return DetectorIndex.from_json(saved['detectors'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_detector_index(add_file, junction_file)
+    directory = os.path.dirname(index_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with atomic_path(index_path) as temp_path:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'sources': sources, 'detectors': index.to_json()}, f, ensure_ascii=False)
+    return index
+
+
+if __name__ == "__main__":
+    detector_index = load_detector_index()
+    print(f"检测器索引: {len(detector_index)} 个检测器, {len(detector_index.by_edge)} 条道路, "
+          f"{len(detector_index.by_junction)} 个路口，已保存到 {INDEX_PATH}")
@@ -0,0 +1,245 @@
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from collections import namedtuple
+from operator import itemgetter
+from xml.parsers import expat
+
+import numpy as np
+
+# 每条 <interval> 记录在 e1output.xml 中大约占用的字节数，用于预估数组容量
+_BYTES_PER_INTERVAL = 180
+
+# expat 每次读入的字节数
+_EXPAT_BUFFER = 1 << 20
+
+E1Arrays = namedtuple('E1Arrays', ['detector_ids', 'codes', 'columns'])
+E1Arrays.__doc__ = """流式读取得到的类型化数组
+
+detector_ids: 按首次出现顺序排列的检测器ID列表
+codes: 每条记录对应 detector_ids 下标的 int32 数组
+columns: {属性名: float64 数组}，缺失或无法解析的属性为 NaN
+"""
+
+
+def iter_intervals(xml_path):
+    """流式遍历 e1 检测器输出中的 <interval> 元素，元素在处理完后立即被清理
+
+    文件打开与根节点解析是立即执行的（FileNotFoundError / ParseError 在调用时抛出），
+    其余记录在迭代过程中增量解析，内存占用与文件大小无关。
+    """
+    context = ET.iterparse(xml_path, events=('start', 'end'))
+    _, root = next(context)
+    return _walk_intervals(context, root)
+
+
+def _walk_intervals(context, root):
+    for event, elem in context:
+        if event == 'end' and elem.tag == 'interval':
+            yield elem
+            elem.clear()
+            root.clear()
+
+
+def _estimate_capacity(xml_path):
+    try:
+        return max(1024, os.path.getsize(xml_path) // _BYTES_PER_INTERVAL)
+    except OSError:
+        return 1024
+
+
+def _to_float(value):
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def read_intervals(xml_path, fields=('begin', 'flow', 'occupancy', 'speed'), parser='expat'):
+    """流式读取 e1 输出，将 id 与指定数值属性写入类型化数组
+
+    parser='expat' 时由 expat 的开始标签回调直接取属性，不创建元素对象；
+    parser='etree' 为基于 ElementTree.iterparse 的原实现，两者结果一致。
+    XML 格式错误统一抛出 xml.etree.ElementTree.ParseError。
+    """
+    if parser == 'etree':
+        return _read_intervals_etree(xml_path, fields)
+    if parser != 'expat':
+        raise ValueError(f"未知的解析器: {parser}")
+    return _read_intervals_expat(xml_path, fields)
+
+
+def _read_intervals_expat(xml_path, fields):
+    fields = list(fields)
+    codes = array('i')
+    rows = array('d')  # 按记录交错存放各属性值，结束后再重排为列
+    index = {}
+    detector_ids = []
+    append_code = codes.append
+    extend_row = rows.extend
+
+    # 属性以 [名, 值, 名, 值, ...] 列表给出（省去 expat 为每个元素构造字典的开销）。
+    # SUMO 输出的属性顺序固定：首条记录确定 id 与各属性值的位置，之后每条只需比较属性名列表
+    layout = {'names': None, 'getter': None}
+
+    def locate(attrs):
+        names = attrs[::2]
+        position = {name: 2 * i + 1 for i, name in enumerate(names)}
+        wanted = ['id'] + fields
+        if all(name in position for name in wanted):
+            getter = itemgetter(*[position[name] for name in wanted])
+            if len(wanted) == 1:
+                getter = (lambda g: lambda attrs: (g(attrs),))(getter)
+        else:
+            # 缺少某些属性时逐项查找，缺失值为 None
+            getter = (lambda pos: lambda attrs: tuple(
+                attrs[pos[name]] if name in pos else None for name in wanted))(position)
+        layout['names'] = names
+        layout['getter'] = getter
+        return getter
+
+    def start_element(name, attrs):
+        if name != 'interval':
+            return
+        getter = layout['getter'] if attrs[::2] == layout['names'] else locate(attrs)
+        values = getter(attrs)
+
+        det_id = values[0]
+        code = index.get(det_id)
+        if code is None:
+            # 检测器ID驻留后，同一ID在各阶段的字典与集合中共享同一个字符串对象
+            code = index[det_id] = len(detector_ids)
+            detector_ids.append(det_id if det_id is None else sys.intern(det_id))
+        append_code(code)
+        try:
+            extend_row(tuple(map(float, values[1:])))
+        except (TypeError, ValueError):
+            extend_row([_to_float(value) for value in values[1:]])
+
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.buffer_size = _EXPAT_BUFFER
+    parser.StartElementHandler = start_element
+    with open(xml_path, 'rb') as f:
+        try:
+            parser.ParseFile(f)
+        except expat.ExpatError as e:
+            # 与 ElementTree 的异常类型保持一致，调用方只需捕获 ParseError
+            err = ET.ParseError(f"{expat.ErrorString(e.code)}: line {e.lineno}, column {e.offset}")
+            err.code = e.code
+            err.position = (e.lineno, e.offset)
+            raise err from None
+
+    table = np.frombuffer(rows, dtype=np.float64).reshape(len(codes), len(fields))
+    return E1Arrays(detector_ids, np.frombuffer(codes, dtype=np.int32).copy(),
+                    {field: table[:, k].copy() for k, field in enumerate(fields)})
+
+
+def _read_intervals_etree(xml_path, fields):
+    capacity = _estimate_capacity(xml_path)
+    codes = np.empty(capacity, dtype=np.int32)
+    columns = {field: np.empty(capacity, dtype=np.float64) for field in fields}
+    index = {}
+    detector_ids = []
+
+    n = 0
+    for interval in iter_intervals(xml_path):
+        if n == capacity:
+            capacity *= 2
+            codes = np.resize(codes, capacity)
+            columns = {field: np.resize(arr, capacity) for field, arr in columns.items()}
+
+        det_id = interval.get('id')
+        code = index.get(det_id)
+        if code is None:
+            code = index[det_id] = len(detector_ids)
+            detector_ids.append(det_id)
+        codes[n] = code
+        for field, arr in columns.items():
+            arr[n] = _to_float(interval.get(field))
+        n += 1
+
+    return E1Arrays(detector_ids, codes[:n].copy(),
+                    {field: arr[:n].copy() for field, arr in columns.items()})
+
+
+def group_by_detector(records, mask=None):
+    """按检测器分组记录下标，返回 [(detector_id, rows), ...]，组内保持文件顺序、组间按首次出现排序"""
+    rows = np.arange(len(records.codes)) if mask is None else np.flatnonzero(mask)
+    if len(rows) == 0:
+        return []
+    codes = records.codes[rows]
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    groups = np.split(rows[order], starts[1:])
+    groups.sort(key=lambda group: group[0])
+    return [(records.detector_ids[records.codes[group[0]]], group) for group in groups]
+
+
+def write_intervals(src_path, dst_path, updates):
+    """流式重写 e1 输出：按记录顺序用 updates[属性] 的值替换对应属性，其余内容保持不变"""
+    context = ET.iterparse(src_path, events=('start', 'end'))
+    _, root = next(context)
+
+    # 根节点以空元素序列化，再改写为开始标签，保留命名空间声明
+    shell = ET.Element(root.tag, root.attrib)
+    start_tag = ET.tostring(shell, encoding='unicode')
+    start_tag = start_tag[:-3] + '>' if start_tag.endswith(' />') else start_tag[:-2] + '>'
+
+    with open(dst_path, 'w', encoding='us-ascii', errors='xmlcharrefreplace') as f:
+        f.write(start_tag)
+        indent = None
+        n = 0
+        for event, elem in context:
+            if event != 'end' or elem.tag != 'interval':
+                continue
+            if indent is None:
+                indent = root.text or '\n'
+            for field, values in updates.items():
+                elem.set(field, str(values[n]))
+            # 元素结束时其尾部空白可能尚未解析，统一按根节点的缩进输出
+            elem.tail = None
+            f.write(indent)
+            f.write(ET.tostring(elem, encoding='unicode'))
+            elem.clear()
+            root.clear()
+            n += 1
+        f.write(f'\n</{root.tag}>')
+
+
+def benchmark(xml_path, fields=('begin', 'flow', 'occupancy', 'speed'), repeat=3):
+    """比较 expat 与 ElementTree 两种解析方式读取同一个 e1 输出的耗时（秒，取最小值）"""
+    timings = {}
+    results = {}
+    for name in ('etree', 'expat'):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results[name] = read_intervals(xml_path, fields, parser=name)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+
+    same = (results['etree'].detector_ids == results['expat'].detector_ids
+            and np.array_equal(results['etree'].codes, results['expat'].codes)
+            and all(np.array_equal(results['etree'].columns[f], results['expat'].columns[f], equal_nan=True)
+                    for f in fields))
+    n = len(results['expat'].codes)
+    print(f"{xml_path}: {n} 条记录，{len(results['expat'].detector_ids)} 个检测器，结果一致: {same}")
+    for name, elapsed in timings.items():
+        print(f"  {name:5s}: {elapsed:.3f}s  ({n / elapsed:,.0f} 条/秒)")
+    print(f"  加速比: {timings['etree'] / timings['expat']:.2f}x")
+    return timings
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python -m data_processing.e1_reader <e1output.xml> [重复次数]")
+    else:
+        benchmark(sys.argv[1], repeat=int(sys.argv[2]) if len(sys.argv) > 2 else 3)
@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from data_processing.detector_frame import DetectorFrame
+from data_processing.e1_reader import read_intervals
+from data_processing.parse_cache import default_cache
+from files_path.file_path import data_path
+
+# 场景数据集的存放目录与默认保存的特征
+STORE_DIR = os.path.join(data_path, "e1_store")
+STORE_FEATURES = ('flow', 'occupancy', 'speed')
+
+# 批量仿真输出文件的后缀：{junction}_{anomaly}_e1.xml
+E1_SUFFIX = "_e1.xml"
+
+
+class E1Store:
+    """按场景、特征分区的 e1 列式数据集
+
+    每个场景一个目录：times.npy 为升序时间轴，<feature>.npy 为 [detector, time] 的 float64 数组，
+    meta.json 记录检测器顺序与源文件哈希。数组按检测器连续存放并以内存映射方式打开，
+    按检测器ID与时间范围读取时只访问所选检测器对应的行片段，而不读入整个场景。
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def scenario_dir(self, scenario):
+        return os.path.join(self.root, scenario)
+
+    def scenarios(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, "meta.json")))
+
+    def meta(self, scenario):
+        with open(os.path.join(self.scenario_dir(scenario), "meta.json"), encoding='utf-8') as f:
+            return json.load(f)
+
+    def ingest(self, xml_path, scenario=None, features=STORE_FEATURES, overwrite=False):
+        """将一个 e1 输出转换为场景分区；源文件内容未变化时跳过，返回场景名"""
+        scenario = scenario or scenario_name(xml_path)
+        digest = default_cache().digest(xml_path)
+        target = self.scenario_dir(scenario)
+        if not overwrite and os.path.exists(os.path.join(target, "meta.json")):
+            meta = self.meta(scenario)
+            if meta.get('digest') == digest and all(feature in meta['features'] for feature in features):
+                return scenario
+
+        records = read_intervals(xml_path, fields=['begin'] + list(features))
+        frame = DetectorFrame.from_records(records, features, dtype=np.float64)
+
+        # 先写入临时目录，全部完成后再替换旧分区，避免读到写了一半的场景
+        os.makedirs(self.root, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=scenario + ".", suffix=".tmp", dir=self.root)
+        try:
+            np.save(os.path.join(temp_dir, "times.npy"), frame.times)
+            for k, feature in enumerate(features):
+                np.save(os.path.join(temp_dir, feature + ".npy"),
+                        np.ascontiguousarray(frame.values[:, :, k].T))
+            meta = {
+                'source': os.path.abspath(xml_path),
+                'digest': digest,
+                'detector_ids': frame.detector_ids,
+                'features': list(features),
+                'n_times': len(frame.times),
+            }
+            with open(os.path.join(temp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            os.replace(temp_dir, target)
+        except Exception:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        return scenario
+
+    def load(self, scenario, detectors=None, start=None, end=None, features=None):
+        """读取一个场景，可按检测器与时间范围 [start, end] 过滤，返回 DetectorFrame
+
+        detectors 按给定顺序返回，不存在于该场景的检测器被跳过；features 默认为场景中的全部特征。
+        """
+        meta = self.meta(scenario)
+        directory = self.scenario_dir(scenario)
+        features = list(features or meta['features'])
+        missing = [feature for feature in features if feature not in meta['features']]
+        if missing:
+            raise KeyError(f"场景 {scenario} 中没有特征: {missing}")
+
+        times = np.load(os.path.join(directory, "times.npy"))
+        lo = 0 if start is None else np.searchsorted(times, start, side='left')
+        hi = len(times) if end is None else np.searchsorted(times, end, side='right')
+
+        if detectors is None:
+            detector_ids = meta['detector_ids']
+            rows = np.arange(len(detector_ids))
+        else:
+            index = {det: j for j, det in enumerate(meta['detector_ids'])}
+            detector_ids = [det for det in detectors if det in index]
+            rows = np.array([index[det] for det in detector_ids], dtype=np.int64)
+
+        values = np.empty((hi - lo, len(rows), len(features)))
+        for k, feature in enumerate(features):
+            table = np.load(os.path.join(directory, feature + ".npy"), mmap_mode='r')
+            # 每个检测器的 [lo, hi) 是文件中的一段连续字节，只有这些片段会被读入
+            values[:, :, k] = table[rows, lo:hi].T
+            del table
+        return DetectorFrame(values, times[lo:hi], detector_ids, features)
+
+    def load_junction(self, scenario, junction_id, start=None, end=None, features=None, junction_path=None):
+        """读取 junction_data.json 中某个路口的检测器"""
+        junction_path = junction_path or os.path.join(data_path, "junction_data.json")
+        with open(junction_path, encoding='utf-8') as f:
+            detectors = json.load(f)[junction_id]['detectors']
+        return self.load(scenario, detectors, start, end, features)
+
+    def remove(self, scenario):
+        shutil.rmtree(self.scenario_dir(scenario), ignore_errors=True)
+
+
+def scenario_name(xml_path):
+    """{junction}_{anomaly}_e1.xml 对应的场景名为 {junction}_{anomaly}，其余文件取去掉扩展名的文件名"""
+    name = os.path.basename(xml_path)
+    if name.endswith(E1_SUFFIX):
+        return name[:-len(E1_SUFFIX)]
+    return os.path.splitext(name)[0]
+
+
+def ingest_directory(directory, store=None, features=STORE_FEATURES):
+    """将目录下所有 *_e1.xml 转换为场景分区，返回场景名列表"""
+    store = store or E1Store()
+    scenarios = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(E1_SUFFIX):
+            continue
+        try:
+            scenarios.append(store.ingest(os.path.join(directory, file_name), features=features))
+        except Exception as e:
+            print(f"转换 {file_name} 失败: {str(e)}")
+    return scenarios
+
+
+if __name__ == "__main__":
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(data_path, "final_output")
+    done = ingest_directory(source_dir)
+    print(f"已转换 {len(done)} 个场景到 {STORE_DIR}")
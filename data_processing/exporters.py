@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from data_processing.detector_frame import DetectorFrame
+from data_processing.parse_cache import load_intervals
+
+# 导出格式及其文件扩展名
+EXPORT_FORMATS = {'xlsx': '.xlsx', 'csv': '.csv', 'npz': '.npz', 'parquet': '.parquet'}
+
+
+def dycause_matrix(frame, feature='speed', decimals=2):
+    """DyCause 输入矩阵 [detector, time]：缺失值与负值记为 0，保留 decimals 位小数"""
+    values = np.asarray(frame.feature(feature), dtype=np.float64).T
+    with np.errstate(invalid='ignore'):
+        return np.round(np.where(values > 0, values, 0.0), decimals)
+
+
+def select_rows(detector_ids, detectors=None):
+    """detectors 非空时返回其中检测器所在的行号（保持原有顺序），否则返回全部行号"""
+    if not detectors:
+        return np.arange(len(detector_ids))
+    return np.array([i for i, det in enumerate(detector_ids) if det in detectors], dtype=np.int64)
+
+
+def export_xlsx(path, detector_ids, times, matrix):
+    """openpyxl 只写模式逐行写出，不为每个单元格保留对象；格式与 DataFrame.to_excel(header=False, index=False) 相同"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    for detector_id, row in zip(detector_ids, matrix.tolist()):
+        sheet.append([detector_id] + row)
+    workbook.save(path)
+
+
+def export_csv(path, detector_ids, times, matrix):
+    """无表头的 CSV，每行为 检测器ID,各时刻的值"""
+    pd.DataFrame(matrix, index=detector_ids).to_csv(path, header=False)
+
+
+def export_npz(path, detector_ids, times, matrix):
+    """未压缩的 npz：detector_ids、times 与 values[detector, time]"""
+    with open(path, 'wb') as f:
+        np.savez(f, detector_ids=np.array(detector_ids, dtype=str), times=np.asarray(times), values=matrix)
+
+
+def export_parquet(path, detector_ids, times, matrix):
+    """列式存储：time 列加每个检测器一列（需要安装 pyarrow 或 fastparquet）"""
+    table = pd.DataFrame(matrix.T, columns=detector_ids)
+    table.insert(0, 'time', np.asarray(times))
+    table.to_parquet(path, index=False)
+
+
+EXPORTERS = {
+    'xlsx': export_xlsx,
+    'csv': export_csv,
+    'npz': export_npz,
+    'parquet': export_parquet,
+}
+
+
+def export_matrix(path, detector_ids, times, matrix, fmt=None):
+    """按 fmt（默认由扩展名决定）导出 [detector, time] 矩阵"""
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in EXPORTERS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    EXPORTERS[fmt](path, detector_ids, times, matrix)
+
+
+def _export_pandas_xlsx(path, detector_ids, times, matrix):
+    rows = [[detector_id] + row for detector_id, row in zip(detector_ids, matrix.tolist())]
+    pd.DataFrame(rows).to_excel(path, index=False, header=False, engine='openpyxl')
+
+
+def benchmark(xml_path, out_dir, repeat=3):
+    """比较各导出格式写出同一个 DyCause 矩阵的耗时（秒，取最小值）与文件大小"""
+    records = load_intervals(xml_path, fields=['begin', 'speed'])
+    frame = DetectorFrame.from_records(records, ['speed'], dtype=np.float64)
+    matrix = dycause_matrix(frame)
+    os.makedirs(out_dir, exist_ok=True)
+    print(f"{xml_path}: {matrix.shape[0]} 个检测器 × {matrix.shape[1]} 个时刻")
+
+    writers = [('xlsx (pandas)', "benchmark_pandas.xlsx", _export_pandas_xlsx)]
+    writers += [(fmt, "benchmark" + EXPORT_FORMATS[fmt], func) for fmt, func in EXPORTERS.items()]
+    report = {}
+    for name, file_name, func in writers:
+        path = os.path.join(out_dir, file_name)
+        best = None
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func(path, frame.detector_ids, frame.times, matrix)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+        except ImportError as e:
+            print(f"  {name:14s}: 跳过（{str(e).splitlines()[0]}）")
+            continue
+        report[name] = (best, os.path.getsize(path))
+        print(f"  {name:14s}: {best:.3f}s  {os.path.getsize(path) / 1024:,.0f} KB")
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("用法: python -m data_processing.exporters <e1output.xml> <输出目录> [重复次数]")
+    else:
+        benchmark(sys.argv[1], sys.argv[2], repeat=int(sys.argv[3]) if len(sys.argv) > 3 else 3)
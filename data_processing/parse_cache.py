@@ -0,0 +1,152 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from data_processing.e1_reader import E1Arrays, read_intervals
+from files_path.file_path import data_path
+
+# 解析缓存目录与容量上限（超出后按最近使用时间淘汰）
+CACHE_DIR = os.path.join(data_path, "parse_cache")
+MAX_CACHE_BYTES = 2 << 30
+
+# 首次解析时总是一并缓存的属性，覆盖各处理阶段的常用字段
+DEFAULT_FIELDS = ('begin', 'flow', 'occupancy', 'speed')
+
+_HASH_CHUNK = 1 << 20
+
+
+class ParseCache:
+    """以源 XML 内容哈希为键的 e1 解析结果缓存
+
+    每个文件的解析结果保存为一个未压缩的 npz（detector_ids、codes 与各属性列），
+    命中时更新文件修改时间，写入后按修改时间从旧到新淘汰，使总大小不超过 max_bytes。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._digests = {}
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, xml_path):
+        """源文件内容的 SHA-1；同一进程内按 (路径, 大小, 修改时间) 记住结果，避免重复计算"""
+        stat = os.stat(xml_path)
+        key = (os.path.abspath(xml_path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            sha = hashlib.sha1()
+            with open(xml_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+                    sha.update(chunk)
+            digest = self._digests[key] = sha.hexdigest()
+        return digest
+
+    def entry_path(self, digest):
+        return os.path.join(self.cache_dir, digest + ".npz")
+
+    def read_intervals(self, xml_path, fields=DEFAULT_FIELDS):
+        """与 e1_reader.read_intervals 相同的返回值，命中缓存时不再解析 XML"""
+        fields = list(fields)
+        path = self.entry_path(self.digest(xml_path))
+        cached = self._load(path, fields)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        # 未命中或缺少字段：连同已缓存的字段一起重新解析，保证条目只增不减
+        self.misses += 1
+        parse_fields = list(dict.fromkeys(list(DEFAULT_FIELDS) + self._cached_fields(path) + fields))
+        records = read_intervals(xml_path, fields=parse_fields)
+        self._store(path, records)
+        return E1Arrays(records.detector_ids, records.codes,
+                        {field: records.columns[field] for field in fields})
+
+    def _cached_fields(self, path):
+        try:
+            with np.load(path) as data:
+                return [name[len("col_"):] for name in data.files if name.startswith("col_")]
+        except (OSError, ValueError):
+            return []
+
+    def _load(self, path, fields):
+        try:
+            with np.load(path) as data:
+                if not all("col_" + field in data.files for field in fields):
+                    return None
+                detector_ids = data['detector_ids'].tolist()
+                for i in np.flatnonzero(data['missing_ids']):
+                    detector_ids[i] = None
+                records = E1Arrays(detector_ids, data['codes'],
+                                   {field: data["col_" + field] for field in fields})
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(path)
+        return records
+
+    def _store(self, path, records):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        arrays = {"col_" + field: values for field, values in records.columns.items()}
+        # 缺少 id 属性的记录以 None 作为检测器ID，单独记录以便原样还原
+        missing_ids = np.array([det is None for det in records.detector_ids], dtype=bool)
+        detector_ids = np.array(['' if det is None else det for det in records.detector_ids], dtype=str)
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, detector_ids=detector_ids, missing_ids=missing_ids,
+                         codes=records.codes, **arrays)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"写入解析缓存失败: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """按最近使用时间淘汰条目，直到缓存总大小不超过 max_bytes"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.cache_dir, name))
+
+
+_default_cache = None
+
+
+def default_cache():
+    """进程内共享的默认缓存（CACHE_DIR 与 MAX_CACHE_BYTES 可在首次使用前修改）"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ParseCache(CACHE_DIR, MAX_CACHE_BYTES)
+    return _default_cache
+
+
+def load_intervals(xml_path, fields=DEFAULT_FIELDS, cache=None):
+    """通过解析缓存读取 e1 输出；cache=False 时直接解析，不读写缓存"""
+    if cache is False:
+        return read_intervals(xml_path, fields=fields)
+    return (cache or default_cache()).read_intervals(xml_path, fields)
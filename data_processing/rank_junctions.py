@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from abnormal_injection.net_index import load_net_index
+from data_processing.detector_index import load_detector_index
+from data_processing.parse_cache import default_cache
+from edpf.localize import JunctionLocalizer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.join(SCRIPT_DIR, "..")
+
+ANOMALY_RESULTS_JSON = os.path.join(PROJECT_ROOT, "data", "anomaly_results.json")
+JUNCTION_JSON = os.path.join(PROJECT_ROOT, "data", "junction_data.json")
+NETWORK_XML = os.path.join(PROJECT_ROOT, "emulation", "map.net.xml")
+DETECTOR_ADD_XML = os.path.join(PROJECT_ROOT, "emulation", "e4.add.xml")
+DETECTOR_INDEX_JSON = os.path.join(PROJECT_ROOT, "data", "detector_index.json")
+LOCALIZER_NPZ = os.path.join(PROJECT_ROOT, "data", "junction_localizer.npz")  # 预先计算的稀疏传播矩阵
+RANKING_JSON = os.path.join(PROJECT_ROOT, "data", "junction_ranking.json")
+
+MAX_HOPS = 2  # 检测器证据最多扩散到几跳以外的交叉口
+DECAY = 0.5  # 每多一跳证据乘以的系数
+EXIT_WEIGHT = 0.5  # 检测器证据分给其所在道路起点交叉口的比例（终点交叉口为 1）
+TOP_JUNCTIONS = 10  # 输出的候选故障路口数量
+
+
+def load_candidates():
+    """junction_data.json 中的路口作为候选；文件不存在时返回 None（使用路网中全部信号灯路口）"""
+    try:
+        with open(JUNCTION_JSON, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"WARNING: 未找到 '{JUNCTION_JSON}'，以路网中全部信号灯路口作为候选")
+        return None
+
+
+def load_localizer(detector_index, junctions):
+    """读取与当前路网、检测器、路口数据、候选路口及参数对应的传播矩阵，不存在或已过期时重新构建并保存
+
+    没有路网时检测器所属路口来自 junction_data.json，因此键中也包含该文件的摘要。
+    """
+    cache = default_cache()
+    try:
+        net_index = load_net_index(NETWORK_XML)
+        net_digest = cache.digest(NETWORK_XML)
+    except (OSError, ET.ParseError) as e:
+        print(f"WARNING: 无法读取路网文件，证据只分配给检测器所属路口: {e}")
+        net_index, net_digest = None, None
+    key = json.dumps({
+        'net': net_digest,
+        'detectors': cache.digest(DETECTOR_ADD_XML),
+        'junctions': cache.digest(JUNCTION_JSON) if os.path.exists(JUNCTION_JSON) else None,
+        'candidates': None if junctions is None else sorted(junctions),
+        'params': [MAX_HOPS, DECAY, EXIT_WEIGHT],
+    }, sort_keys=True)
+
+    try:
+        with np.load(LOCALIZER_NPZ) as f:
+            cached_key = str(f['key'])
+        if cached_key == key:
+            return JunctionLocalizer.load(LOCALIZER_NPZ)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    start = time.perf_counter()
+    localizer = JunctionLocalizer.build(detector_index, net_index, candidates=junctions, max_hops=MAX_HOPS,
+                                        decay=DECAY, exit_weight=EXIT_WEIGHT)
+    os.makedirs(os.path.dirname(LOCALIZER_NPZ), exist_ok=True)
+    localizer.save(LOCALIZER_NPZ, key=key)
+    print(f"INFO: 构建传播矩阵 {len(localizer.candidate_ids)} 个候选路口 × {len(localizer.detector_ids)} 个检测器，"
+          f"耗时 {time.perf_counter() - start:.2f}s")
+    return localizer
+
+
+def main():
+    try:
+        with open(ANOMALY_RESULTS_JSON, 'r', encoding='utf-8') as f:
+            anomaly_results = json.load(f)
+    except FileNotFoundError:
+        print(f"Error: 未找到 '{ANOMALY_RESULTS_JSON}'，请先运行 eDPF 异常检测。")
+        return
+    detector_scores = {item['detector_id']: item['anomaly_score']
+                       for item in anomaly_results.get('top_k_detectors', [])}
+    if not detector_scores:
+        print("Error: 异常检测结果中没有检测器。")
+        return
+
+    try:
+        detector_index = load_detector_index(DETECTOR_ADD_XML, JUNCTION_JSON, DETECTOR_INDEX_JSON)
+    except (OSError, ET.ParseError) as e:
+        print(f"Error: 无法由 '{DETECTOR_ADD_XML}' 构建检测器索引: {e}")
+        return
+    junctions = load_candidates()
+    localizer = load_localizer(detector_index, junctions)
+
+    unknown = [det for det in detector_scores if det not in localizer.detector_code]
+    if unknown:
+        print(f"WARNING: {len(unknown)} 个检测器不在检测器索引中，已忽略: {unknown[:5]}")
+
+    start = time.perf_counter()
+    ranking = localizer.rank(detector_scores, TOP_JUNCTIONS)
+    elapsed = time.perf_counter() - start
+
+    total = sum(evidence for _, evidence in ranking) or 1.0
+    top_junctions = []
+    for jid, evidence in ranking:
+        detectors = junctions[jid]['detectors'] if junctions and jid in junctions \
+            else detector_index.by_junction.get(jid, [])
+        top_junctions.append({'junction_id': jid, 'evidence': evidence, 'share': evidence / total,
+                              'detectors': detectors})
+    result = {
+        'top_junctions': top_junctions,
+        # 候选路口的检测器，可用于缩小 GC/PC/TCDF 的检测器范围
+        'candidate_detectors': list(dict.fromkeys(det for item in top_junctions for det in item['detectors'])),
+    }
+    with open(RANKING_JSON, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+    print(f"\n--- 候选故障路口（排序耗时 {elapsed * 1000:.2f}ms）---")
+    for rank, item in enumerate(top_junctions, 1):
+        print(f"Top {rank}: {item['junction_id']} - 证据 {item['evidence']:.4f} ({item['share']:.1%})")
+    print(f"\n--- 结果已保存到：'{RANKING_JSON}' ---")
+
+
+if __name__ == "__main__":
+    main()
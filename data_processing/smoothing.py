@@ -0,0 +1,51 @@
+import numpy as np
+from scipy.signal import savgol_filter
+
+from data_processing.detector_frame import DetectorFrame
+
+
+def smooth_frame(frame, window_size, poly_order):
+    """对每个检测器、每个特征沿时间轴独立做 Savitzky-Golay 平滑，结果截断为非负，返回新的 DetectorFrame
+
+    没有缺失值的检测器在一次批量调用中完成；有缺失时刻的检测器只在自身的有效点上平滑，缺失处仍为 NaN。
+    """
+    values = np.asarray(frame.values, dtype=np.float64)
+    smoothed = np.full(values.shape, np.nan)
+    valid = ~np.isnan(values)
+    complete = valid.all(axis=0)  # [detector, feature]
+
+    if len(frame.times) and complete.any():
+        det_idx, feat_idx = np.nonzero(complete)
+        smoothed[:, det_idx, feat_idx] = savgol_filter(values[:, det_idx, feat_idx], window_size, poly_order,
+                                                       axis=0, mode='mirror')
+    for j, k in zip(*np.nonzero(~complete & valid.any(axis=0))):
+        rows = np.flatnonzero(valid[:, j, k])
+        smoothed[rows, j, k] = savgol_filter(values[rows, j, k], window_size, poly_order, mode='mirror')
+
+    np.maximum(smoothed, 0, out=smoothed)  # 保证滤波结果非负（NaN 保持不变）
+    return DetectorFrame(smoothed, frame.times, frame.detector_ids, frame.features)
+
+
+def frame_to_records(frame, records, time_decimals=None):
+    """将帧中的值按 records 的记录顺序展开为 {特征: 数组}，供 write_intervals 写回 XML
+
+    每条记录取其 (begin, 检测器) 对应的帧中的值；帧中没有对应位置的记录保留原值。
+    """
+    begin = records.columns['begin']
+    if time_decimals is not None:
+        begin = np.round(begin, time_decimals)
+    column = np.array([frame.index.get(det, -1) for det in records.detector_ids], dtype=np.int64)[records.codes]
+    time_idx = np.clip(np.searchsorted(frame.times, begin), 0, max(len(frame.times) - 1, 0))
+    found = (column >= 0) & ~np.isnan(begin)
+    if len(frame.times):
+        found &= frame.times[time_idx] == begin
+    else:
+        found[:] = False
+
+    updates = {}
+    for k, feature in enumerate(frame.features):
+        original = records.columns[feature]
+        out = original.copy()
+        out[found] = frame.values[time_idx[found], column[found], k]
+        updates[feature] = out
+    return updates
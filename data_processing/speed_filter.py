@@ -1,52 +1,32 @@
 import os
-import xml.etree.ElementTree as ET
-import pandas as pd
-from scipy.signal import savgol_filter
 import numpy as np
 
+from data_processing.detector_frame import DetectorFrame
+from data_processing.e1_reader import write_intervals
+from data_processing.parse_cache import load_intervals
+from data_processing.smoothing import frame_to_records, smooth_frame
 from files_path.file_path import emulation_path, data_path
 
 # 输入文件路径
 input_data_path = os.path.join(emulation_path, "e1output.xml")
 
-# 解析XML文件
-tree = ET.parse(input_data_path)
-root = tree.getroot()
-
-# 提取数据并存储到列表中
-data = []
-for interval in root.findall('interval'):
-    begin = float(interval.get('begin'))
-    end = float(interval.get('end'))
-    id = interval.get('id')
-    flow = float(interval.get('flow'))
-    occupancy = float(interval.get('occupancy'))
-    speed = float(interval.get('speed'))
-    data.append([begin, end, id, flow, occupancy, speed])
-
-# 将数据转换为DataFrame
-df = pd.DataFrame(data, columns=['begin', 'end', 'id', 'flow', 'occupancy', 'speed'])
+# 流式读取XML文件中的数值属性
+features = ['flow', 'occupancy', 'speed']
+records = load_intervals(input_data_path, fields=['begin'] + features)
 
 # 对flow、occupancy和speed列进行平滑处理
 # 假设数据以1秒为间隔，5分钟窗口对应 5*60=300 个点
 window_size = 19  # 必须为奇数
 poly_order = 3
 
-smoothed_data = []
-for column in ['flow', 'occupancy', 'speed']:
-    aspect = df[column].to_numpy()
-    # 应用 Savitzky-Golay 滤波器
-    smooth = savgol_filter(aspect, window_size, poly_order, mode='mirror')
-    smooth = np.maximum(smooth, 0)  # 保证滤波结果非负
-    smoothed_data.append(smooth)
-
-# 更新XML文件中的数据
-for index, interval in enumerate(root.findall('interval')):
-    interval.set('flow', str(smoothed_data[0][index]))
-    interval.set('occupancy', str(smoothed_data[1][index]))
-    interval.set('speed', str(smoothed_data[2][index]))
+# 每个检测器沿时间轴独立应用 Savitzky-Golay 滤波器（结果截断为非负），再按原记录顺序展开
+frame = DetectorFrame.from_records(records, features, dtype=np.float64)
+smoothed = smooth_frame(frame, window_size, poly_order)
+smoothed_data = frame_to_records(smoothed, records)
 
-# 将更新后的XML写回原文件
-tree.write(input_data_path)
+# 流式写出更新后的XML，再替换原文件
+temp_path = input_data_path + ".tmp"
+write_intervals(input_data_path, temp_path, smoothed_data)
+os.replace(temp_path, input_data_path)
 
 print(f"数据处理完成，平滑后的XML文件已保存到原文件: {input_data_path}")
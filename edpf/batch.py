@@ -0,0 +1,78 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from edpf.model_store import MappedModel
+
+# 工作进程内的检测器实例，由 _init_worker 在进程启动时创建一次
+_worker_detector = None
+
+
+def _init_worker(detector_cls, init_kwargs, model_path):
+    global _worker_detector
+    _worker_detector = detector_cls(**init_kwargs)
+    _worker_detector.load_model(model_path)
+
+
+def _detect_one(test_file, output_file):
+    try:
+        return test_file, _worker_detector.detect_anomalies(test_file, output_file, save_results=False), None
+    except Exception as e:
+        return test_file, None, str(e)
+
+
+@contextmanager
+def shared_model_path(detector):
+    """返回工作进程加载模型所用的路径
+
+    二进制模型直接共享同一个内存映射文件；内存中的字典模型先导出为临时 JSON，
+    以保持与主进程完全相同的参数精度。
+    """
+    if isinstance(detector.normal_params, MappedModel):
+        yield detector.normal_params.model_path
+        return
+    with tempfile.TemporaryDirectory() as temp_dir:
+        model_path = os.path.join(temp_dir, "shared_model.json")
+        detector.save_model(model_path)
+        yield model_path
+
+
+def detect_many(detector, files, workers=1, output_files=None):
+    """批量检测多个场景文件，按完成顺序逐个产出 (test_file, sorted_scores)
+
+    workers>1 时每个工作进程只加载一次检测器，并通过内存映射共享同一个二进制模型；
+    单个文件检测失败时打印错误并产出 (test_file, None)。批量检测不写入全局的 anomaly_results.json，
+    各文件的结果只写入对应的 output_file。
+    """
+    files = list(files)
+    output_files = list(output_files) if output_files is not None else [None] * len(files)
+
+    if workers <= 1 or len(files) <= 1:
+        for test_file, output_file in zip(files, output_files):
+            try:
+                result = detector.detect_anomalies(test_file, output_file, save_results=False)
+            except Exception as e:
+                print(f"检测文件 {test_file} 时出错: {e}")
+                result = None
+            yield test_file, result
+        return
+
+    init_kwargs = dict(
+        phase_length=detector.phase_length,
+        time_window=detector.time_window,
+        top_k=detector.top_k,
+        verbose=False,
+        scoring_mode=detector.scoring_mode,
+    )
+    with shared_model_path(detector) as model_path:
+        with ProcessPoolExecutor(max_workers=min(workers, len(files)),
+                                 initializer=_init_worker,
+                                 initargs=(type(detector), init_kwargs, model_path)) as pool:
+            futures = [pool.submit(_detect_one, test_file, output_file)
+                       for test_file, output_file in zip(files, output_files)]
+            for future in as_completed(futures):
+                test_file, result, error = future.result()
+                if error is not None:
+                    print(f"检测文件 {test_file} 时出错: {error}")
+                yield test_file, result
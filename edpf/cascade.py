@@ -0,0 +1,131 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from edpf.rolling import _WINDOW_BUDGET
+from edpf.scoring import phase_scores, score_aligned
+
+# 剪枝比较时留出的相对余量，抵消上界与精确分数各自的浮点舍入
+_BOUND_SLACK = 1e-9
+
+
+def _blocks(rows, block, fill):
+    """[row, time] 按 block 切成 [row, n_blocks, block]，最后不足一块的部分用 fill 补齐"""
+    n_rows, n_time = rows.shape
+    n_blocks = -(-n_time // block)
+    blocks = np.full((n_rows, n_blocks * block), fill, dtype=rows.dtype)
+    blocks[:, :n_time] = rows
+    return blocks.reshape(n_rows, n_blocks, block)
+
+
+def block_window_bound(scores, valid, block, time_window):
+    """各时间块内窗口中位数的上界 [row, n_blocks]，每块只需 O(1) 个分组统计量
+
+    scores/valid 为 [row, time]。每行的有效分数先按顺序压紧，窗口即压紧序列上连续的 w 个值，
+    必然落在从其起点所在块开始的 ceil(w / block) + 1 个连续块内，上中位数（第 w - w//2 大的值）
+    不超过这组块中同名次的值，每组块只做一次 partition。时间块内各时刻的窗口终点最多落在两个压紧块中，
+    取这两块上界的较大者；扩张窗口（压紧序列前 w - 1 个位置）用前 w - 1 个值中相应名次的值界定。
+    返回 (bound, before)，before[:, c] 为时间块 c 之前的有效分数个数。
+    """
+    n_rows, n_time = scores.shape
+    before = np.zeros((n_rows, -(-n_time // block) + 1), dtype=np.int64)
+    np.cumsum(_blocks(valid, block, False).sum(axis=-1), axis=1, out=before[:, 1:])
+
+    # 压紧有效分数，末尾补 -inf 使每组块都完整
+    span = -(-time_window // block) + 1
+    n_packed = max(-(-int(before[:, -1].max()) // block), 1)
+    packed = np.full((n_rows, (n_packed + span - 1) * block), -np.inf)
+    rows, cols = np.nonzero(valid)
+    packed[rows, np.cumsum(valid, axis=1)[rows, cols] - 1] = scores[rows, cols]
+
+    rank = time_window - time_window // 2
+    kth = np.empty((n_rows, n_packed))
+    chunk = max(1, _WINDOW_BUDGET // (n_packed * span * block))
+    for start in range(0, n_rows, chunk):
+        groups = sliding_window_view(packed[start:start + chunk], span * block, axis=1)[:, ::block][:, :n_packed]
+        kth[start:start + chunk] = np.partition(groups, span * block - rank, axis=-1)[..., span * block - rank]
+
+    # 终点位于压紧块 q 的完整窗口，起点块只可能是以下两者之一
+    ends = np.arange(n_packed) * block
+    bound = np.maximum(kth[:, np.maximum(ends - time_window + 1, 0) // block],
+                       kth[:, np.maximum(ends + block - time_window, 0) // block])
+    # 扩张窗口：终点 e 处的窗口为前 e+1 个值，其上中位数不超过前 w-1 个值中第 (e+1) - (e+1)//2 大的值
+    head = -np.sort(-packed[:, :max(time_window - 1, 1)], axis=1)
+    size = np.minimum(ends + 1, head.shape[1])
+    warm = head[:, size - size // 2 - 1]
+    bound = np.where(ends + block - 1 < time_window - 1, warm,
+                     np.where(ends < time_window - 1, np.maximum(warm, bound), bound))
+
+    last = np.maximum(before - 1, 0) // block
+    return np.maximum(np.take_along_axis(bound, last[:, :-1], axis=1),
+                      np.take_along_axis(bound, last[:, 1:], axis=1)), before
+
+
+def weighted_percentile(values, weights, q):
+    """每行把 values 按 weights 重复后的 q 百分位（与 np.percentile 的线性插值一致），权重和为 0 的行为 0"""
+    order = np.argsort(values, axis=1, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=1)
+    cumulative = np.cumsum(np.take_along_axis(weights, order, axis=1), axis=1)
+    total = cumulative[:, -1]
+    position = q / 100 * np.maximum(total - 1, 0)
+    lower = np.floor(position)
+    upper = np.minimum(lower + 1, np.maximum(total - 1, 0))
+    # 第 k 个（从 0 开始）展开值位于累计权重首次超过 k 的位置
+    a, b = [np.take_along_axis(ordered, np.minimum((cumulative <= k[:, None]).sum(axis=1),
+                                                   ordered.shape[1] - 1)[:, None], axis=1)[:, 0]
+            for k in (lower, upper)]
+    with np.errstate(invalid='ignore'):
+        result = a + (b - a) * (position - lower)
+    return np.where(total > 0, result, 0.0)
+
+
+def cascade_bounds(values, times, params, phase_length, time_window, block=None):
+    """由分块聚合量计算各检测器综合异常指数的上界 [detector]
+
+    块长默认为 min(phase_length, time_window // 4)，即不超过一个信号周期。每个特征先得到各时间块内窗口中位数的上界；
+    块内参与平均的特征集合不变时取其平均，否则取最大，作为该块内每个有效时刻综合异常指数的上界，
+    再按各块的有效时刻数加权取 95 百分位。百分位对各时刻的值单调，因而结果不小于 score_aligned 的精确分数。
+    逐时刻只计算一次 MAD 分数并压紧有效值，其余都是每块 O(1) 的计算。
+    """
+    block = block or max(1, min(phase_length, time_window // 4))
+    n_det, n_time, n_feat = values.shape
+    scores, valid = phase_scores(values, times, params, phase_length)
+    rows = scores.transpose(0, 2, 1).reshape(n_det * n_feat, n_time)
+    row_mask = valid.transpose(0, 2, 1).reshape(n_det * n_feat, n_time)
+    window_bound, before = block_window_bound(rows, row_mask, block, time_window)
+    n_blocks = window_bound.shape[1]
+    window_bound = window_bound.reshape(n_det, n_feat, n_blocks)
+    has_window = (before[:, 1:] > 0).reshape(n_det, n_feat, n_blocks)
+    unchanged = (has_window == (before[:, :-1] > 0).reshape(n_det, n_feat, n_blocks)).all(axis=1)
+
+    with np.errstate(invalid='ignore'):
+        mean = np.where(has_window, window_bound, 0.0).sum(axis=1) / has_window.sum(axis=1)
+    largest = np.where(has_window, window_bound, -np.inf).max(axis=1)
+    steps = _blocks(valid.any(axis=-1), block, False).sum(axis=-1)
+    return weighted_percentile(np.where(unchanged, mean, largest), steps, 95)
+
+
+def cascade_scores(values, times, params, phase_length, time_window, top_k, eligible=None, batch=None, block=None):
+    """两阶段筛选：先用上界排除不可能进入 top-K 的检测器，再只对候选精确打分
+
+    eligible 为参与排名的检测器布尔掩码（默认全部）。按上界从高到低分批精确打分，
+    当剩余检测器的上界都低于当前第 K 名的精确分数时停止；返回
+    ({检测器下标: 精确分数}, bounds)，未打分的检测器即被剪枝，不可能进入 top-K。
+    """
+    n_det = values.shape[0]
+    eligible = np.ones(n_det, dtype=bool) if eligible is None else np.asarray(eligible, dtype=bool)
+    bounds = cascade_bounds(values, times, params, phase_length, time_window, block)
+
+    batch = batch or max(2 * top_k, 16)
+    pending = np.flatnonzero(eligible)
+    pending = pending[np.argsort(-bounds[pending], kind='stable')]
+    exact = {}
+    while len(pending):
+        current = pending[:batch]
+        pending = pending[batch:]
+        scores = score_aligned(values[current], times, params[current], phase_length, time_window)
+        exact.update(zip(current.tolist(), scores))
+
+        if len(exact) >= top_k:
+            threshold = np.sort(list(exact.values()))[-top_k]
+            pending = pending[bounds[pending] >= threshold - _BOUND_SLACK * abs(threshold)]
+    return exact, bounds
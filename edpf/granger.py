@@ -0,0 +1,319 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy import stats
+from tqdm import tqdm
+
+from edpf.runner import atomic_path
+
+# 协方差矩阵特征值相对最大特征值低于该阈值时视为奇异方向（用于伪逆与秩）
+_EIG_RCOND = 1e-12
+
+# 每批计算的序列对数量，限制中间数组的内存占用
+_PAIR_CHUNK = 20000
+
+CHECKPOINT_VERSION = 1
+
+# 工作进程内共享的输入与结果文件，由 _init_chunk_worker 在进程启动时以内存映射方式打开
+_worker_state = None
+
+
+def granger_all_pairs(data, max_lag, min_obs=None, targets=None, allowed=None):
+    """全部有序序列对的 Granger 因果 F 检验，与 statsmodels grangercausalitytests 的 F 检验一致
+
+    data: [time, series]，NaN 为缺失。与逐对调用 statsmodels 相同，每一对只使用两者都有效的时刻，
+    并把这些时刻视为连续序列；有效时刻少于 min_obs 的序列对不做检验。
+    返回 (f_stat, p_value)，形状均为 [target, source, lag]（lag 维下标 0 对应滞后 1），
+    检验 source 是否 Granger 引起 target；对角线、数据不足、含常数序列或完全拟合的位置为 NaN。
+    targets 为目标序列下标时只检验这些目标，结果第一维按 targets 的顺序排列；
+    allowed 为 [target, source] 布尔掩码（如 edpf.topology.allowed_pair_mask）时只检验其中为 True 的序列对。
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n_series = data.shape[1]
+    targets = np.arange(n_series) if targets is None else np.asarray(targets, dtype=np.int64)
+    row_of = np.full(n_series, -1, dtype=np.int64)
+    row_of[targets] = np.arange(len(targets))
+    f_stat = np.full((len(targets), n_series, max_lag), np.nan)
+    p_value = np.full((len(targets), n_series, max_lag), np.nan)
+    min_obs = max(min_obs or 0, 2 * max_lag + 2)
+
+    candidates = np.ones((len(targets), n_series), dtype=bool) if allowed is None else np.array(allowed[targets])
+    candidates[np.arange(len(targets)), targets] = False
+    rows, pair_sources = np.nonzero(candidates)
+    for mask, group_targets, group_sources in _pair_groups(~np.isnan(data), targets[rows], pair_sources):
+        if mask.sum() < min_obs:
+            continue
+        _granger_group(data[mask], group_targets, group_sources, max_lag, row_of, f_stat, p_value)
+    return f_stat, p_value
+
+
+def _pair_groups(valid, targets, sources):
+    """按两序列共同有效的时刻将序列对分组，产出 (mask, targets, sources)，同组序列对使用同一组时刻"""
+    if not len(targets):
+        return
+    patterns, pattern_of = np.unique(valid.T, axis=0, return_inverse=True)
+    pattern_of = pattern_of.reshape(-1)
+    combos, combo_of = np.unique(np.stack([pattern_of[targets], pattern_of[sources]], axis=1),
+                                 axis=0, return_inverse=True)
+    combo_of = combo_of.reshape(-1)
+
+    # 不同的有效模式组合可能得到相同的共同有效时刻，合并为一组
+    groups = {}
+    group_of_combo = np.empty(len(combos), dtype=np.int64)
+    for k, (i, j) in enumerate(combos):
+        joint = patterns[i] & patterns[j]
+        group_of_combo[k] = groups.setdefault(joint.tobytes(), (len(groups), joint))[0]
+
+    group_of = group_of_combo[combo_of]
+    order = np.argsort(group_of, kind='stable')
+    bounds = np.flatnonzero(np.r_[True, group_of[order][1:] != group_of[order][:-1], True])
+    joints = [joint for _, joint in sorted(groups.values(), key=lambda item: item[0])]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        rows = order[start:stop]
+        yield joints[group_of[rows[0]]], targets[rows], sources[rows]
+
+
+def _pinv_psd(mats):
+    """对称半正定矩阵（可成批）的伪逆与秩"""
+    w, v = np.linalg.eigh(mats)
+    keep = w > _EIG_RCOND * np.maximum(w[..., -1:], 0)
+    inv_w = np.where(keep, 1.0 / np.where(keep, w, 1.0), 0.0)
+    return (v * inv_w[..., None, :]) @ np.swapaxes(v, -1, -2), keep.sum(axis=-1)
+
+
+def _granger_group(values, targets, sources, max_lag, row_of, f_stat, p_value):
+    """对共享同一组有效时刻的序列对计算全部滞后阶数的 F 统计量，结果写入 f_stat / p_value 的 row_of[target] 行"""
+    columns, local = np.unique(np.concatenate([targets, sources]), return_inverse=True)
+    t_local, s_local = local[:len(targets)], local[len(targets):]
+    x = values[:, columns]
+    x = x - x.mean(axis=0)  # 平移不改变中心化矩，先减均值以减少舍入误差
+    n, n_cols = x.shape
+    width = max_lag + 1
+
+    # shifted[t, i, u] = x[K + t - i, u]，即滞后 i 阶的序列（i=0 为被解释变量本身），时刻 t 从 K 开始
+    shifted = np.stack([x[max_lag - i:n - i] for i in range(width)], axis=1)
+
+    # 全部序列对在 t>=K 上的未中心化二阶矩 [pair, i, j]：按目标序列成批做矩阵乘法
+    cross = np.empty((len(targets), width, width))
+    diag = np.einsum('tiu,tju->uij', shifted, shifted)
+    order = np.argsort(t_local, kind='stable')
+    bounds = np.flatnonzero(np.r_[True, t_local[order][1:] != t_local[order][:-1], True])
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        rows = order[start:stop]
+        target = t_local[rows[0]]
+        block = shifted[:, :, target].T @ shifted[:, :, s_local[rows]].reshape(len(shifted), -1)
+        cross[rows] = block.reshape(width, width, len(rows)).transpose(2, 0, 1)
+
+    # 常数判断：区间内相邻值没有变化即为常数
+    changes = np.r_[np.zeros((1, n_cols), dtype=np.int64), np.cumsum(x[1:] != x[:-1], axis=0)]
+    sums = np.r_[np.zeros((1, n_cols)), np.cumsum(x, axis=0)]
+
+    for lag in range(1, max_lag + 1):
+        n_obs = n - lag
+        lags = np.arange(lag + 1)
+        # 滞后 lag 的回归使用 t>=lag 的时刻，比 t>=K 多出的前 K-lag 个时刻单独补上
+        extra = np.stack([x[lag - i:max_lag - i] for i in lags], axis=1)  # [K-lag, lag+1, U]
+        diag_l = diag[:, :lag + 1, :lag + 1] + np.einsum('tiu,tju->uij', extra, extra)
+        means = (sums[n - lags] - sums[lag - lags]).T / n_obs  # [U, lag+1]
+        constant = (changes[n - 1 - lags] == changes[lag - lags]).T  # [U, lag+1]
+
+        cov = diag_l - n_obs * means[:, :, None] * means[:, None, :]
+        scale = np.sqrt(np.maximum(np.einsum('uii->ui', cov), 0))
+        scale[constant | (scale == 0)] = 1.0
+        cov /= scale[:, :, None] * scale[:, None, :]
+
+        # 受限模型（只含目标自身滞后）：每个目标序列只解一次
+        own = cov[:, 1:, 1:]
+        own_y = cov[:, 1:, 0]
+        own_inv, own_rank = _pinv_psd(own)
+        own_coef = np.einsum('uij,uj->ui', own_inv, own_y)
+        ssr_own = cov[:, 0, 0] - np.einsum('ui,ui->u', own_y, own_coef)
+        bad_col = constant.any(axis=1)
+
+        for start in range(0, len(targets), _PAIR_CHUNK):
+            a = t_local[start:start + _PAIR_CHUNK]
+            b = s_local[start:start + _PAIR_CHUNK]
+            block = cross[start:start + _PAIR_CHUNK, :lag + 1, :lag + 1] + np.einsum(
+                'tip,tjp->pij', extra[:, :, a], extra[:, :, b])
+            block = block - n_obs * means[a][:, :, None] * means[b][:, None, :]
+            block /= scale[a][:, :, None] * scale[b][:, None, :]
+
+            # 非受限模型：把来源序列的滞后对目标自身滞后做残差化（Frisch-Waugh），只需 lag×lag 的伪逆
+            c = block[:, 1:, 1:]
+            projected = own_inv[a] @ c
+            resid_cov = cov[b][:, 1:, 1:] - np.swapaxes(c, 1, 2) @ projected
+            resid_y = block[:, 0, 1:] - np.einsum('pij,pi->pj', projected, own_y[a])
+            resid_inv, resid_rank = _pinv_psd(resid_cov)
+            reduction = np.einsum('pi,pij,pj->p', resid_y, resid_inv, resid_y)
+
+            ssr_joint = ssr_own[a] - reduction
+            df_resid = n_obs - 1 - own_rank[a] - resid_rank
+            infeasible = (bad_col[a] | constant[b][:, 1:].any(axis=1)
+                          | (ssr_joint < np.finfo(float).eps) | (df_resid <= 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                f = np.maximum(reduction, 0) / lag / (ssr_joint / df_resid)
+            f[infeasible] = np.nan
+            p = stats.f.sf(f, lag, np.maximum(df_resid, 1))
+            p[infeasible] = np.nan
+
+            f_stat[row_of[columns[a]], columns[b], lag - 1] = f
+            p_value[row_of[columns[a]], columns[b], lag - 1] = p
+
+
+def save_granger(path, columns, f_stat, p_value):
+    """保存为 npz：columns、f_stat 与 p_value（[target, source, lag]）"""
+    with open(path, 'wb') as f:
+        np.savez(f, columns=np.array(columns, dtype=str), f_stat=f_stat, p_value=p_value)
+
+
+def _checkpoint_key(data, max_lag, min_obs, chunk_size, allowed):
+    digest = hashlib.sha1(np.ascontiguousarray(data).view(np.uint8))
+    if allowed is not None:
+        digest.update(np.packbits(allowed))
+    return {'digest': digest.hexdigest(), 'shape': list(data.shape), 'max_lag': max_lag,
+            'min_obs': min_obs, 'chunk_size': chunk_size, 'pruned': allowed is not None}
+
+
+def _open_checkpoint(checkpoint_dir, data, max_lag, min_obs, chunk_size, allowed):
+    """打开或新建检查点目录，返回已完成的分块起点集合；输入或参数变化时丢弃旧结果"""
+    progress_path = os.path.join(checkpoint_dir, "progress.json")
+    key = _checkpoint_key(data, max_lag, min_obs, chunk_size, allowed)
+    if os.path.exists(progress_path):
+        try:
+            with open(progress_path, encoding='utf-8') as f:
+                progress = json.load(f)
+            if progress.get('version') == CHECKPOINT_VERSION and progress.get('key') == key:
+                return set(progress['done'])
+        except (OSError, ValueError) as e:
+            print(f"检查点无法读取，将重新计算全部分块: {str(e)}")
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    np.save(os.path.join(checkpoint_dir, "data.npy"), data)
+    allowed_path = os.path.join(checkpoint_dir, "allowed.npy")
+    if allowed is not None:
+        np.save(allowed_path, allowed)
+    elif os.path.exists(allowed_path):
+        os.remove(allowed_path)
+    n_series = data.shape[1]
+    for name in ('f_stat', 'p_value'):
+        out = np.lib.format.open_memmap(os.path.join(checkpoint_dir, f"{name}.npy"), mode='w+',
+                                        dtype=np.float64, shape=(n_series, n_series, max_lag))
+        out[:] = np.nan
+        out.flush()
+        del out
+    _save_progress(progress_path, key, [])
+    return set()
+
+
+def _save_progress(progress_path, key, done):
+    with atomic_path(progress_path) as temp_path:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CHECKPOINT_VERSION, 'key': key, 'done': sorted(done)}, f)
+
+
+def _init_chunk_worker(checkpoint_dir, max_lag, min_obs):
+    global _worker_state
+    allowed_path = os.path.join(checkpoint_dir, "allowed.npy")
+    _worker_state = {
+        'data': np.load(os.path.join(checkpoint_dir, "data.npy"), mmap_mode='r'),
+        'allowed': np.load(allowed_path, mmap_mode='r') if os.path.exists(allowed_path) else None,
+        'f_stat': np.load(os.path.join(checkpoint_dir, "f_stat.npy"), mmap_mode='r+'),
+        'p_value': np.load(os.path.join(checkpoint_dir, "p_value.npy"), mmap_mode='r+'),
+        'max_lag': max_lag,
+        'min_obs': min_obs,
+    }
+
+
+def _granger_chunk(start, stop):
+    """计算目标序列 [start, stop) 的全部序列对并写入结果文件，写盘后才返回"""
+    state = _worker_state
+    f_stat, p_value = granger_all_pairs(state['data'], state['max_lag'], state['min_obs'],
+                                        targets=np.arange(start, stop), allowed=state['allowed'])
+    state['f_stat'][start:stop] = f_stat
+    state['p_value'][start:stop] = p_value
+    state['f_stat'].flush()
+    state['p_value'].flush()
+    return start
+
+
+def granger_chunked(data, max_lag, checkpoint_dir, min_obs=None, chunk_size=32, workers=1, allowed=None):
+    """按目标序列分块计算 granger_all_pairs，可多进程并行，并可从中断处继续
+
+    输入矩阵保存为 checkpoint_dir/data.npy，各工作进程以只读内存映射共享；每个分块的结果直接写入
+    f_stat.npy / p_value.npy（[target, source, lag]），写盘后才记入 progress.json。
+    allowed 同 granger_all_pairs，保存为 allowed.npy 供工作进程共享。
+    再次运行时若输入数据、allowed 与参数未变，只计算尚未完成的分块。返回两个结果数组的内存映射（只读）。
+    """
+    global _worker_state
+    data = np.asarray(data, dtype=np.float64)
+    n_series = data.shape[1]
+    progress_path = os.path.join(checkpoint_dir, "progress.json")
+    if allowed is not None:
+        allowed = np.asarray(allowed, dtype=bool)
+    key = _checkpoint_key(data, max_lag, min_obs, chunk_size, allowed)
+    done = _open_checkpoint(checkpoint_dir, data, max_lag, min_obs, chunk_size, allowed)
+    pending = [start for start in range(0, n_series, chunk_size) if start not in done]
+    if done and pending:
+        print(f"从检查点继续：已完成 {len(done)} 个分块，剩余 {len(pending)} 个")
+
+    if pending:
+        if workers <= 1 or len(pending) <= 1:
+            _init_chunk_worker(checkpoint_dir, max_lag, min_obs)
+            try:
+                for start in tqdm(pending, desc="Granger 检验"):
+                    done.add(_granger_chunk(start, min(start + chunk_size, n_series)))
+                    _save_progress(progress_path, key, done)
+            finally:
+                _worker_state = None  # 释放内存映射，Windows 下文件才能被再次覆盖
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending)),
+                                     initializer=_init_chunk_worker,
+                                     initargs=(checkpoint_dir, max_lag, min_obs)) as pool:
+                futures = [pool.submit(_granger_chunk, start, min(start + chunk_size, n_series))
+                           for start in pending]
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Granger 检验"):
+                    done.add(future.result())
+                    _save_progress(progress_path, key, done)
+
+    return (np.load(os.path.join(checkpoint_dir, "f_stat.npy"), mmap_mode='r'),
+            np.load(os.path.join(checkpoint_dir, "p_value.npy"), mmap_mode='r'))
+
+
+def _statsmodels_granger(test, pair, max_lag):
+    # 新版本 statsmodels 移除了 verbose 参数
+    try:
+        return test(pair, maxlag=max_lag, verbose=False)
+    except TypeError:
+        return test(pair, maxlag=max_lag)
+
+
+def compare_with_statsmodels(data, f_stat, p_value, n_pairs=20, seed=0, min_obs=None):
+    """随机抽取序列对，用 statsmodels 逐对重算并返回 F 统计量与 p 值的最大相对/绝对误差"""
+    from statsmodels.tsa.stattools import grangercausalitytests
+
+    data = np.asarray(data, dtype=np.float64)
+    n_series, _, max_lag = f_stat.shape
+    rng = np.random.default_rng(seed)
+    candidates = np.argwhere(np.isfinite(f_stat).any(axis=-1))
+    picks = candidates[rng.choice(len(candidates), size=min(n_pairs, len(candidates)), replace=False)]
+
+    f_err = p_err = 0.0
+    compared = 0
+    for target, source in picks:
+        pair = data[:, [target, source]]
+        pair = pair[~np.isnan(pair).any(axis=1)]
+        if min_obs and len(pair) < min_obs:
+            continue
+        try:
+            result = _statsmodels_granger(grangercausalitytests, pair, max_lag)
+        except Exception:
+            continue
+        for lag, (tests, _) in result.items():
+            f_ref, p_ref = tests['params_ftest'][0], tests['params_ftest'][1]
+            f_err = max(f_err, abs(f_stat[target, source, lag - 1] - f_ref) / max(abs(f_ref), 1e-12))
+            p_err = max(p_err, abs(p_value[target, source, lag - 1] - p_ref))
+        compared += 1
+    return {'pairs': compared, 'f_rel_err': f_err, 'p_abs_err': p_err}
@@ -0,0 +1,141 @@
+import numpy as np
+from scipy import sparse
+
+
+def junction_adjacency(net_index):
+    """由普通道路连接的交叉口之间的无向邻接矩阵 [junction, junction]（csr，不含自环）"""
+    n = len(net_index.junction_ids)
+    keep = (net_index.edge_from >= 0) & (net_index.edge_to >= 0) & (net_index.edge_from != net_index.edge_to)
+    rows = np.concatenate([net_index.edge_from[keep], net_index.edge_to[keep]])
+    cols = np.concatenate([net_index.edge_to[keep], net_index.edge_from[keep]])
+    adjacency = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    adjacency.data[:] = 1.0
+    return adjacency
+
+
+def hop_kernel(adjacency, max_hops, decay):
+    """按跳数衰减的稀疏核：相距 d <= max_hops 跳的交叉口之间为 decay ** d（含对角线的 1）
+
+    逐跳做稀疏广度优先扩展，只保存 max_hops 跳以内的非零项。
+    """
+    n = adjacency.shape[0]
+    reached = sparse.identity(n, format='csr')
+    frontier = reached
+    kernel = reached.copy()
+    for hop in range(1, max_hops + 1):
+        step = (frontier @ adjacency).tocsr()
+        step.data[:] = 1.0
+        new = step - step.multiply(reached)
+        new.eliminate_zeros()
+        if new.nnz == 0:
+            break
+        kernel = kernel + new * decay ** hop
+        reached = reached + new
+        frontier = new
+    return kernel.tocsr()
+
+
+def detector_incidence(detector_ids, detector_index, net_index, exit_weight):
+    """检测器到交叉口的证据分配 [junction, detector]（csr）
+
+    检测器所在道路的终点交叉口（控制该车道的路口）记 1，起点交叉口记 exit_weight；
+    net_index 为 None 时只使用 detector_index 中记录的所属路口。无法定位的检测器整列为 0。
+    返回 (incidence, junction_ids, located)，located 为能定位到交叉口的检测器掩码。
+    """
+    if net_index is not None:
+        junction_ids = net_index.junction_ids.tolist()
+        code = net_index.junction_code
+    else:
+        junction_ids = sorted({detector_index.junction(det) for det in detector_ids
+                               if det in detector_index and detector_index.junction(det) is not None})
+        code = {jid: j for j, jid in enumerate(junction_ids)}
+
+    rows, cols, weights = [], [], []
+    located = np.zeros(len(detector_ids), dtype=bool)
+    for d, det in enumerate(detector_ids):
+        ends = []
+        if det in detector_index:
+            if net_index is not None:
+                lane = net_index.lane_code.get(detector_index.lane(det))
+                edge = -1 if lane is None else net_index.lane_edge[lane]
+                if edge >= 0:
+                    ends = [(net_index.edge_to[edge], 1.0), (net_index.edge_from[edge], exit_weight)]
+            else:
+                ends = [(code.get(detector_index.junction(det), -1), 1.0)]
+        for j, weight in ends:
+            if j >= 0 and weight > 0:
+                rows.append(j)
+                cols.append(d)
+                weights.append(weight)
+                located[d] = True
+
+    incidence = sparse.csr_matrix((weights, (rows, cols)), shape=(len(junction_ids), len(detector_ids)))
+    return incidence, junction_ids, located
+
+
+class JunctionLocalizer:
+    """把检测器异常分数沿路网扩散到附近的交叉口，按汇总证据对候选故障路口排序
+
+    propagation [candidate, detector] 为稀疏矩阵 K @ B 中候选路口的行：B 将检测器分数分配到其道路两端的交叉口，
+    K 为按跳数衰减的交叉口核。两者只在构建时计算一次，每次排序只是一次稀疏矩阵与向量的乘法。
+    """
+
+    def __init__(self, candidate_ids, detector_ids, propagation):
+        self.candidate_ids = list(candidate_ids)
+        self.detector_ids = list(detector_ids)
+        self.propagation = propagation.tocsr()
+        self.detector_code = {det: d for d, det in enumerate(self.detector_ids)}
+
+    @classmethod
+    def build(cls, detector_index, net_index=None, candidates=None, max_hops=2, decay=0.5, exit_weight=0.5):
+        """由检测器索引与路网索引构建；candidates 为参与排序的交叉口（默认全部信号灯交叉口）
+
+        net_index 为 None 时没有路网，只用检测器所属路口（不扩散）。
+        """
+        detector_ids = sorted(detector_index.records)
+        incidence, junction_ids, _ = detector_incidence(detector_ids, detector_index, net_index, exit_weight)
+        if net_index is not None:
+            kernel = hop_kernel(junction_adjacency(net_index), max_hops, decay)
+            if candidates is None:
+                candidates = net_index.junctions('traffic_light')
+        else:
+            kernel = sparse.identity(len(junction_ids), format='csr')
+            if candidates is None:
+                candidates = junction_ids
+
+        code = {jid: j for j, jid in enumerate(junction_ids)}
+        candidate_ids = [jid for jid in candidates if jid in code]
+        rows = np.array([code[jid] for jid in candidate_ids], dtype=np.int64)
+        propagation = (kernel[rows] @ incidence).tocsr()
+        return cls(candidate_ids, detector_ids, propagation)
+
+    def scores(self, detector_scores):
+        """detector_scores 为 {检测器ID: 异常分数}，返回各候选路口的证据 [candidate]；不在索引中的检测器被忽略"""
+        vector = np.zeros(len(self.detector_ids))
+        for det, score in detector_scores.items():
+            d = self.detector_code.get(det)
+            if d is not None:
+                vector[d] = score
+        return self.propagation @ vector
+
+    def rank(self, detector_scores, top_n=None):
+        """按证据从大到小返回 [(路口ID, 证据)]，只包含证据大于 0 的路口"""
+        evidence = self.scores(detector_scores)
+        order = np.argsort(-evidence, kind='stable')
+        order = order[evidence[order] > 0][:top_n]
+        return [(self.candidate_ids[j], float(evidence[j])) for j in order]
+
+    def save(self, path, **extra):
+        """保存为 npz：candidate_ids、detector_ids 与 propagation 的 CSR 数组，以及 extra 中的数组"""
+        with open(path, 'wb') as f:
+            np.savez(f, candidate_ids=np.array(self.candidate_ids, dtype=str),
+                     detector_ids=np.array(self.detector_ids, dtype=str), data=self.propagation.data,
+                     indices=self.propagation.indices, indptr=self.propagation.indptr, **extra)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            candidate_ids, detector_ids = f['candidate_ids'].tolist(), f['detector_ids'].tolist()
+            propagation = sparse.csr_matrix((f['data'], f['indices'], f['indptr']),
+                                            shape=(len(candidate_ids), len(detector_ids)))
+        return cls(candidate_ids, detector_ids, propagation)
@@ -0,0 +1,125 @@
+import json
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+from edpf.scoring import build_param_array
+
+MODEL_FORMAT_VERSION = 1
+
+
+def index_path_for(model_path):
+    """二进制模型对应的检测器索引文件路径（与 .npy 同名的 .index.json）"""
+    return os.path.splitext(model_path)[0] + ".index.json"
+
+
+def save_binary_model(model_path, normal_params, phase_length, features, source_digest=None):
+    """将正常模型保存为 float32 [detector, phase, feature, 2] 数组 + 检测器索引
+
+    source_digest 为转换来源（如 JSON 模型）的内容哈希，记录在索引中，用于判断二进制模型是否过期。
+    """
+    detector_ids = list(normal_params.keys())
+    params = build_param_array(normal_params, detector_ids, phase_length, features)
+    with open(model_path, 'wb') as f:
+        np.save(f, params.astype(np.float32))
+
+    meta = {
+        "version": MODEL_FORMAT_VERSION,
+        "phase_length": phase_length,
+        "features": list(features),
+        "detectors": detector_ids,
+        "source_digest": source_digest,
+    }
+    with open(index_path_for(model_path), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def binary_model_source(model_path):
+    """二进制模型索引中记录的来源哈希；模型或索引不存在、无法读取时返回 None"""
+    try:
+        with open(index_path_for(model_path), 'r') as f:
+            return json.load(f).get("source_digest")
+    except (OSError, ValueError):
+        return None
+
+
+def export_model_json(model_path, json_path):
+    """将二进制模型导出为与 save_model 相同结构的 JSON，便于查看"""
+    model = MappedModel(model_path)
+    save_data = {}
+    for detector in model.detector_ids:
+        save_data[detector] = {
+            str(phase): {feature: list(params) for feature, params in features.items()}
+            for phase, features in model[detector].items()
+        }
+    with open(json_path, 'w') as f:
+        json.dump(save_data, f, indent=2)
+
+
+class _PhaseParams(Mapping):
+    """单个检测器的 {phase: {feature: (median, mad)}} 只读视图，按需从映射数组中读取"""
+
+    def __init__(self, rows, features):
+        self._rows = rows
+        self._features = features
+
+    def __getitem__(self, phase):
+        if not 0 <= phase < len(self._rows):
+            return {}
+        values = np.asarray(self._rows[phase], dtype=np.float64)
+        return {feature: (values[j, 0], values[j, 1]) for j, feature in enumerate(self._features)}
+
+    def __iter__(self):
+        return iter(range(len(self._rows)))
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class MappedModel(Mapping):
+    """以内存映射方式打开的二进制正常模型，接口与 normal_params 字典一致
+
+    未知检测器返回空的参数视图（与 defaultdict 的行为一致），数组只在访问时被读入内存。
+    """
+
+    def __init__(self, model_path):
+        with open(index_path_for(model_path), 'r') as f:
+            meta = json.load(f)
+        if meta.get("version") != MODEL_FORMAT_VERSION:
+            raise ValueError(f"不支持的模型版本: {meta.get('version')}")
+
+        self.model_path = model_path
+        self.array = np.load(model_path, mmap_mode='r')
+        self.phase_length = meta["phase_length"]
+        self.features = meta["features"]
+        self.detector_ids = meta["detectors"]
+        self.index = {det: i for i, det in enumerate(self.detector_ids)}
+        if self.array.shape != (len(self.detector_ids), self.phase_length, len(self.features), 2):
+            raise ValueError(f"模型数组形状 {self.array.shape} 与索引不一致")
+
+    def __getitem__(self, detector_id):
+        row = self.index.get(detector_id)
+        if row is None:
+            return _PhaseParams(self.array[:0, 0], self.features)
+        return _PhaseParams(self.array[row], self.features)
+
+    def __contains__(self, detector_id):
+        return detector_id in self.index
+
+    def __iter__(self):
+        return iter(self.detector_ids)
+
+    def __len__(self):
+        return len(self.detector_ids)
+
+    def param_array(self, detector_ids, phase_length, features):
+        """按给定检测器顺序取出 float64 [detector, phase, feature, 2] 参数，未知检测器为 NaN"""
+        if phase_length != self.phase_length or list(features) != list(self.features):
+            raise ValueError("相位长度或特征顺序与模型不一致")
+        params = np.full((len(detector_ids), phase_length, len(features), 2), np.nan)
+        rows = [self.index.get(det, -1) for det in detector_ids]
+        known = np.flatnonzero(np.asarray(rows) >= 0)
+        if len(known):
+            params[known] = self.array[np.asarray(rows)[known]]
+        return params
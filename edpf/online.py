@@ -0,0 +1,142 @@
+import numpy as np
+
+from edpf.rolling import RollingMedian
+from edpf.scoring import build_param_array
+from edpf.series import BASE_FEATURES
+from edpf.sketch import LogBuckets
+
+# 与离线预处理一致的移动平均窗口长度
+SMOOTH_WINDOW = 3
+
+# 与 detect_anomalies 一致：至少有 5 个平滑后时间点的检测器才参与排名
+MIN_VALID_POINTS = 5
+
+# 窗口不小于该长度时每个检测器/特征用 RollingMedian 增量维护窗口中位数（O(log w)），
+# 更短的窗口对所有检测器整体排序更快（300 个检测器实测交点约为 800~900）
+INCREMENTAL_MIN_WINDOW = 900
+
+
+class OnlineDetector:
+    """逐仿真步接收线圈读数的流式异常检测器
+
+    每个检测器只保存固定大小的状态：最近 3 个有效原始读数（移动平均）、每个特征最近
+    time_window 个 MAD 分数（窗口中位数），以及综合异常指数的对数分桶计数（在线估计 95 百分位）。
+    time_window 不小于 INCREMENTAL_MIN_WINDOW 时每个检测器/特征维护一个 RollingMedian，推入与淘汰均为 O(log w)；
+    更短的窗口保存环形缓冲，每步整体排序取中位数。
+    分数计算与离线的 detect_anomalies 相同，只有最终的百分位是带相对误差界的近似值。
+    """
+
+    def __init__(self, normal_params, detector_ids, phase_length=90, time_window=30, top_k=10,
+                 features=BASE_FEATURES, rank_every=30, relative_accuracy=0.01):
+        self.detector_ids = list(detector_ids)
+        self.index = {det: i for i, det in enumerate(self.detector_ids)}
+        self.phase_length = phase_length
+        self.time_window = time_window
+        self.top_k = top_k
+        self.features = list(features)
+        self.rank_every = rank_every
+        self.params = build_param_array(normal_params, self.detector_ids, phase_length, self.features)
+
+        n_det, n_feat = len(self.detector_ids), len(self.features)
+        # 读数按 BASE_FEATURES 的列顺序传入，评分特征从中按名称选取
+        self._columns = [BASE_FEATURES.index(f) for f in self.features]
+        self._raw = np.zeros((n_det, SMOOTH_WINDOW, n_feat))
+        self._raw_count = np.zeros(n_det, dtype=np.int64)
+        if time_window >= INCREMENTAL_MIN_WINDOW:
+            self._windows = [[RollingMedian(time_window) for _ in range(n_feat)] for _ in range(n_det)]
+            self._window_median = np.zeros((n_det, n_feat))
+        else:
+            self._windows = np.full((n_det, n_feat, time_window), np.nan)
+            self._window_median = None
+        self._window_count = np.zeros((n_det, n_feat), dtype=np.int64)
+        self._points = np.zeros(n_det, dtype=np.int64)
+
+        self.buckets = LogBuckets(relative_accuracy)
+        self._score_counts = np.zeros((n_det, self.buckets.n_buckets), dtype=np.int64)
+        self._steps = 0
+
+        self.top = []
+        self.top_since = None  # 当前 top-K 成员首次出现的仿真时间
+        self.last_time = None
+
+    def update(self, t, readings):
+        """输入时间 t 的一步读数 [detector, (speed, occupancy, flow)]，顺序与 detector_ids 一致"""
+        readings = np.asarray(readings, dtype=np.float64)
+        speed, occupancy, flow = readings[:, 0], readings[:, 1], readings[:, 2]
+        with np.errstate(invalid='ignore'):
+            valid = np.flatnonzero((speed > 0) & (occupancy >= 0) & (flow >= 0))
+
+        # 移动平均：环形缓冲保存最近 3 个有效读数
+        slot = self._raw_count[valid] % SMOOTH_WINDOW
+        self._raw[valid, slot] = readings[valid][:, self._columns]
+        self._raw_count[valid] += 1
+        ready = valid[self._raw_count[valid] >= SMOOTH_WINDOW]
+        self.last_time = t
+        self._steps += 1
+        if len(ready):
+            self._score_step(t, ready)
+        if self._steps % self.rank_every == 0:
+            self._refresh_ranking(t)
+
+    def _score_step(self, t, ready):
+        self._points[ready] += 1
+        smoothed = self._raw[ready].sum(axis=1) / SMOOTH_WINDOW
+
+        step_params = self.params[ready, t % self.phase_length]
+        median, mad = step_params[..., 0], step_params[..., 1]
+        has_param = ~np.isnan(median)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.abs(smoothed - median) / mad
+        scores = np.where((mad == 0) | np.isnan(mad), 0.0, scores)
+
+        # 有参数的特征把分数推入各自的滑动窗口
+        rows, cols = np.nonzero(has_param)
+        dets = ready[rows]
+        if self._window_median is not None:
+            for det, col, score in zip(dets.tolist(), cols.tolist(), scores[rows, cols].tolist()):
+                self._window_median[det, col] = self._windows[det][col].push(score)
+        else:
+            slot = self._window_count[dets, cols] % self.time_window
+            self._windows[dets, cols, slot] = scores[rows, cols]
+        self._window_count[dets, cols] += 1
+
+        # 本步至少一个特征有分数时，综合各特征的窗口中位数
+        scored = ready[has_param.any(axis=1)]
+        if not len(scored):
+            return
+        n = np.minimum(self._window_count[scored], self.time_window)
+        if self._window_median is not None:
+            window_median = self._window_median[scored]
+        else:
+            ordered = np.sort(self._windows[scored], axis=-1)  # 未填满的 NaN 排在末尾
+            lo = np.maximum(n - 1, 0) // 2
+            hi = n // 2
+            window_median = (np.take_along_axis(ordered, lo[..., None], -1)[..., 0]
+                             + np.take_along_axis(ordered, hi[..., None], -1)[..., 0]) / 2
+        has_window = n > 0
+        combined = np.where(has_window, window_median, 0.0).sum(axis=1) / has_window.sum(axis=1)
+        np.add.at(self._score_counts, (scored, self.buckets.bucket_of(combined)), 1)
+
+    def _refresh_ranking(self, t):
+        top = self.ranking()
+        # 只比较 top-K 的成员，名次相近的检测器之间的交换不算排名变化
+        if {det for det, _ in top} != {det for det, _ in self.top} or self.top_since is None:
+            self.top_since = t
+        self.top = top
+
+    def ranking(self):
+        """当前估计的 top-K [(detector_id, 综合异常指数), ...]"""
+        eligible = np.flatnonzero(self._points >= MIN_VALID_POINTS)
+        if not len(eligible):
+            return []
+        scores = self.buckets.quantile(self._score_counts[eligible], 0.95)
+        scores = np.where(np.isnan(scores), 0.0, scores)
+        order = np.argsort(-scores, kind='stable')[:self.top_k]
+        return [(self.detector_ids[eligible[i]], float(scores[i])) for i in order]
+
+    def stable_for(self, since=None):
+        """当前 top-K 成员持续不变的仿真时长；since 给出时只从该时刻开始计"""
+        if self.top_since is None or not self.top:
+            return 0
+        start = self.top_since if since is None else max(self.top_since, since)
+        return max(self.last_time - start, 0)
@@ -0,0 +1,208 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
+from scipy import stats
+
+# 偏相关系数截断到 (-_R_MAX, _R_MAX)，避免 Fisher z 变换在 ±1 处发散
+_R_MAX = 1 - 1e-7
+
+# 每个进程每批条件独立性检验的数量，限制中间数组的内存占用
+_TEST_CHUNK = 200000
+
+# 工作进程内的相关系数矩阵与样本数，由 _init_ci_worker 在进程启动时设置一次
+_worker_state = None
+
+_combination_cache = {}
+
+
+def correlation_matrix(data):
+    """[time, var] 数据的相关系数矩阵；常数列与其它变量的相关系数记为 0"""
+    data = np.asarray(data, dtype=np.float64)
+    centered = data - data.mean(axis=0)
+    scale = np.sqrt((centered ** 2).sum(axis=0))
+    constant = scale == 0
+    scale[constant] = 1.0
+    corr = (centered.T @ centered) / np.outer(scale, scale)
+    corr[constant] = 0.0
+    corr[:, constant] = 0.0
+    np.fill_diagonal(corr, 1.0)
+    return np.clip(corr, -1.0, 1.0)
+
+
+def partial_correlations(corr, tests):
+    """成批计算偏相关系数：tests 每行为 [x, y, 条件变量...]
+
+    条件集大小为 1、2 时直接用条件集子矩阵的解析逆（Schur 补）计算，更大的条件集对
+    corr 中 [x, y, 条件变量] 子矩阵求逆，由精度矩阵得到偏相关系数。
+    """
+    depth = tests.shape[1] - 2
+    x, y = tests[:, 0], tests[:, 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if depth == 0:
+            return corr[x, y]
+        if depth == 1:
+            z = tests[:, 2]
+            rxz, ryz = corr[x, z], corr[y, z]
+            return (corr[x, y] - rxz * ryz) / np.sqrt((1 - rxz ** 2) * (1 - ryz ** 2))
+        if depth == 2:
+            z, w = tests[:, 2], tests[:, 3]
+            rzw = corr[z, w]
+            det = 1 - rzw ** 2
+            rxz, rxw, ryz, ryw = corr[x, z], corr[x, w], corr[y, z], corr[y, w]
+
+            def quad(u1, u2, v1, v2):
+                return (u1 * v1 - rzw * (u1 * v2 + u2 * v1) + u2 * v2) / det
+
+            sxy = corr[x, y] - quad(rxz, rxw, ryz, ryw)
+            sxx = 1 - quad(rxz, rxw, rxz, rxw)
+            syy = 1 - quad(ryz, ryw, ryz, ryw)
+            return sxy / np.sqrt(sxx * syy)
+
+        sub = corr[tests[:, :, None], tests[:, None, :]]
+        try:
+            precision = np.linalg.inv(sub)
+        except np.linalg.LinAlgError:
+            precision = np.linalg.pinv(sub)
+        return -precision[:, 0, 1] / np.sqrt(precision[:, 0, 0] * precision[:, 1, 1])
+
+
+def fisher_z_pvalues(corr, n_obs, tests):
+    """成批的 Gauss 条件独立性检验（Fisher z），返回 p 值；偏相关系数无法计算时 p 值记为 1（视为独立）"""
+    depth = tests.shape[1] - 2
+    r = partial_correlations(corr, tests)
+    z = np.sqrt(n_obs - depth - 3) * np.arctanh(np.clip(r, -_R_MAX, _R_MAX))
+    p = 2 * stats.norm.sf(np.abs(z))
+    p[np.isnan(p)] = 1.0
+    return p
+
+
+def independent(corr, n_obs, alpha, tests):
+    """与 fisher_z_pvalues(...) > alpha 等价的判断：|偏相关系数| 小于该层的临界值即为条件独立"""
+    depth = tests.shape[1] - 2
+    r_crit = np.tanh(stats.norm.isf(alpha / 2) / np.sqrt(n_obs - depth - 3))
+    with np.errstate(invalid='ignore'):
+        return ~(np.abs(partial_correlations(corr, tests)) >= min(r_crit, _R_MAX))
+
+
+def _init_ci_worker(corr, n_obs, alpha):
+    global _worker_state
+    _worker_state = (corr, n_obs, alpha)
+
+
+def _worker_independent(tests):
+    corr, n_obs, alpha = _worker_state
+    return independent(corr, n_obs, alpha, tests)
+
+
+def _combinations(n, k):
+    key = (n, k)
+    if key not in _combination_cache:
+        combos = list(combinations(range(n), k))
+        _combination_cache[key] = np.array(combos, dtype=np.int64).reshape(len(combos), k)
+    return _combination_cache[key]
+
+
+def pc_skeleton(data, alpha=0.05, max_depth=None, workers=1, allowed=None):
+    """PC 算法（stable 版本）的骨架搜索，条件独立性检验为 Fisher z 检验
+
+    data: [time, var]。相关系数矩阵只计算一次；每一层（条件集大小）开始时固定各变量的邻接集，
+    按 (x, y) 的顺序与条件集的组合顺序成批检验，与逐个检验的 PC-stable 结果相同。
+    allowed 为 [var, var] 布尔掩码时，初始图只包含双向都为 True 的边。
+    返回 (adjacency, sepsets)：adjacency 为对称的布尔邻接矩阵，sepsets 为 {(i, j): 分离集}（i < j）。
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n_obs, n_vars = data.shape
+    corr = correlation_matrix(data)
+    if allowed is None:
+        adjacency = np.ones((n_vars, n_vars), dtype=bool)
+    else:
+        allowed = np.asarray(allowed, dtype=bool)
+        adjacency = allowed & allowed.T
+    np.fill_diagonal(adjacency, False)
+    sepsets = {}
+
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_ci_worker,
+                                   initargs=(corr, n_obs, alpha))
+    try:
+        depth = 0
+        while (max_depth is None or depth <= max_depth) and n_obs - depth - 3 > 0:
+            neighbours = [np.flatnonzero(row) for row in adjacency]
+            if all(len(nb) - 1 < depth for nb in neighbours):
+                break
+            _search_level(corr, n_obs, alpha, depth, neighbours, adjacency, sepsets, pool, workers)
+            depth += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return adjacency, sepsets
+
+
+def _search_level(corr, n_obs, alpha, depth, neighbours, adjacency, sepsets, pool, workers):
+    """检验一层的全部 (x, y, 条件集)，发现独立即删边并记录分离集；每批检验完成后才删边，下一批跳过已删除的边"""
+    pairs, tests, n_tests = [], [], 0
+
+    def flush():
+        if not tests:
+            return
+        batch = np.concatenate(tests)
+        if pool is None:
+            found = independent(corr, n_obs, alpha, batch)
+        else:
+            parts = np.array_split(batch, workers)
+            found = np.concatenate(list(pool.map(_worker_independent, parts)))
+        start = 0
+        for x, y, count in pairs:
+            hits = np.flatnonzero(found[start:start + count])
+            if len(hits) and adjacency[x, y]:
+                adjacency[x, y] = adjacency[y, x] = False
+                key = (x, y) if x < y else (y, x)
+                sepsets[key] = tuple(int(v) for v in batch[start + hits[0], 2:])
+            start += count
+        pairs.clear()
+        tests.clear()
+
+    for x, candidates in enumerate(neighbours):
+        if len(candidates) - 1 < depth:
+            continue
+        combos = _combinations(len(candidates) - 1, depth)
+        for y in candidates:
+            if not adjacency[x, y]:
+                continue
+            others = candidates[candidates != y]
+            block = np.empty((len(combos), depth + 2), dtype=np.int64)
+            block[:, 0] = x
+            block[:, 1] = y
+            block[:, 2:] = others[combos]
+            pairs.append((x, y, len(block)))
+            tests.append(block)
+            n_tests += len(block)
+            if n_tests >= _TEST_CHUNK * max(workers, 1):
+                flush()
+                n_tests = 0
+    flush()
+
+
+def save_skeleton(path, columns, adjacency, sepsets, alpha):
+    """保存为 npz：columns、edges [E, 2]（i < j），分离集以 CSR 形式存为 sep_pairs、sep_offsets、sep_members"""
+    edges = np.argwhere(np.triu(adjacency, 1)).astype(np.int32)
+    keys = sorted(sepsets)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(sepsets[key]) for key in keys])
+    members = np.array([v for key in keys for v in sepsets[key]], dtype=np.int32)
+    with open(path, 'wb') as f:
+        np.savez(f, columns=np.array(columns, dtype=str), edges=edges,
+                 sep_pairs=np.array(keys, dtype=np.int32).reshape(-1, 2), sep_offsets=offsets,
+                 sep_members=members, alpha=alpha)
+
+
+def load_skeleton(path):
+    """读取 save_skeleton 的输出，返回 (columns, edges, sepsets)"""
+    with np.load(path) as f:
+        offsets = f['sep_offsets']
+        members = f['sep_members']
+        sepsets = {(int(i), int(j)): tuple(int(v) for v in members[offsets[k]:offsets[k + 1]])
+                   for k, (i, j) in enumerate(f['sep_pairs'])}
+        return f['columns'].tolist(), f['edges'], sepsets
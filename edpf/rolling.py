@@ -0,0 +1,177 @@
+import time
+from collections import defaultdict, deque
+from heapq import heappop, heappush
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 单次滑窗中位数计算允许展开的最大元素数（控制内存占用）
+_WINDOW_BUDGET = 1 << 22
+
+# 窗口不小于该长度时改用双堆滑动中位数（O(log w)），更小的窗口用 partition 更快
+HEAP_MIN_WINDOW = 128
+
+
+class RollingMedian:
+    """滑动窗口中位数：双堆 + 延迟删除，每次插入/淘汰 O(log w)
+
+    low 为存放较小一半的最大堆（取负存储），high 为较大一半的最小堆；被移出窗口的值
+    先记在 _delayed 中，等到它出现在堆顶时再真正弹出。中位数与 np.median 的结果一致。
+    """
+
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError("窗口长度必须为正整数")
+        self.window = window
+        self._values = deque()
+        self._low, self._high = [], []
+        self._low_size = self._high_size = 0
+        self._delayed = defaultdict(int)
+
+    def __len__(self):
+        return len(self._values)
+
+    def push(self, value):
+        """加入一个新值（必要时淘汰最旧的值），返回当前窗口的中位数"""
+        self._values.append(value)
+        if not self._low or value <= -self._low[0]:
+            heappush(self._low, -value)
+            self._low_size += 1
+        else:
+            heappush(self._high, value)
+            self._high_size += 1
+        self._rebalance()
+        self._evict()
+        return self.median()
+
+    def resize(self, window):
+        """修改窗口长度；缩小时立即淘汰多出的最旧值"""
+        if window < 1:
+            raise ValueError("窗口长度必须为正整数")
+        self.window = window
+        self._evict()
+
+    def median(self):
+        if not self._values:
+            return np.nan
+        if self._low_size > self._high_size:
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) / 2
+
+    def _evict(self):
+        while len(self._values) > self.window:
+            self._remove(self._values.popleft())
+            self._rebalance()
+
+    def _remove(self, value):
+        # 堆顶均为有效值，故 value 不大于 low 堆顶时必有一个副本在 low 中
+        self._delayed[value] += 1
+        if value <= -self._low[0]:
+            self._low_size -= 1
+            if value == -self._low[0]:
+                self._prune(self._low, -1)
+        else:
+            self._high_size -= 1
+            if value == self._high[0]:
+                self._prune(self._high, 1)
+
+    def _prune(self, heap, sign):
+        while heap:
+            value = sign * heap[0]
+            if not self._delayed.get(value):
+                break
+            self._delayed[value] -= 1
+            if not self._delayed[value]:
+                del self._delayed[value]
+            heappop(heap)
+
+    def _rebalance(self):
+        while self._low_size > self._high_size + 1:
+            heappush(self._high, -heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune(self._low, -1)
+        while self._low_size < self._high_size:
+            heappush(self._low, -heappop(self._high))
+            self._low_size += 1
+            self._high_size -= 1
+            self._prune(self._high, 1)
+
+
+def rolling_median_1d(values, window):
+    """一维序列上以每个位置结尾、长度至多为 window 的窗口中位数"""
+    rolling = RollingMedian(window)
+    push = rolling.push
+    return np.array([push(value) for value in values.tolist()], dtype=np.float64)
+
+
+def rolling_median_partition(packed, window):
+    """在展开的滑动窗口上用 partition 取中位数，每个窗口 O(w)，适合较小的窗口"""
+    n_rows, length = packed.shape
+    result = np.full((n_rows, length), np.nan)
+    head = min(window - 1, length)
+
+    # 扩张窗口部分：窗口长度为 k+1
+    for k in range(head):
+        result[:, k] = np.median(packed[:, :k + 1], axis=1)
+
+    # 完整窗口部分：按行分块，用 partition 取中位数
+    if length >= window:
+        lo, hi = (window - 1) // 2, window // 2
+        chunk = max(1, _WINDOW_BUDGET // max(1, (length - window + 1) * window))
+        for start in range(0, n_rows, chunk):
+            windows = sliding_window_view(packed[start:start + chunk], window, axis=1)
+            part = np.partition(windows, [lo, hi], axis=-1)
+            if lo == hi:
+                med = part[..., lo]
+            else:
+                med = (part[..., lo] + part[..., hi]) / 2
+            result[start:start + chunk, window - 1:] = med
+    return result
+
+
+def rolling_median_heap(packed, window, counts=None):
+    """逐行用双堆结构计算窗口中位数，每个样本 O(log w)，只计算每行的有效前缀"""
+    if counts is None:
+        counts = (~np.isnan(packed)).sum(axis=1)
+    result = np.full(packed.shape, np.nan)
+    for i in np.flatnonzero(counts):
+        result[i, :counts[i]] = rolling_median_1d(packed[i, :counts[i]], window)
+    return result
+
+
+def rolling_median(packed, window, counts=None):
+    """逐行计算以每个位置结尾、长度至多为 window 的窗口中位数（前 window-1 个位置为扩张窗口）
+
+    packed 每行为左对齐的有效值，其后填 NaN；counts 为每行有效前缀的长度。
+    """
+    if window >= HEAP_MIN_WINDOW:
+        return rolling_median_heap(packed, window, counts)
+    return rolling_median_partition(packed, window)
+
+
+def _slice_median(row, window):
+    # 原逐点实现：每步切片最近 window 个分数再调用 np.median
+    values = row.tolist()
+    return [np.median(values[max(0, k + 1 - window):k + 1]) for k in range(len(values))]
+
+
+def benchmark(windows=(30, 60, 120, 300, 600, 900), n_rows=30, length=3600, seed=0):
+    """比较三种窗口中位数实现的耗时（秒）：逐步切片 + np.median、partition、双堆"""
+    rows = np.random.default_rng(seed).gamma(2.0, 1.0, size=(n_rows, length))
+    report = []
+    for window in windows:
+        timings = {}
+        for name, func in [('slice', lambda: [_slice_median(row, window) for row in rows]),
+                           ('partition', lambda: rolling_median_partition(rows, window)),
+                           ('heap', lambda: rolling_median_heap(rows, window))]:
+            start = time.perf_counter()
+            func()
+            timings[name] = time.perf_counter() - start
+        report.append((window, timings))
+        print(f"time_window={window:4d}  " + "  ".join(f"{k}: {v:.3f}s" for k, v in timings.items()))
+    return report
+
+
+if __name__ == "__main__":
+    benchmark()
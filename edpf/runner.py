@@ -0,0 +1,142 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from tqdm import tqdm
+
+from data_processing.parse_cache import default_cache
+
+MANIFEST_VERSION = 1
+
+# 工作进程内的处理器实例，由 _init_worker 在进程启动时创建一次
+_worker_processor = None
+
+
+@contextmanager
+def atomic_path(path):
+    """产出与 path 同目录的临时文件名，正常退出后将其原子替换为 path
+
+    出错时删除临时文件、保留原有的 path；退出时临时文件不存在（没有写出内容）则 path 不变。
+    """
+    directory, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    temp_path = os.path.join(directory, f"{stem}.{os.getpid()}.tmp{ext}")
+    try:
+        yield temp_path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if os.path.exists(temp_path):
+        os.replace(temp_path, path)
+
+
+class BatchManifest:
+    """批处理清单：每个输入文件的内容哈希，以及各阶段的参数与输出文件
+
+    某阶段在输入内容、阶段参数变化，输出文件缺失，或其依赖的阶段需要重算时视为过期。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"清单文件无法读取，将重新处理全部文件: {str(e)}")
+            return
+        if data.get('version') == MANIFEST_VERSION:
+            self.files = data['files']
+
+    def stale_stages(self, key, digest, stage_params, depends=None):
+        """按 stage_params 的顺序返回需要（重新）计算的阶段"""
+        depends = depends or {}
+        entry = self.files.get(key)
+        if entry is None or entry['digest'] != digest:
+            return list(stage_params)
+
+        stale = []
+        for stage, params in stage_params.items():
+            done = entry['stages'].get(stage)
+            if (done is None or done['params'] != params
+                    or not all(os.path.exists(path) for path in done['outputs'])
+                    or any(upstream in stale for upstream in depends.get(stage, ()))):
+                stale.append(stage)
+        return stale
+
+    def record(self, key, digest, stage_params, outputs):
+        """记录一个文件已完成的阶段 {阶段: [输出文件]} 并立即写回清单"""
+        entry = self.files.get(key)
+        if entry is None or entry['digest'] != digest:
+            entry = self.files[key] = {'digest': digest, 'stages': {}}
+        for stage, paths in outputs.items():
+            entry['stages'][stage] = {'params': stage_params[stage], 'outputs': list(paths)}
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with atomic_path(self.path) as temp_path:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': MANIFEST_VERSION, 'files': self.files}, f, indent=2, ensure_ascii=False)
+
+
+def _init_worker(processor_cls):
+    global _worker_processor
+    _worker_processor = processor_cls()
+
+
+def _process_one(input_path, stages):
+    return _worker_processor.process_single_file(input_path, stages)
+
+
+def run_batch(processor, files, manifest, workers=1):
+    """批量处理输入文件，只重新计算过期的阶段，返回 (完成数, 跳过数, 失败数)
+
+    processor 需提供 stage_params()、STAGE_DEPENDS 与 process_single_file(input_path, stages)，
+    后者返回 {阶段: [输出文件]}，失败时返回 None。每完成一个文件即写回清单，中断后重新运行会从断点继续。
+    workers>1 时每个工作进程创建一次 type(processor)()。
+    """
+    stage_params = processor.stage_params()
+    cache = default_cache()
+    plan = []
+    for input_path in files:
+        key = os.path.basename(input_path)
+        digest = cache.digest(input_path)
+        stages = manifest.stale_stages(key, digest, stage_params, processor.STAGE_DEPENDS)
+        if stages:
+            plan.append((input_path, key, digest, stages))
+    skipped = len(files) - len(plan)
+    if not plan:
+        return 0, skipped, 0
+
+    failed = 0
+
+    def finish(key, digest, outputs):
+        nonlocal failed
+        if outputs is None:
+            failed += 1
+        else:
+            manifest.record(key, digest, stage_params, outputs)
+
+    if workers <= 1 or len(plan) <= 1:
+        for input_path, key, digest, stages in tqdm(plan, desc="处理进度"):
+            finish(key, digest, processor.process_single_file(input_path, stages))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(plan)),
+                                 initializer=_init_worker,
+                                 initargs=(type(processor),)) as pool:
+            futures = {pool.submit(_process_one, input_path, stages): (key, digest)
+                       for input_path, key, digest, stages in plan}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="处理进度"):
+                key, digest = futures[future]
+                try:
+                    outputs = future.result()
+                except Exception as e:
+                    print(f"处理文件 {key} 时出错: {str(e)}")
+                    outputs = None
+                finish(key, digest, outputs)
+    return len(plan) - failed, skipped, failed
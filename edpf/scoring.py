@@ -0,0 +1,84 @@
+import numpy as np
+
+from edpf.rolling import rolling_median
+
+
+def build_param_array(normal_params, detector_ids, phase_length, features):
+    """将 normal_params 展开为 [detector, phase, feature, 2] 的 (median, mad) 数组"""
+    if hasattr(normal_params, 'param_array'):
+        # 内存映射模型直接按行读取，无需逐项展开
+        return normal_params.param_array(detector_ids, phase_length, features)
+    params = np.full((len(detector_ids), phase_length, len(features), 2), np.nan)
+    for i, det in enumerate(detector_ids):
+        if det not in normal_params:
+            continue
+        for phase, feature_params in normal_params[det].items():
+            phase = int(phase)
+            if not 0 <= phase < phase_length:
+                continue
+            for j, feature in enumerate(features):
+                if feature in feature_params:
+                    params[i, phase, j] = feature_params[feature]
+    return params
+
+
+def pack_valid(rows, mask):
+    """将每行的有效元素按原顺序左移压紧，其余位置填 NaN，返回 (packed, counts)"""
+    order = np.argsort(~mask, axis=1, kind='stable')
+    packed = np.take_along_axis(rows, order, axis=1)
+    counts = mask.sum(axis=1)
+    packed[np.arange(rows.shape[1]) >= counts[:, None]] = np.nan
+    return packed, counts
+
+
+def phase_scores(values, times, params, phase_length):
+    """逐时刻的相位感知 MAD 分数，返回 (scores, valid)，均为 [detector, time, feature]"""
+    phases = np.asarray(times, dtype=np.int64) % phase_length
+    step_params = params[:, phases]
+    median, mad = step_params[..., 0], step_params[..., 1]
+
+    valid = ~np.isnan(values) & ~np.isnan(median)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.abs(values - median) / mad
+    scores = np.where((mad == 0) | np.isnan(mad), 0.0, scores)
+    return scores, valid
+
+
+def score_aligned(values, times, params, phase_length, time_window):
+    """批量计算相位感知的 MAD 分数、窗口中位数与 95 百分位综合异常指数
+
+    values: [detector, time, feature]，params: [detector, phase, feature, 2]。
+    返回每个检测器的综合异常指数列表，无有效时间点的检测器为 0。
+    """
+    n_det, n_time, n_feat = values.shape
+    scores, valid = phase_scores(values, times, params, phase_length)
+
+    # 每个 (检测器, 特征) 只在自身的有效分数序列上开窗
+    rows = scores.transpose(0, 2, 1).reshape(n_det * n_feat, n_time)
+    row_mask = valid.transpose(0, 2, 1).reshape(n_det * n_feat, n_time)
+    packed, counts = pack_valid(rows, row_mask)
+    window_medians = rolling_median(packed, time_window, counts)
+
+    # 时刻 t 对应的窗口为该特征截至 t 的最近 time_window 个有效分数
+    seen = np.cumsum(row_mask, axis=1)
+    gathered = np.take_along_axis(window_medians, np.maximum(seen - 1, 0), axis=1)
+    has_window = (seen > 0).reshape(n_det, n_feat, n_time).transpose(0, 2, 1)
+    gathered = gathered.reshape(n_det, n_feat, n_time).transpose(0, 2, 1)
+
+    total = np.where(has_window, gathered, 0.0).sum(axis=-1)
+    count = has_window.sum(axis=-1)
+    step_valid = valid.any(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        combined = total / count
+
+    # 按有效时间点数量分组，批量计算 95 百分位
+    packed_combined, n_steps = pack_valid(combined, step_valid)
+    final_scores = [0] * n_det
+    for n in np.unique(n_steps):
+        if n == 0:
+            continue
+        members = np.flatnonzero(n_steps == n)
+        percentiles = np.percentile(packed_combined[members, :n], 95, axis=1)
+        for det_idx, score in zip(members, percentiles):
+            final_scores[det_idx] = score
+    return final_scores
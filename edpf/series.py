@@ -0,0 +1,35 @@
+import numpy as np
+
+from data_processing.e1_reader import group_by_detector
+from data_processing.parse_cache import load_intervals
+
+# 有效性判断与平滑都依赖这三个属性
+BASE_FEATURES = ['speed', 'occupancy', 'flow']
+
+
+def moving_average(data, window_size=3):
+    """使用移动平均进行数据平滑"""
+    if len(data) < window_size:
+        return np.asarray(data, dtype=np.float64)
+    return np.convolve(data, np.ones(window_size) / window_size, mode='valid')
+
+
+def load_detector_series(file_path, features=BASE_FEATURES, cache=None):
+    """读取 e1 输出并预处理，返回 [(detector_id, times, values[n, feature]), ...]
+
+    剔除 speed<=0、occupancy<0 或 flow<0 的记录后，对每个检测器的各特征做 3 点移动平均，
+    时间轴取平滑窗口的末端；检测器按首次有效出现的顺序排列。cache 的含义同 load_intervals。
+    """
+    fields = ['begin'] + [f for f in BASE_FEATURES if f not in features] + list(features)
+    records = load_intervals(file_path, fields=fields, cache=cache)
+    columns = records.columns
+    times = columns['begin'].astype(np.int64)
+
+    # 数据有效性判断
+    valid = (columns['speed'] > 0) & (columns['occupancy'] >= 0) & (columns['flow'] >= 0)
+
+    series = []
+    for detector_id, rows in group_by_detector(records, valid):
+        values = np.column_stack([moving_average(columns[f][rows]) for f in features])
+        series.append((detector_id, times[rows][len(rows) - len(values):], values))
+    return series
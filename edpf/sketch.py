@@ -0,0 +1,290 @@
+import os
+
+import numpy as np
+
+from edpf.training import MIN_SAMPLES, NORMAL_SCALE
+
+# 逐块计算 MAD 时每块处理的 (检测器, 相位, 特征) 组数
+_GROUP_CHUNK = 4096
+# 草图默认的桶相对精度：桶宽约为取值的 2 * relative_accuracy，需明显小于 MAD（速度约为中位数的 4%）
+SKETCH_RELATIVE_ACCURACY = 0.002
+# evaluate_sketch 允许的 MAD 相对误差 95 分位
+SKETCH_MAD_TOLERANCE = 0.05
+
+
+def sketch_path_for(model_path):
+    """模型文件旁保存草图状态的路径"""
+    return os.path.splitext(model_path)[0] + ".sketch.npz"
+
+
+class LogBuckets:
+    """几何增长的对数分桶：每个桶的代表值相对误差不超过 relative_accuracy
+
+    不大于 min_value 的取值归入 0 号桶（代表值 0），超过 max_value 的取值归入最后一个桶。
+    第 b >= 1 号桶覆盖 (lower[b], upper[b]]，0 号桶的上下界都为 0。
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-2, max_value=1e4):
+        self.min_value = min_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.n_buckets = int(np.ceil(np.log(max_value / min_value) / np.log(self._gamma))) + 1
+        upper = min_value * self._gamma ** np.arange(self.n_buckets)
+        self.representatives = np.concatenate(([0.0], 2 * upper[1:] / (self._gamma + 1)))
+        self.lower = np.concatenate(([0.0], upper[:-1]))
+        self.upper = np.concatenate(([0.0], upper[1:]))
+
+    def bucket_of(self, values):
+        """取值对应的桶下标"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            buckets = np.ceil(np.log(values / self.min_value) / np.log(self._gamma))
+        buckets = np.where(values > self.min_value, buckets, 0)
+        return np.clip(buckets, 0, self.n_buckets - 1).astype(np.int64)
+
+    def quantile(self, counts, q):
+        """由 [group, bucket] 计数估计每组的 q 分位数（与 np.percentile 相同的线性插值），空组为 NaN"""
+        cum = np.cumsum(counts, axis=-1)
+        n = cum[:, -1]
+        position = q * np.maximum(n - 1, 0)
+        lo = np.floor(position).astype(np.int64)
+        hi = np.ceil(position).astype(np.int64)
+        low = self.representatives[(cum > lo[:, None]).argmax(axis=-1)]
+        high = self.representatives[(cum > hi[:, None]).argmax(axis=-1)]
+        return np.where(n > 0, low + (position - lo) * (high - low), np.nan)
+
+
+def segment_quantile(start, end, mass, target):
+    """[row, segment] 个均匀分布线段（长度为 0 时为点质量）混合后，累计质量达到 target 的位置 [row]
+
+    分布函数在线段端点之间是线性的：按端点排序后累加斜率即得各端点处的累计质量，再在相邻端点间线性插值。
+    """
+    length = end - start
+    point = length <= 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(point, 0.0, mass / length)
+    position = np.concatenate((start, end), axis=1)
+    order = np.argsort(position, axis=1, kind='stable')
+    position = np.take_along_axis(position, order, axis=1)
+    jump = np.take_along_axis(np.concatenate((np.where(point, mass, 0.0), np.zeros_like(mass)), axis=1), order, 1)
+    rate = np.cumsum(np.take_along_axis(np.concatenate((slope, -slope), axis=1), order, axis=1), axis=1)
+
+    # cumulative[:, i] 为端点 i 处（含该处点质量）的累计质量，left 为不含该处点质量的左极限
+    gain = np.zeros_like(position)
+    gain[:, 1:] = rate[:, :-1] * np.diff(position, axis=1)
+    cumulative = np.cumsum(gain + jump, axis=1)
+    left = cumulative - jump
+
+    i = np.minimum((cumulative >= target[:, None] - 1e-9).argmax(axis=1), position.shape[1] - 1)[:, None]
+    at = np.take_along_axis(position, i, axis=1)[:, 0]
+    before = np.take_along_axis(position, np.maximum(i - 1, 0), axis=1)[:, 0]
+    mass_before = np.where(i[:, 0] > 0, np.take_along_axis(cumulative, np.maximum(i - 1, 0), axis=1)[:, 0], 0.0)
+    mass_left = np.take_along_axis(left, i, axis=1)[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.clip((target - mass_before) / (mass_left - mass_before), 0, 1)
+    return np.where(target > mass_left, at, before + np.nan_to_num(fraction) * (at - before))
+
+
+class PhaseSketch:
+    """按 (检测器, 相位, 特征) 维护的可合并分位数草图（DDSketch 风格的对数分桶计数，见 LogBuckets）
+
+    计数以 CSR 形式只保存非零的桶：组下标为 (检测器行 * phase_length + 相位) * 特征数 + 特征，
+    第 g 组的桶下标与计数为 bucket_ids / bucket_counts 的 [group_ptr[g], group_ptr[g + 1]) 段（桶下标升序）。
+    新检测器的组追加在末尾。两个草图只要配置相同即可通过计数相加精确合并。
+    """
+
+    def __init__(self, phase_length, features, relative_accuracy=SKETCH_RELATIVE_ACCURACY, min_value=1e-2,
+                 max_value=1e4):
+        self.phase_length = phase_length
+        self.features = list(features)
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+
+        self.buckets = LogBuckets(relative_accuracy, min_value, max_value)
+        self.n_buckets = self.buckets.n_buckets
+
+        self.detector_ids = []
+        self.index = {}
+        self.group_ptr = np.zeros(1, dtype=np.int64)
+        self.bucket_ids = np.zeros(0, dtype=self._bucket_dtype)
+        self.bucket_counts = np.zeros(0, dtype=np.uint32)
+        self.files = []
+
+    def _config(self):
+        return (self.phase_length, self.features, self.relative_accuracy, self.min_value, self.max_value)
+
+    @property
+    def _groups_per_detector(self):
+        return self.phase_length * len(self.features)
+
+    @property
+    def _bucket_dtype(self):
+        return np.uint16 if self.n_buckets <= np.iinfo(np.uint16).max else np.int32
+
+    def _keys(self):
+        """各非零桶的 组下标 * n_buckets + 桶下标（升序）"""
+        groups = np.repeat(np.arange(len(self.group_ptr) - 1, dtype=np.int64), np.diff(self.group_ptr))
+        return groups * self.n_buckets + self.bucket_ids
+
+    def _set_keys(self, keys, counts):
+        n_groups = len(self.detector_ids) * self._groups_per_detector
+        self.group_ptr = np.zeros(n_groups + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // self.n_buckets, minlength=n_groups), out=self.group_ptr[1:])
+        self.bucket_ids = (keys % self.n_buckets).astype(self._bucket_dtype)
+        self.bucket_counts = counts.astype(np.uint32)
+
+    def _ensure_detectors(self, detector_ids):
+        for det in detector_ids:
+            if det not in self.index:
+                self.index[det] = len(self.detector_ids)
+                self.detector_ids.append(det)
+        return np.array([self.index[det] for det in detector_ids], dtype=np.int64)
+
+    def _accumulate(self, keys, values):
+        """把互不相同的 keys 上的计数加到已有计数上：已有的键直接相加，新键按顺序插入"""
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order].astype(np.uint32)
+        current, counts = self._keys(), self.bucket_counts.copy()
+        pos = np.searchsorted(current, keys)
+        found = pos < len(current)
+        found[found] = current[pos[found]] == keys[found]
+        counts[pos[found]] += values[found]
+        new = ~found
+        self._set_keys(np.insert(current, pos[new], keys[new]), np.insert(counts, pos[new], values[new]))
+
+    def bucket_of(self, values):
+        """取值对应的桶下标"""
+        return self.buckets.bucket_of(values)
+
+    def add_shard(self, shard, file_name=None):
+        """折叠一个 phase_shard 分片（与精确训练使用相同的分片格式）"""
+        detector_ids, codes, phases, values = shard
+        rows = self._ensure_detectors(detector_ids)
+        if len(codes):
+            n_features = len(self.features)
+            cell = (rows[codes] * self.phase_length + phases) * n_features
+            flat = ((cell[:, None] + np.arange(n_features)) * self.n_buckets + self.bucket_of(values)).ravel()
+            flat = flat[~np.isnan(values).ravel()]
+            cells, hits = np.unique(flat, return_counts=True)
+            self._accumulate(cells, hits)
+        if file_name is not None:
+            self.files.append(file_name)
+
+    def merge(self, other):
+        """合并另一个配置相同的草图，两者不能包含相同的文件"""
+        if other._config() != self._config():
+            raise ValueError("草图配置不一致，无法合并")
+        overlap = set(self.files) & set(other.files)
+        if overlap:
+            raise ValueError(f"草图包含重复的文件: {sorted(overlap)[:5]}")
+        rows = self._ensure_detectors(other.detector_ids)
+        # other 的检测器行换成本草图中的行，组内相位、特征与桶下标不变
+        span = self._groups_per_detector * self.n_buckets
+        other_keys = other._keys()
+        self._accumulate(rows[other_keys // span] * span + other_keys % span, other.bucket_counts)
+        self.files.extend(other.files)
+
+    def params(self, min_samples=MIN_SAMPLES):
+        """由草图估计 [detector, phase, feature, 2] 的 (median, mad) 参数，逐块只展开各组有计数的桶
+
+        每个桶内的计数视为桶上的均匀分布（0 号桶为 0 处的点质量），中位数为该混合分布的分位数；
+        MAD 为各桶关于中位数折叠后的偏差分布的分位数。桶宽约为取值的 2 * relative_accuracy，只有远小于 MAD 时
+        MAD 才准确（见 SKETCH_RELATIVE_ACCURACY）；中位数所在的桶占过半样本时 MAD 为 0。
+        与精确训练一样取第 (n-1)//2 与 n//2 个样本的平均，第 k 个（从 0 开始）样本对应累计计数 k + 0.5。
+        """
+        result = np.full((len(self.detector_ids) * self._groups_per_detector, 2), np.nan)
+        groups = np.flatnonzero(np.diff(self.group_ptr))
+        starts, ends = self.group_ptr[groups], self.group_ptr[groups + 1]
+        for start in range(0, len(groups), _GROUP_CHUNK):
+            stop = min(start + _GROUP_CHUNK, len(groups))
+            sizes = ends[start:stop] - starts[start:stop]
+            entries = np.arange(starts[start], ends[stop - 1])
+            local = np.repeat(np.arange(stop - start), sizes)
+            slot = entries - np.repeat(starts[start:stop], sizes)
+            lower = np.zeros((stop - start, sizes.max()))
+            upper = np.zeros_like(lower)
+            counts = np.zeros_like(lower)
+            lower[local, slot] = self.buckets.lower[self.bucket_ids[entries]]
+            upper[local, slot] = self.buckets.upper[self.bucket_ids[entries]]
+            counts[local, slot] = self.bucket_counts[entries]
+
+            n = counts.sum(axis=1)
+            ok = n >= max(min_samples, 1)
+            ranks = [(n - 1) // 2 + 0.5, n // 2 + 0.5]
+            median = sum(segment_quantile(lower, upper, counts, rank) for rank in ranks) / 2
+
+            # 每个桶分成中位数以下与以上两段，分别折叠为偏差 |x - median| 上的线段
+            m = median[:, None]
+            width = upper - lower
+            with np.errstate(divide='ignore', invalid='ignore'):
+                below = np.where(width > 0, np.clip((m - lower) / width, 0, 1), (lower <= m) * 1.0)
+            dev_start = np.concatenate((m - np.minimum(upper, m), np.maximum(lower, m) - m), axis=1)
+            dev_end = np.concatenate((m - np.minimum(lower, m), upper - m), axis=1)
+            dev_end = np.maximum(dev_end, dev_start)
+            dev_mass = np.concatenate((counts * below, counts * (1 - below)), axis=1)
+            mad = sum(segment_quantile(dev_start, dev_end, dev_mass, rank) for rank in ranks) / 2
+            # 中位数所在的桶就占了过半样本时 MAD 低于草图分辨率，与取值重复的精确结果一样记为 0
+            crowded = (counts * ((lower < m) & (m <= upper))).sum(axis=1) >= n // 2 + 1
+            mad = np.where(crowded, 0.0, mad)
+
+            rows = groups[start:stop]
+            result[rows, 0] = np.where(ok, median, np.nan)
+            result[rows, 1] = np.where(ok, mad / NORMAL_SCALE, np.nan)
+        return self.detector_ids, result.reshape(len(self.detector_ids), self.phase_length, len(self.features), 2)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                group_ptr=self.group_ptr,
+                bucket_ids=self.bucket_ids,
+                bucket_counts=self.bucket_counts,
+                detector_ids=np.array(self.detector_ids, dtype=str),
+                files=np.array(self.files, dtype=str),
+                features=np.array(self.features, dtype=str),
+                config=np.array([self.phase_length, self.relative_accuracy, self.min_value, self.max_value]),
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            phase_length, relative_accuracy, min_value, max_value = data['config'].tolist()
+            sketch = cls(int(phase_length), data['features'].tolist(), relative_accuracy, min_value, max_value)
+            sketch.detector_ids = data['detector_ids'].tolist()
+            sketch.index = {det: i for i, det in enumerate(sketch.detector_ids)}
+            sketch.group_ptr = data['group_ptr'].astype(np.int64)
+            sketch.bucket_ids = data['bucket_ids'].astype(sketch._bucket_dtype)
+            sketch.bucket_counts = data['bucket_counts'].astype(np.uint32)
+            sketch.files = data['files'].tolist()
+        return sketch
+
+
+def merge_sketch_files(paths, output_path=None):
+    """合并多个分别训练的草图文件（例如不同机器、不同日期的部分模型）"""
+    merged = PhaseSketch.load(paths[0])
+    for path in paths[1:]:
+        merged.merge(PhaseSketch.load(path))
+    if output_path:
+        merged.save(output_path)
+    return merged
+
+
+def sketch_error_report(sketch_ids, sketch_params, exact_ids, exact_params):
+    """比较草图参数与精确训练参数的相对误差"""
+    index = {det: i for i, det in enumerate(sketch_ids)}
+    common = [i for i, det in enumerate(exact_ids) if det in index]
+    approx = sketch_params[[index[exact_ids[i]] for i in common]]
+    exact = exact_params[common]
+
+    report = {"detectors": len(common)}
+    for k, name in enumerate(['median', 'mad']):
+        a, e = approx[..., k], exact[..., k]
+        both = ~np.isnan(a) & ~np.isnan(e)
+        rel = np.abs(a[both] - e[both]) / np.maximum(np.abs(e[both]), 1e-9)
+        report[name] = {
+            "compared": int(both.sum()),
+            "mean_rel_error": float(rel.mean()) if len(rel) else 0.0,
+            "p95_rel_error": float(np.percentile(rel, 95)) if len(rel) else 0.0,
+            "max_rel_error": float(rel.max()) if len(rel) else 0.0,
+        }
+    report["nan_mismatch"] = int((np.isnan(approx[..., 0]) != np.isnan(exact[..., 0])).sum())
+    return report
@@ -0,0 +1,92 @@
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+import numpy as np
+
+from abnormal_injection.get_data import parse_detectors, parse_edge_graph
+
+
+def _reach(start, graph, hops):
+    """沿 graph 的有向边从 start 出发 hops 跳以内可达的道路（含自身）"""
+    seen = {start}
+    frontier = {start}
+    for _ in range(hops):
+        frontier = {nxt for edge in frontier for nxt in graph.get(edge, ())} - seen
+        if not frontier:
+            break
+        seen |= frontier
+    return seen
+
+
+def detector_neighbours(lane_to_detectors, lane_to_edge, successors, hops):
+    """每个检测器沿道路向上游或下游 hops 跳以内的检测器集合（同一道路上的检测器为 0 跳，含自身）
+
+    lane_to_detectors 来自 get_data.parse_detectors，lane_to_edge 与 successors 来自 get_data.parse_edge_graph；
+    不在路网中的车道上的检测器不出现在结果里。
+    """
+    predecessors = defaultdict(set)
+    for edge, nexts in successors.items():
+        for nxt in nexts:
+            predecessors[nxt].add(edge)
+
+    edge_detectors = defaultdict(list)
+    for lane, detectors in lane_to_detectors.items():
+        edge = lane_to_edge.get(lane)
+        if edge is not None:
+            edge_detectors[edge].extend(detectors)
+
+    neighbours = {}
+    for edge, detectors in edge_detectors.items():
+        near = set()
+        for other in _reach(edge, successors, hops) | _reach(edge, predecessors, hops):
+            near.update(edge_detectors.get(other, ()))
+        for det in detectors:
+            neighbours[det] = near
+    return neighbours
+
+
+def load_neighbours(net_file, add_file, hops):
+    """由 map.net.xml 与检测器配置文件计算 detector_neighbours"""
+    lane_to_detectors, _ = parse_detectors(add_file)
+    lane_to_edge, successors = parse_edge_graph(net_file)
+    return detector_neighbours(lane_to_detectors, lane_to_edge, successors, hops)
+
+
+def allowed_pair_mask(series_detectors, neighbours):
+    """序列两两之间是否需要检验的掩码 [target, source]
+
+    series_detectors 为每条序列所属的检测器。同一检测器的序列之间、互为邻居的检测器的序列之间为 True；
+    neighbours 中没有的检测器无法按路网剪枝，与全部序列之间都为 True。
+    """
+    detectors = list(dict.fromkeys(series_detectors))
+    code = {det: i for i, det in enumerate(detectors)}
+    det_mask = np.eye(len(detectors), dtype=bool)
+    for i, det in enumerate(detectors):
+        near = neighbours.get(det)
+        if near is None:
+            det_mask[i, :] = True
+            det_mask[:, i] = True
+        else:
+            det_mask[i, [code[other] for other in near if other in code]] = True
+    idx = np.array([code[det] for det in series_detectors], dtype=np.int64)
+    return det_mask[np.ix_(idx, idx)]
+
+
+def load_allowed_mask(series_detectors, net_file, add_file, hops):
+    """由路网文件生成 allowed_pair_mask；hops 为 None 或路网文件无法解析时返回 None（不剪枝）"""
+    if hops is None:
+        return None
+    try:
+        neighbours = load_neighbours(net_file, add_file, hops)
+    except (OSError, ET.ParseError) as e:
+        print(f"WARNING: 无法读取路网或检测器文件，将检验全部序列对: {e}")
+        return None
+
+    unknown = {det for det in series_detectors if det not in neighbours}
+    if unknown:
+        print(f"WARNING: {len(unknown)} 个检测器不在路网中，与其相关的序列对全部保留")
+    allowed = allowed_pair_mask(series_detectors, neighbours)
+    n_series = len(series_detectors)
+    n_allowed = int(allowed.sum()) - n_series
+    print(f"INFO: 按 {hops} 跳以内的上下游关系保留 {n_allowed} / {n_series * (n_series - 1)} 个序列对")
+    return allowed
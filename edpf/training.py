@@ -0,0 +1,127 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+from tqdm import tqdm
+
+from edpf.series import load_detector_series
+
+# scipy.stats.median_abs_deviation(scale='normal') 使用的缩放常数 special.ndtri(0.75)
+NORMAL_SCALE = 0.6744897501960817
+
+# 每个 (检测器, 相位, 特征) 至少需要的样本数，不足时参数记为 NaN
+MIN_SAMPLES = 5
+
+
+def phase_shard(file_path, features, phase_length, cache=False):
+    """解析单个正常数据文件，返回按相位展开的紧凑分片
+
+    分片为 (detector_ids, codes, phases, values)：codes 为每个样本在 detector_ids 中的下标，
+    phases 为 t % phase_length，values 为 [n, feature] 的平滑后取值。
+    训练文件通常只解析一次，默认不读写解析缓存；cache=None 使用默认缓存。
+    """
+    detector_ids, codes, phases, values = [], [], [], []
+    for code, (detector_id, times, series) in enumerate(load_detector_series(file_path, features, cache)):
+        detector_ids.append(detector_id)
+        codes.append(np.full(len(times), code, dtype=np.int32))
+        phases.append((times % phase_length).astype(np.int32))
+        values.append(series)
+
+    if not detector_ids:
+        return [], np.empty(0, np.int32), np.empty(0, np.int32), np.empty((0, len(features)))
+    return detector_ids, np.concatenate(codes), np.concatenate(phases), np.concatenate(values)
+
+
+def collect_shards(file_paths, features, phase_length, workers=1, verbose=False, cache=False):
+    """解析所有文件为分片；workers>1 时在进程池中并行解析，cache 同 phase_shard
+
+    返回的分片顺序始终与 file_paths 一致，合并结果与 workers 数量无关。
+    """
+    progress = dict(total=len(file_paths), desc="处理正常数据文件", disable=not verbose)
+    if workers <= 1 or len(file_paths) <= 1:
+        return [phase_shard(file_path, features, phase_length, cache)
+                for file_path in tqdm(file_paths, **progress)]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as pool:
+        shards = pool.map(phase_shard, file_paths, repeat(features), repeat(phase_length), repeat(cache))
+        return list(tqdm(shards, **progress))
+
+
+def merge_shards(shards):
+    """按顺序合并分片，检测器按首次出现的顺序统一编码"""
+    index = {}
+    detector_ids = []
+    codes, phases, values = [], [], []
+    for shard_ids, shard_codes, shard_phases, shard_values in shards:
+        remap = np.empty(len(shard_ids), dtype=np.int32)
+        for i, detector_id in enumerate(shard_ids):
+            if detector_id not in index:
+                index[detector_id] = len(detector_ids)
+                detector_ids.append(detector_id)
+            remap[i] = index[detector_id]
+        codes.append(remap[shard_codes])
+        phases.append(shard_phases)
+        values.append(shard_values)
+    if not codes:
+        return detector_ids, np.empty(0, np.int32), np.empty(0, np.int32), np.empty((0, 0))
+    return detector_ids, np.concatenate(codes), np.concatenate(phases), np.concatenate(values)
+
+
+def group_padded(group, values, n_groups):
+    """按分组编号把样本放入 NaN 填充的 [group, sample, feature] 数组，组内保持原有顺序"""
+    counts = np.bincount(group, minlength=n_groups)
+    padded = np.full((n_groups, max(counts.max(initial=0), 1), values.shape[1]), np.nan)
+    order = np.argsort(group, kind='stable')
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sorted_group = group[order]
+    padded[sorted_group, np.arange(len(order)) - starts[sorted_group]] = values[order]
+    return padded, counts
+
+
+def _partition_median(block, n):
+    """对 [group, n, feature] 块沿样本轴取中位数（与 np.median 结果一致）"""
+    lo, hi = (n - 1) // 2, n // 2
+    part = np.partition(block, [lo, hi] if lo != hi else lo, axis=1)
+    if lo == hi:
+        return part[:, lo]
+    return (part[:, lo] + part[:, hi]) / 2
+
+
+def robust_params(padded, counts, min_samples=MIN_SAMPLES):
+    """批量计算每组的 (median, mad)，样本数不足 min_samples 的组为 NaN"""
+    n_groups, _, n_features = padded.shape
+    params = np.full((n_groups, n_features, 2), np.nan)
+    # 样本数相同的组一起计算，便于使用固定 kth 的 partition
+    for n in np.unique(counts):
+        if n < min_samples:
+            continue
+        members = np.flatnonzero(counts == n)
+        block = padded[members, :n]
+        median = _partition_median(block, n)
+        mad = _partition_median(np.abs(block - median[:, None]), n)
+        params[members, :, 0] = median
+        params[members, :, 1] = mad / NORMAL_SCALE
+    return params
+
+
+def fit_phase_params(shards, phase_length, n_features):
+    """合并所有分片并计算鲁棒统计量，返回 (detector_ids, [detector, phase, feature, 2] 参数数组)"""
+    detector_ids, codes, phases, values = merge_shards(shards)
+    n_groups = len(detector_ids) * phase_length
+    if len(codes) == 0:
+        return detector_ids, np.full((len(detector_ids), phase_length, n_features, 2), np.nan)
+    padded, counts = group_padded(codes.astype(np.int64) * phase_length + phases, values, n_groups)
+    params = robust_params(padded, counts)
+    return detector_ids, params.reshape(len(detector_ids), phase_length, n_features, 2)
+
+
+def params_to_dict(detector_ids, params, features):
+    """将参数数组转换为 normal_params 的嵌套字典结构"""
+    normal_params = defaultdict(lambda: defaultdict(dict))
+    for i, detector_id in enumerate(detector_ids):
+        for phase in range(params.shape[1]):
+            for j, feature in enumerate(features):
+                normal_params[detector_id][phase][feature] = (params[i, phase, j, 0],
+                                                              params[i, phase, j, 1])
+    return normal_params
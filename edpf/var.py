@@ -0,0 +1,143 @@
+import numpy as np
+
+# 块坐标下降的收敛阈值：一轮更新中（正交化尺度下）系数的最大变化
+_TOL = 1e-4
+_MAX_SWEEPS = 500
+
+# 正交化时特征值相对最大特征值低于该阈值的方向视为共线并丢弃
+_EIG_RCOND = 1e-8
+
+# 计算梯度范数时每批的目标序列数，限制中间数组的内存占用
+_TARGET_BLOCK = 256
+
+
+def _standardize(data):
+    """按序列用有效值标准化，缺失值填 0（即均值）；常数或全缺失的序列整列为 0，返回 (x, usable)"""
+    valid = ~np.isnan(data)
+    count = valid.sum(axis=0)
+    filled = np.where(valid, data, 0.0)
+    mean = filled.sum(axis=0) / np.maximum(count, 1)
+    centered = np.where(valid, data - mean, 0.0)
+    std = np.sqrt((centered ** 2).sum(axis=0) / np.maximum(count, 1))
+    usable = (count > 0) & (std > 0)
+    return centered / np.where(usable, std, 1.0), usable
+
+
+def _lagged_design(x, max_lag):
+    """各序列滞后 1..max_lag 的取值按组正交化：返回 (y, basis, whiten)
+
+    y: [n, series]，为 t >= max_lag 的当前值；basis: [series * max_lag, n]，第 j 组的 max_lag 行满足
+    basis_j basis_j^T / n = I；whiten: [series, max_lag, max_lag]，原滞后系数 = whiten_j @ 正交化系数。
+    """
+    n_time, n_series = x.shape
+    n = n_time - max_lag
+    lagged = np.stack([x[max_lag - lag:n_time - lag].T for lag in range(1, max_lag + 1)], axis=1)  # [S, L, n]
+    gram = lagged @ np.swapaxes(lagged, 1, 2) / n
+    w, v = np.linalg.eigh(gram)
+    keep = w > _EIG_RCOND * np.maximum(w[:, -1:], 0)
+    inv_sqrt = np.where(keep, 1.0 / np.sqrt(np.where(keep, w, 1.0)), 0.0)
+    whiten = (v * inv_sqrt[:, None, :]) @ np.swapaxes(v, 1, 2)
+    basis = (whiten @ lagged).reshape(n_series * max_lag, n)
+    return np.ascontiguousarray(x[max_lag:]), basis, whiten
+
+
+def _group_norms(basis, residuals, max_lag, n):
+    """梯度范数 ||basis_j r_i|| / n，residuals 为 [target, n]，返回 [target, source]"""
+    n_series = basis.shape[0] // max_lag
+    norms = np.empty((len(residuals), n_series))
+    for start in range(0, len(residuals), _TARGET_BLOCK):
+        block = residuals[start:start + _TARGET_BLOCK] @ basis.T / n
+        norms[start:start + len(block)] = np.sqrt((block.reshape(len(block), n_series, max_lag) ** 2).sum(axis=2))
+    return norms
+
+
+def _block_descent(basis, residuals, beta, work, lam, targets, max_lag, n):
+    """全部目标同步进行的块坐标下降：依次更新每个来源组，该组在其工作集中的目标一起更新
+
+    residuals [target, n] 与 beta [target, source, lag]（正交化尺度）就地更新；work [source, target] 为工作集，
+    目标自身的组不惩罚。某个目标一轮内系数变化都小于 _TOL 即视为收敛，不再参与后续各轮。
+    """
+    n_series = len(residuals)
+    alive = np.zeros(n_series, dtype=bool)
+    alive[targets] = True
+    groups = np.flatnonzero(work[:, alive].any(axis=1))
+    for _ in range(_MAX_SWEEPS):
+        change = np.zeros(n_series)
+        for j in groups:
+            t = np.flatnonzero(work[j] & alive)
+            if not len(t):
+                continue
+            rows = basis[j * max_lag:(j + 1) * max_lag]
+            old = beta[t, j]
+            z = residuals[t] @ rows.T / n + old
+            norm = np.sqrt((z * z).sum(axis=1))
+            threshold = np.where(t == j, 0.0, lam[t])
+            scale = np.where(norm > threshold, 1 - threshold / np.where(norm > 0, norm, 1.0), 0.0)
+            new = z * scale[:, None]
+            delta = new - old
+            moved = np.abs(delta).max(axis=1)
+            sel = moved > 0
+            if sel.any():
+                residuals[t[sel]] -= delta[sel] @ rows
+                beta[t[sel], j] = new[sel]
+                change[t] = np.maximum(change[t], moved)
+        alive &= change >= _TOL
+        if not alive.any():
+            break
+
+
+def fit_sparse_var(data, max_lag, min_ratio=0.5, n_lambdas=10, allowed=None):
+    """对全部序列拟合一个稀疏 VAR：每个目标序列对各来源序列的 max_lag 个滞后系数做 group lasso
+
+    data: [time, series]，NaN 为缺失。各序列先标准化，缺失值按均值填补；目标自身的滞后项不惩罚。
+    每个来源序列的滞后组先正交化，块坐标下降沿 lambda 路径（每个目标自身的 lambda_max 乘以 1 到 min_ratio
+    的 n_lambdas 个等比值）逐点热启动，用强规则筛选候选组并以 KKT 条件校验。
+    allowed 为 [target, source] 布尔掩码时只允许其中为 True 的来源进入模型。
+    返回 (influence, coef, entry)，均为 min_ratio 处的结果：influence [target, source] 为来源序列对目标拟合值的
+    均方根贡献（标准化尺度，对角线为 0）；coef [target, source, lag] 为标准化数据上的滞后系数（含自身滞后）；
+    entry [target, source] 为该来源沿路径首次进入模型时的 lambda / lambda_max（越大影响越强），未进入为 0。
+    """
+    x, usable = _standardize(np.asarray(data, dtype=np.float64))
+    y, basis, whiten = _lagged_design(x, max_lag)
+    n, n_series = y.shape
+    candidates = np.repeat(usable[None, :], n_series, axis=0)
+    if allowed is not None:
+        candidates &= np.asarray(allowed, dtype=bool)
+    np.fill_diagonal(candidates, False)
+    targets = np.flatnonzero(usable)
+
+    # lambda_max 之上只含自身滞后（正交化后即为投影系数）
+    residuals = np.ascontiguousarray(y.T)
+    beta = np.zeros((n_series, n_series, max_lag))
+    own = np.eye(n_series, dtype=bool)
+    _block_descent(basis, residuals, beta, own, np.zeros(n_series), targets, max_lag, n)
+    norms = _group_norms(basis, residuals, max_lag, n)
+    lam_max = np.where(candidates, norms, 0).max(axis=1)
+
+    entry = np.zeros((n_series, n_series))
+    previous_lam = lam_max
+    for ratio in np.geomspace(1.0, min_ratio, n_lambdas):
+        lam = lam_max * ratio
+        # 强规则：上一个 lambda 处梯度范数不小于 2*lam - lam_prev 的组才可能进入模型
+        work = (candidates & (norms >= (2 * lam - previous_lam)[:, None])) | own | beta.any(axis=2)
+        pending = targets
+        while len(pending):
+            _block_descent(basis, residuals, beta, work.T, lam, pending, max_lag, n)
+            norms[pending] = _group_norms(basis, residuals[pending], max_lag, n)
+            missed = candidates[pending] & ~work[pending] & (norms[pending] > lam[pending, None] * (1 + 1e-6))
+            work[pending] |= missed
+            pending = pending[missed.any(axis=1)]
+        entry[(entry == 0) & beta.any(axis=2)] = ratio
+        previous_lam = lam
+
+    coef = np.einsum('jlm,ijm->ijl', whiten, beta)
+    influence = np.sqrt((beta ** 2).sum(axis=2))
+    np.fill_diagonal(influence, 0.0)
+    np.fill_diagonal(entry, 0.0)
+    return influence, coef, entry
+
+
+def save_var(path, columns, influence, coef, entry, **extra):
+    """保存为 npz：columns、influence [target, source]、coef [target, source, lag]、entry [target, source]，以及 extra 中的数组"""
+    with open(path, 'wb') as f:
+        np.savez(f, columns=np.array(columns, dtype=str), influence=influence, coef=coef, entry=entry, **extra)
@@ -1,105 +1,76 @@
 import os
-import xml.etree.ElementTree as ET
 import numpy as np
 import json
 from collections import defaultdict
 from tqdm import tqdm
 from pathlib import Path
-from scipy.stats import median_abs_deviation
+from data_processing.detector_frame import DetectorFrame
+from edpf.cascade import cascade_scores
+from edpf.model_store import MappedModel, save_binary_model
+from edpf.online import OnlineDetector
+from edpf.rolling import RollingMedian
+from edpf.scoring import build_param_array, score_aligned
+from edpf.series import load_detector_series
+from edpf.sketch import (SKETCH_MAD_TOLERANCE, SKETCH_RELATIVE_ACCURACY, PhaseSketch, sketch_error_report,
+                         sketch_path_for)
+from edpf.training import collect_shards, fit_phase_params, params_to_dict
 
 
 class EnhancedTrafficAnomalyDetector:
-    def __init__(self, phase_length=90, time_window=30, top_k=10, verbose=True):
+    def __init__(self, phase_length=90, time_window=30, top_k=10, verbose=True,
+                 scoring_mode='array', workers=1, cache_training=False):
         self.phase_length = phase_length
         self.time_window = time_window
         self.top_k = top_k
         self.verbose = verbose
+        self.scoring_mode = scoring_mode  # 'array' 批量数组计算，'cascade' 上界剪枝后精确计算，'loop' 逐点计算
+        self.workers = workers  # 训练时并行解析文件的进程数
+        self.cache_training = cache_training  # 训练时是否把正常数据文件的解析结果写入解析缓存
         self.features = ['speed', 'occupancy', 'flow']
         self.normal_params = defaultdict(lambda: defaultdict(dict))
         self._model_trained = False
+        self.cascade_stats = None  # 最近一次级联筛选的检测器数、精确打分数与剪枝数
+
+    def _training_cache(self):
+        # 正常数据文件默认只解析一次、不写入解析缓存，避免训练集被整体复制到 data/parse_cache
+        return None if self.cache_training else False
 
     def _print(self, message):
         if self.verbose:
             print(f"[SYSTEM] {message}")
 
-    def _smooth_data(self, data, window_size=3):
-        """使用移动平均进行数据平滑"""
-        if len(data) < window_size:
-            return data
-        return np.convolve(data, np.ones(window_size) / window_size, mode='valid')
-
     def _parse_xml(self, file_path):
-        """改进的XML解析，包含数据预处理"""
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-
+        """改进的XML解析，包含数据预处理（有效性过滤与移动平均平滑）"""
         time_series = defaultdict(lambda: defaultdict(list))
-        for interval in root.findall('interval'):
-            t = int(float(interval.get('begin')))
-            detector_id = interval.get('id')
-
-            # 读取所有特征并预处理
-            record = {
-                'speed': float(interval.get('speed')),
-                'occupancy': float(interval.get('occupancy')),
-                'flow': float(interval.get('flow'))
-            }
-
-            # 数据有效性判断
-            valid = record['speed'] > 0 and record['occupancy'] >= 0 and record['flow'] >= 0
-            if valid:
-                for feature in self.features:
-                    time_series[detector_id][feature].append((t, record[feature]))
-
-        # 数据平滑处理
-        for detector in time_series.values():
-            for feature in self.features:
-                if len(detector[feature]) > 0:
-                    times, values = zip(*detector[feature])
-                    smoothed = self._smooth_data(values)
-                    if len(smoothed) > 0:
-                        detector[feature] = list(zip(times[-len(smoothed):], smoothed))
+        for detector_id, times, values in load_detector_series(file_path, self.features):
+            row_times = times.tolist()
+            for j, feature in enumerate(self.features):
+                time_series[detector_id][feature] = list(zip(row_times, values[:, j].tolist()))
         return time_series
 
+    def _parse_frame(self, file_path):
+        """预处理后的数据以 DetectorFrame 返回（float64，保证与逐点计算的分数一致）"""
+        series = load_detector_series(file_path, self.features)
+        return DetectorFrame.from_series(series, self.features, dtype=np.float64)
+
     def train_normal_model(self, normal_dir, save_path=None):
         self._print(f"开始训练正常流量模型，数据目录: {normal_dir}")
 
-        phase_buckets = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-        file_count = 0
-
-        for file_name in tqdm(sorted(os.listdir(normal_dir)),
-                              desc="处理正常数据文件",
-                              disable=not self.verbose):
-            if not file_name.startswith("normal_"):
-                continue
-
-            file_path = os.path.join(normal_dir, file_name)
-            time_series = self._parse_xml(file_path)
-
-            for detector, features in time_series.items():
-                for feature in self.features:
-                    for t, value in features[feature]:
-                        phase = t % self.phase_length
-                        phase_buckets[detector][phase][feature].append(value)
-            file_count += 1
-
-        if file_count == 0:
+        file_paths = [os.path.join(normal_dir, file_name)
+                      for file_name in sorted(os.listdir(normal_dir))
+                      if file_name.startswith("normal_")]
+        if not file_paths:
             raise ValueError("未找到正常数据文件")
 
+        # 每个文件解析为按相位展开的数组分片（workers>1 时多进程并行）
+        shards = collect_shards(file_paths, self.features, self.phase_length,
+                                workers=self.workers, verbose=self.verbose,
+                                cache=self._training_cache())
+
         # 计算鲁棒统计量
         self._print("计算鲁棒统计参数...")
-        for detector in tqdm(phase_buckets.keys(),
-                             desc="处理检测器",
-                             disable=not self.verbose):
-            for phase in range(self.phase_length):
-                for feature in self.features:
-                    data = phase_buckets[detector][phase][feature]
-                    if len(data) >= 5:
-                        median = np.median(data)
-                        mad = median_abs_deviation(data, scale='normal')
-                        self.normal_params[detector][phase][feature] = (median, mad)
-                    else:
-                        self.normal_params[detector][phase][feature] = (np.nan, np.nan)
+        detector_ids, params = fit_phase_params(shards, self.phase_length, len(self.features))
+        self.normal_params = params_to_dict(detector_ids, params, self.features)
 
         self._model_trained = True
 
@@ -107,7 +78,75 @@ class EnhancedTrafficAnomalyDetector:
             self.save_model(save_path)
             self._print(f"模型已保存至: {save_path}")
 
+    def update_normal_model(self, normal_dir, save_path, sketch_path=None,
+                            relative_accuracy=SKETCH_RELATIVE_ACCURACY):
+        """增量训练：把尚未合并的 normal_* 文件折叠进分位数草图，并由草图重新估计模型参数
+
+        草图状态默认保存在模型文件旁（*.sketch.npz），已合并过的文件不会被重新解析。
+        """
+        sketch_path = sketch_path or sketch_path_for(save_path)
+        if os.path.exists(sketch_path):
+            sketch = PhaseSketch.load(sketch_path)
+            if sketch.phase_length != self.phase_length or sketch.features != self.features:
+                raise ValueError("草图的相位长度或特征与检测器配置不一致")
+        else:
+            sketch = PhaseSketch(self.phase_length, self.features, relative_accuracy)
+
+        new_files = [file_name for file_name in sorted(os.listdir(normal_dir))
+                     if file_name.startswith("normal_") and file_name not in sketch.files]
+        self._print(f"增量训练: 新文件 {len(new_files)} 个，已合并 {len(sketch.files)} 个")
+        new_paths = [os.path.join(normal_dir, file_name) for file_name in new_files]
+        shards = collect_shards(new_paths, self.features, self.phase_length,
+                                workers=self.workers, verbose=self.verbose,
+                                cache=self._training_cache())
+        for file_name, shard in zip(new_files, shards):
+            sketch.add_shard(shard, file_name)
+
+        if not sketch.files:
+            raise ValueError("未找到正常数据文件")
+
+        detector_ids, params = sketch.params()
+        self.normal_params = params_to_dict(detector_ids, params, self.features)
+        self._model_trained = True
+
+        self.save_model(save_path)
+        sketch.save(sketch_path)
+        self._print(f"模型已保存至: {save_path}，草图已保存至: {sketch_path}")
+        return sketch
+
+    def evaluate_sketch(self, reference_dir, relative_accuracy=SKETCH_RELATIVE_ACCURACY,
+                        mad_tolerance=SKETCH_MAD_TOLERANCE):
+        """在参考数据集上比较草图训练与精确训练得到的参数，返回相对误差报告
+
+        MAD 相对误差的 95 分位超过 mad_tolerance 时抛出 ValueError。
+        """
+        file_paths = [os.path.join(reference_dir, file_name)
+                      for file_name in sorted(os.listdir(reference_dir))
+                      if file_name.startswith("normal_")]
+        shards = collect_shards(file_paths, self.features, self.phase_length, workers=self.workers,
+                                cache=self._training_cache())
+
+        exact_ids, exact_params = fit_phase_params(shards, self.phase_length, len(self.features))
+        sketch = PhaseSketch(self.phase_length, self.features, relative_accuracy)
+        for shard in shards:
+            sketch.add_shard(shard)
+        sketch_ids, sketch_params = sketch.params()
+
+        report = sketch_error_report(sketch_ids, sketch_params, exact_ids, exact_params)
+        for name in ['median', 'mad']:
+            stats = report[name]
+            self._print(f"{name}: 平均相对误差 {stats['mean_rel_error']:.4f}，"
+                        f"95分位 {stats['p95_rel_error']:.4f}，最大 {stats['max_rel_error']:.4f}")
+        if report['mad']['p95_rel_error'] > mad_tolerance:
+            raise ValueError(f"草图 MAD 相对误差的95分位 {report['mad']['p95_rel_error']:.4f} 超过 {mad_tolerance}，"
+                             f"请减小 relative_accuracy")
+        return report
+
     def save_model(self, file_path):
+        """保存模型：.npy 为内存映射二进制格式，其余按 JSON 保存"""
+        if file_path.endswith('.npy'):
+            save_binary_model(file_path, self.normal_params, self.phase_length, self.features)
+            return
         save_data = {}
         for detector, phases in self.normal_params.items():
             save_data[detector] = {}
@@ -120,6 +159,14 @@ class EnhancedTrafficAnomalyDetector:
 
     def load_model(self, file_path):
         self._print(f"加载预训练模型: {file_path}")
+        if file_path.endswith('.npy'):
+            model = MappedModel(file_path)
+            if model.phase_length != self.phase_length or model.features != self.features:
+                raise ValueError("模型的相位长度或特征与检测器配置不一致")
+            self.normal_params = model
+            self._model_trained = True
+            return
+
         with open(file_path, 'r') as f:
             loaded_data = json.load(f)
 
@@ -137,26 +184,24 @@ class EnhancedTrafficAnomalyDetector:
             return 0
         return abs(actual - median) / mad
 
-    def detect_anomalies(self, test_file, output_file=None):
-        if not self._model_trained:
-            raise RuntimeError("请先训练或加载模型")
-
-        self._print(f"\n开始检测异常: {Path(test_file).name}")
-        test_data = self._parse_xml(test_file)
-
+    def _score_detectors_loop(self, test_data):
+        """逐检测器、逐时间点计算综合异常指数"""
         detector_scores = defaultdict(list)
         min_valid_samples = 3  # 窗口内最小有效样本数
 
         for detector_id, features in tqdm(test_data.items(),
                                           desc="处理检测器数据",
                                           disable=not self.verbose):
-            feature_scores = {f: [] for f in self.features}
+            feature_windows = {f: RollingMedian(self.time_window) for f in self.features}
             time_points = set()
+            # 各特征按时间点建立索引（同一时间点取第一个值），避免逐时间点扫描整个序列
+            feature_values = {f: {} for f in self.features}
 
             # 收集所有时间点
             for feature in self.features:
-                for t, _ in features[feature]:
+                for t, v in features[feature]:
                     time_points.add(t)
+                    feature_values[feature].setdefault(t, v)
 
             # 按时间顺序处理
             sorted_times = sorted(time_points)
@@ -167,7 +212,7 @@ class EnhancedTrafficAnomalyDetector:
 
                 for feature in self.features:
                     # 查找当前时间的特征值
-                    current_value = next((v for (time, v) in features[feature] if time == t), None)
+                    current_value = feature_values[feature].get(t)
                     if current_value is None:
                         continue
 
@@ -178,20 +223,16 @@ class EnhancedTrafficAnomalyDetector:
 
                     # 计算特征分数
                     score = self._calculate_feature_score(current_value, *params)
-                    feature_scores[feature].append(score)
+                    feature_windows[feature].push(score)
                     valid_features += 1
 
                 # 组合多特征分数
                 if valid_features > 0:
                     window_scores = []
                     for feature in self.features:
-                        if len(feature_scores[feature]) >= self.time_window:
-                            window = feature_scores[feature][-self.time_window:]
-                        else:
-                            window = feature_scores[feature]
-
-                        if len(window) > 0:
-                            window_scores.append(np.median(window))
+                        # 滑动窗口内最近 time_window 个分数的中位数
+                        if len(feature_windows[feature]) > 0:
+                            window_scores.append(feature_windows[feature].median())
 
                     if len(window_scores) > 0:
                         combined_score = np.mean(window_scores)
@@ -203,11 +244,65 @@ class EnhancedTrafficAnomalyDetector:
                 detector_scores[detector_id] = final_score
             else:
                 detector_scores[detector_id] = 0
+        return detector_scores
+
+    def _score_detectors_array(self, frame):
+        """在 DetectorFrame 的 (detector, time, feature) 数组上批量计算综合异常指数"""
+        params = build_param_array(self.normal_params, frame.detector_ids,
+                                   self.phase_length, self.features)
+        scores = score_aligned(frame.values.transpose(1, 0, 2), frame.times, params,
+                               self.phase_length, self.time_window)
+        return dict(zip(frame.detector_ids, scores))
+
+    def _score_detectors_cascade(self, frame):
+        """两阶段筛选：先计算每个检测器综合异常指数的上界，只对可能进入 top-K 的检测器精确打分
+
+        返回的字典只包含精确打分的检测器，其 top-K 与穷举计算完全相同。
+        """
+        detector_ids = frame.detector_ids
+        params = build_param_array(self.normal_params, detector_ids,
+                                   self.phase_length, self.features)
+        eligible = frame.counts() >= 5
+        exact, _ = cascade_scores(frame.values.transpose(1, 0, 2), frame.times, params,
+                                  self.phase_length, self.time_window, self.top_k, eligible)
+        self.cascade_stats = {
+            "detectors": len(detector_ids),
+            "scored": len(exact),
+            "pruned": int(eligible.sum()) - len(exact),
+        }
+        self._print(f"级联筛选: 共 {len(detector_ids)} 个检测器，精确打分 {len(exact)} 个，"
+                    f"剪枝 {self.cascade_stats['pruned']} 个")
+        return {detector_ids[i]: exact[i] for i in sorted(exact)}
+
+    def online_session(self, detector_ids, rank_every=30):
+        """创建逐步接收线圈读数的流式检测器（例如由 TraCI 仿真循环驱动）"""
+        if not self._model_trained:
+            raise RuntimeError("请先训练或加载模型")
+        return OnlineDetector(self.normal_params, detector_ids, self.phase_length,
+                              self.time_window, self.top_k, self.features, rank_every)
+
+    def detect_anomalies(self, test_file, output_file=None, save_results=True):
+        """检测单个场景文件；save_results 为 False 时不写入 ../data/anomaly_results.json，只写 output_file"""
+        if not self._model_trained:
+            raise RuntimeError("请先训练或加载模型")
+
+        self._print(f"\n开始检测异常: {Path(test_file).name}")
+        if self.scoring_mode == 'loop':
+            test_data = self._parse_xml(test_file)
+            detector_scores = self._score_detectors_loop(test_data)
+            point_counts = {k: len(v['speed']) for k, v in test_data.items()}
+        else:
+            frame = self._parse_frame(test_file)
+            if self.scoring_mode == 'cascade':
+                detector_scores = self._score_detectors_cascade(frame)
+            else:
+                detector_scores = self._score_detectors_array(frame)
+            point_counts = dict(zip(frame.detector_ids, frame.counts().tolist()))
 
         # 筛选有效检测器（至少有5个有效时间点）
         valid_detectors = {
             k: v for k, v in detector_scores.items()
-            if len(test_data[k]['speed']) >= 5
+            if point_counts[k] >= 5
         }
 
         sorted_scores = sorted(valid_detectors.items(),
@@ -219,18 +314,19 @@ class EnhancedTrafficAnomalyDetector:
             self._print(f"Top {rank}: {detector} - 综合异常指数: {score:.2f}")
 
         # 保存结果到上一级目录的data文件夹中
-        result_data = {
-            "top_k_detectors": [
-                {"detector_id": detector, "anomaly_score": score}
-                for detector, score in sorted_scores
-            ]
-        }
-        data_dir = os.path.join(os.path.dirname(os.getcwd()), "data")
-        os.makedirs(data_dir, exist_ok=True)
-        result_file = os.path.join(data_dir, "anomaly_results.json")
-        with open(result_file, 'w') as f:
-            json.dump(result_data, f, indent=2)
-        self._print(f"检测结果已保存至: {result_file}")
+        if save_results:
+            result_data = {
+                "top_k_detectors": [
+                    {"detector_id": detector, "anomaly_score": score}
+                    for detector, score in sorted_scores
+                ]
+            }
+            data_dir = os.path.join(os.path.dirname(os.getcwd()), "data")
+            os.makedirs(data_dir, exist_ok=True)
+            result_file = os.path.join(data_dir, "anomaly_results.json")
+            with open(result_file, 'w') as f:
+                json.dump(result_data, f, indent=2)
+            self._print(f"检测结果已保存至: {result_file}")
 
         if output_file:
             with open(output_file, 'w') as f: